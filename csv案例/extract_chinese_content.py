@@ -5,9 +5,11 @@
 提取所有案例的中文文字信息
 """
 
+import argparse
 import csv
 import json
 import re
+from concurrent.futures import ProcessPoolExecutor
 from typing import Dict, List, Any
 from collections import OrderedDict
 
@@ -107,58 +109,66 @@ def parse_in_param(in_param_json: str) -> Dict[str, str]:
 
 def main():
     """主程序"""
+    parser = argparse.ArgumentParser(description='提取好人坏人挑战CSV中的中文内容')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='并行解析JSON的进程数，默认使用全部CPU核，1表示串行')
+    args = parser.parse_args()
+    
     csv_file = '/Users/edy/Desktop/project/挑战玩法/csv案例/好人坏人挑战数据.csv'
     
     all_cases = []
     
     # 读取CSV文件
     with open(csv_file, 'r', encoding='utf-8') as file:
-        csv_reader = csv.DictReader(file)
+        rows = list(csv.DictReader(file))
+    
+    # content和in_param在进程池中并行解析（--jobs 1时串行），结果与行顺序一致
+    contents = [row['content'] for row in rows]
+    in_params = [row['in_param'] for row in rows]
+    if args.jobs == 1:
+        case_infos = [parse_case_content(content) for content in contents]
+        param_infos = [parse_in_param(in_param) for in_param in in_params]
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            case_infos = list(executor.map(parse_case_content, contents))
+            param_infos = list(executor.map(parse_in_param, in_params))
+    
+    for row_num, (row, case_info, param_info) in enumerate(zip(rows, case_infos, param_infos), 1):
+        pipe_id = row['pipe_id']
         
-        for row_num, row in enumerate(csv_reader, 1):
-            pipe_id = row['pipe_id']
-            content = row['content']
-            in_param = row['in_param']
-            
-            print(f"\n{'='*80}")
-            print(f"案例 {row_num}: {pipe_id}")
-            print(f"{'='*80}")
-            
-            # 解析content中的内容
-            case_info = parse_case_content(content)
-            
-            # 解析in_param中的内容
-            param_info = parse_in_param(in_param)
-            
-            # 合并信息
-            full_case = {
-                '案例ID': pipe_id,
-                '案例编号': row_num,
-                **case_info
-            }
-            
-            # 打印案例信息
-            for key, value in full_case.items():
-                if key == '其他中文内容' and value:
-                    print(f"\n{key}:")
-                    for i, text in enumerate(value, 1):
-                        print(f"  {i}. {text}")
-                elif value and key != '案例ID' and key != '案例编号':
-                    print(f"\n{key}: {value}")
-            
-            # 从in_param中提取额外信息
-            if param_info:
-                print("\n从参数中提取的额外信息:")
-                unique_params = {}
-                for path, text in param_info.items():
-                    # 过滤掉已经在case_info中的内容
-                    if text not in str(case_info.values()):
-                        unique_params[text] = path
-                
-                for text in unique_params:
-                    print(f"  - {text}")
+        print(f"\n{'='*80}")
+        print(f"案例 {row_num}: {pipe_id}")
+        print(f"{'='*80}")
+        
+        # 合并信息
+        full_case = {
+            '案例ID': pipe_id,
+            '案例编号': row_num,
+            **case_info
+        }
+        
+        # 打印案例信息
+        for key, value in full_case.items():
+            if key == '其他中文内容' and value:
+                print(f"\n{key}:")
+                for i, text in enumerate(value, 1):
+                    print(f"  {i}. {text}")
+            elif value and key != '案例ID' and key != '案例编号':
+                print(f"\n{key}: {value}")
+        
+        # 从in_param中提取额外信息
+        if param_info:
+            print("\n从参数中提取的额外信息:")
+            unique_params = {}
+            for path, text in param_info.items():
+                # 过滤掉已经在case_info中的内容
+                if text not in str(case_info.values()):
+                    unique_params[text] = path
             
-            all_cases.append(full_case)
+            for text in unique_params:
+                print(f"  - {text}")
+        
+        all_cases.append(full_case)
     
     # 统计总结
     print(f"\n\n{'='*80}")
@@ -1,70 +1,443 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import pandas as pd
+import argparse
+import csv
+import json
+import shutil
+import sys
+import time
 import os
-from openpyxl import load_workbook
-from openpyxl.styles import Alignment, Font
-from openpyxl.utils.dataframe import dataframe_to_rows
+from concurrent.futures import ProcessPoolExecutor
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font, NamedStyle
+from openpyxl.utils import get_column_letter
 
-def convert_csv_to_excel(csv_file_path, excel_file_path):
+from 角色设定 import SETTINGS_FILENAME, expand_character_rows, load_settings_in
+from 并行解码 import resolve_jobs
+from 轮次扫描 import file_content_hash
+
+try:
+    import resource
+except ImportError:
+    # Windows没有resource模块，不记录峰值内存
+    resource = None
+
+# 对话历史单元格可能远超csv模块默认的字段长度上限；不用sys.maxsize，它在C long为32位的平台上会溢出
+CSV_FIELD_SIZE_LIMIT = 2**31 - 1
+csv.field_size_limit(CSV_FIELD_SIZE_LIMIT)
+
+SHEET_NAME = '评测数据'
+
+# 各列宽度，未列出的列使用DEFAULT_COLUMN_WIDTH
+COLUMN_WIDTHS = {
+    'SESSION_ID': 40,
+    'SEGMENT_INFO': 20,
+    'CHARACTER_SETTING': 80,
+    'DIALOGUE_HISTORY': 100,
+    'ROW_ID': 45,
+    'CONTENT_HASH': 70
+}
+DEFAULT_COLUMN_WIDTH = 50
+
+# 数据行高度，较大的行高以容纳多行文本
+DATA_ROW_HEIGHT = 100
+
+# Excel单元格最多容纳的字符数（按UTF-16计）
+EXCEL_CELL_LIMIT = 32767
+
+# Excel每个工作表的最大行数（含标题行），超过后新建工作表
+EXCEL_MAX_ROWS = 1048576
+
+# 超长单元格的处理方式：sidecar 另存为附件文件、单元格中写引用；columns 拆分到紧随其后的续列
+SPILL_MODES = ('sidecar', 'columns')
+
+# 附件引用的前缀，其后为相对Excel文件所在目录的附件路径
+SIDECAR_MARKER = '[超长内容见附件] '
+
+# 附件目录名后缀，如 合并总评测集_全部轮次对话_超长内容/
+SIDECAR_DIR_SUFFIX = '_超长内容'
+
+# 续列名，如 DIALOGUE_HISTORY_续2
+CONTINUATION_COLUMN = '{}_续{}'
+
+# 转换缓存，记录每个CSV上次成功转换时的内容哈希，放在Excel输出目录中
+CACHE_FILENAME = '.转换缓存.json'
+
+# 转换日志的列及宽度
+LOG_COLUMNS = [
+    ('csv_filename', 50),
+    ('excel_filename', 50),
+    ('csv_size_kb', 15),
+    ('excel_size_kb', 15),
+    ('sheets', 15),
+    ('spilled_cells', 15),
+    ('wall_time_s', 15),
+    ('peak_memory_mb', 15),
+    ('status', 15)
+]
+
+def register_eval_styles(workbook):
+    """
+    注册标题行和数据行的命名样式，所有单元格共享这两个样式
+    
+    Args:
+        workbook: openpyxl工作簿
+    
+    Returns:
+        tuple: (标题样式名, 数据样式名)
+    """
+    alignment = Alignment(horizontal='left', vertical='top', wrap_text=True)
+    header_style = NamedStyle(name='评测标题', font=Font(bold=True, size=12), alignment=alignment)
+    body_style = NamedStyle(name='评测数据', font=Font(size=10), alignment=alignment)
+    workbook.add_named_style(header_style)
+    workbook.add_named_style(body_style)
+    return header_style.name, body_style.name
+
+def make_cell(worksheet, value, style):
+    """创建只写模式的单元格，空字符串写为空单元格"""
+    cell = WriteOnlyCell(worksheet, value if value != '' else None)
+    cell.style = style
+    return cell
+
+def utf16_length(text):
+    """Excel按UTF-16计算的字符数"""
+    return len(text.encode('utf-16-le')) // 2
+
+def fits_in_cell(text, limit=EXCEL_CELL_LIMIT):
+    """判断文本能否放进一个Excel单元格"""
+    if len(text) > limit:
+        return False
+    # UTF-16长度不超过字符数的2倍，短文本无需编码
+    return len(text) * 2 <= limit or utf16_length(text) <= limit
+
+def split_for_cells(text, limit=EXCEL_CELL_LIMIT):
+    """
+    按Excel单元格上限切分文本，不拆开UTF-16代理对
+    
+    Args:
+        text: 文本
+        limit: 每段的UTF-16字符数上限
+    
+    Returns:
+        list: 切分后的文本
+    """
+    if utf16_length(text) == len(text):
+        return [text[i:i + limit] for i in range(0, len(text), limit)] or ['']
+    
+    pieces = []
+    start = 0
+    units = 0
+    for i, char in enumerate(text):
+        width = 2 if ord(char) > 0xFFFF else 1
+        if units + width > limit:
+            pieces.append(text[start:i])
+            start = i
+            units = 0
+        units += width
+    pieces.append(text[start:])
+    return pieces
+
+def count_cell_pieces(csv_file_path, settings=None):
+    """
+    预扫描CSV，统计每列最多需要拆成几个单元格（columns模式需先确定表头）
+    
+    Args:
+        csv_file_path: CSV文件路径
+        settings: 角色设定表
+    
+    Returns:
+        list: 每列的单元格数，CSV为空时返回空列表
+    """
+    with open(csv_file_path, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return []
+        
+        header, rows = expand_character_rows(header, reader, settings)
+        pieces = [1] * len(header)
+        for row in rows:
+            for i, value in enumerate(row):
+                if not fits_in_cell(value):
+                    pieces[i] = max(pieces[i], len(split_for_cells(value)))
+    
+    return pieces
+
+def resolve_spilled_value(value, excel_dir):
+    """
+    还原附件引用的单元格内容
+    
+    Args:
+        value: 单元格的值
+        excel_dir: Excel文件所在目录
+    
+    Returns:
+        单元格原本的完整内容；不是附件引用时原样返回
+    """
+    if not isinstance(value, str) or not value.startswith(SIDECAR_MARKER):
+        return value
+    with open(os.path.join(excel_dir, value[len(SIDECAR_MARKER):]), 'r', encoding='utf-8') as f:
+        return f.read()
+
+class EvalWorkbookWriter:
+    """
+    只写模式的评测集工作簿，所有单元格共享命名样式，超过行数上限时自动新建工作表并重复表头
+    """
+    
+    def __init__(self, header, widths, max_rows=EXCEL_MAX_ROWS):
+        """
+        Args:
+            header: 列名列表
+            widths: 各列宽度
+            max_rows: 每个工作表的最大行数（含标题行）
+        """
+        self.workbook = Workbook(write_only=True)
+        self.header_style, self.body_style = register_eval_styles(self.workbook)
+        self.header = header
+        self.widths = widths
+        self.max_rows = max_rows
+        self.sheet_names = []
+        self._new_sheet()
+    
+    def _new_sheet(self):
+        name = SHEET_NAME if not self.sheet_names else f"{SHEET_NAME}_{len(self.sheet_names) + 1}"
+        self.sheet_names.append(name)
+        self.worksheet = self.workbook.create_sheet(name)
+        
+        # 设置列宽（只写模式下需要在写入数据前设置）
+        for col_num, width in enumerate(self.widths, 1):
+            self.worksheet.column_dimensions[get_column_letter(col_num)].width = width
+        
+        self.worksheet.append([make_cell(self.worksheet, value, self.header_style) for value in self.header])
+        self.row_num = 1
+    
+    def append(self, row):
+        """写入一行数据"""
+        if self.row_num >= self.max_rows:
+            self._new_sheet()
+        self.row_num += 1
+        
+        # 行高需在写入该行前设置，写入后即可丢弃
+        self.worksheet.row_dimensions[self.row_num].height = DATA_ROW_HEIGHT
+        self.worksheet.append([make_cell(self.worksheet, value, self.body_style) for value in row])
+        self.worksheet.row_dimensions.pop(self.row_num, None)
+    
+    def save(self, excel_file_path):
+        self.workbook.save(excel_file_path)
+
+def read_eval_workbook(excel_file_path):
+    """
+    以只读模式逐行读取评测集工作簿，内存占用与行数无关
+    第一个工作表之后表头相同的工作表（行数超限时拆分出的续表）会接着读取
+    
+    Args:
+        excel_file_path: Excel文件路径
+    
+    Returns:
+        generator: 先产出列名列表，之后逐行产出与列名等长的值列表（空单元格为空字符串）；
+                   关闭生成器时关闭工作簿
+    """
+    workbook = load_workbook(excel_file_path, read_only=True, data_only=True)
+    try:
+        header = None
+        for worksheet in workbook.worksheets:
+            # 部分工具写出的dimension不准确，按实际内容读取
+            worksheet.reset_dimensions()
+            values = worksheet.iter_rows(values_only=True)
+            sheet_header = [str(value) if value is not None else '' for value in next(values, None) or ()]
+            if header is None:
+                header = sheet_header
+                yield header
+            elif sheet_header != header:
+                continue
+            
+            for row in values:
+                if row is None or all(value is None for value in row):
+                    continue
+                row = ['' if value is None else value for value in row[:len(header)]]
+                yield row + [''] * (len(header) - len(row))
+        
+        if header is None:
+            yield []
+    finally:
+        workbook.close()
+
+def convert_csv_to_excel(csv_file_path, excel_file_path, settings=None, spill='sidecar'):
     """
     将CSV文件转换为Excel文件，并设置格式
+    使用openpyxl只写模式逐行读写，内存占用与行数无关；
+    超过单元格上限的内容按spill方式处理，超过行数上限时自动拆分工作表
     
     Args:
         csv_file_path: CSV文件路径
         excel_file_path: Excel文件输出路径
+        settings: 角色设定表，CSV只含CHARACTER_ID时用于展开为CHARACTER_SETTING全文
+        spill: 超长单元格的处理方式，见SPILL_MODES
+    
+    Returns:
+        dict: rows（数据行数）、sheets（工作表数）、spilled_cells（超长单元格数）
     """
-    # 读取CSV文件
-    df = pd.read_csv(csv_file_path, encoding='utf-8')
-    
-    # 保存为Excel文件
-    with pd.ExcelWriter(excel_file_path, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='评测数据')
-        
-        # 获取工作簿和工作表
-        workbook = writer.book
-        worksheet = writer.sheets['评测数据']
-        
-        # 设置列宽
-        if 'CHARACTER_SETTING' in df.columns:
-            worksheet.column_dimensions['A'].width = 80  # CHARACTER_SETTING列
-            if 'DIALOGUE_HISTORY' in df.columns:
-                worksheet.column_dimensions['B'].width = 100  # DIALOGUE_HISTORY列
-        elif 'SESSION_ID' in df.columns:
-            # 合并CSV的格式
-            worksheet.column_dimensions['A'].width = 40  # SESSION_ID列
-            worksheet.column_dimensions['B'].width = 20  # SEGMENT_INFO列
-            worksheet.column_dimensions['C'].width = 80  # CHARACTER_SETTING列
-            worksheet.column_dimensions['D'].width = 100  # DIALOGUE_HISTORY列
-        
-        # 设置单元格格式
-        for row in worksheet.iter_rows():
-            for cell in row:
-                # 设置文本对齐方式
-                cell.alignment = Alignment(
-                    horizontal='left',
-                    vertical='top',
-                    wrap_text=True
-                )
-                
-                # 设置字体
-                if cell.row == 1:  # 标题行
-                    cell.font = Font(bold=True, size=12)
-                else:
-                    cell.font = Font(size=10)
+    if spill not in SPILL_MODES:
+        raise ValueError(f"未知的超长单元格处理方式: {spill}")
+    
+    # columns模式需要先知道每列拆成几列才能写表头
+    pieces = count_cell_pieces(csv_file_path, settings) if spill == 'columns' else None
+    
+    # 附件目录，清理上次转换留下的附件
+    excel_dir = os.path.dirname(excel_file_path)
+    sidecar_name = os.path.splitext(os.path.basename(excel_file_path))[0] + SIDECAR_DIR_SUFFIX
+    sidecar_dir = os.path.join(excel_dir, sidecar_name)
+    if os.path.isdir(sidecar_dir):
+        shutil.rmtree(sidecar_dir)
+    
+    stats = {'rows': 0, 'sheets': 1, 'spilled_cells': 0}
+    
+    with open(csv_file_path, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            Workbook(write_only=True).save(excel_file_path)
+            return stats
+        
+        # Excel用于评测，需要角色设定全文
+        header, rows = expand_character_rows(header, reader, settings)
         
-        # 设置行高
-        for row_num in range(2, len(df) + 2):  # 从第2行开始（跳过标题行）
-            worksheet.row_dimensions[row_num].height = 100  # 设置较大的行高以容纳多行文本
+        widths = [COLUMN_WIDTHS.get(column, DEFAULT_COLUMN_WIDTH) for column in header]
+        if pieces:
+            # 续列紧跟在原列之后，宽度与原列相同
+            header, widths = (
+                [name for column, count in zip(header, pieces)
+                 for name in [column] + [CONTINUATION_COLUMN.format(column, k) for k in range(2, count + 1)]],
+                [width for width, count in zip(widths, pieces) for _ in range(count)]
+            )
+        
+        writer = EvalWorkbookWriter(header, widths)
+        
+        for data_row, row in enumerate(rows, 1):
+            if pieces:
+                cells = []
+                for value, count in zip(row, pieces):
+                    parts = split_for_cells(value) if not fits_in_cell(value) else [value]
+                    if len(parts) > 1:
+                        stats['spilled_cells'] += 1
+                    cells.extend(parts + [None] * (count - len(parts)))
+                row = cells
+            else:
+                for i, value in enumerate(row):
+                    if fits_in_cell(value):
+                        continue
+                    # 另存为附件，单元格中写引用
+                    os.makedirs(sidecar_dir, exist_ok=True)
+                    sidecar_file = f"第{data_row}行_{header[i]}.txt"
+                    with open(os.path.join(sidecar_dir, sidecar_file), 'w', encoding='utf-8') as sidecar:
+                        sidecar.write(value)
+                    row[i] = f"{SIDECAR_MARKER}{sidecar_name}/{sidecar_file}"
+                    stats['spilled_cells'] += 1
+            
+            writer.append(row)
+            stats['rows'] += 1
+    
+    writer.save(excel_file_path)
+    stats['sheets'] = len(writer.sheet_names)
+    return stats
+
+def peak_memory_mb():
+    """当前进程的峰值常驻内存（MB），无法获取时返回None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS的单位为字节，Linux为KB
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def convert_file_task(task):
+    """
+    转换单个文件（在独立子进程中执行，峰值内存即该文件的转换开销）
+    
+    Args:
+        task: (csv_file_path, excel_file_path, settings, spill)
+    
+    Returns:
+        dict: convert_csv_to_excel的统计信息，另含wall_time_s、peak_memory_mb、status
+    """
+    csv_file_path, excel_file_path, settings, spill = task
+    start_time = time.perf_counter()
+    
+    try:
+        result = convert_csv_to_excel(csv_file_path, excel_file_path, settings, spill)
+        result['status'] = 'success'
+    except Exception as e:
+        result = {'rows': 0, 'sheets': 0, 'spilled_cells': 0, 'status': f'error: {str(e)}'}
+    
+    result['wall_time_s'] = round(time.perf_counter() - start_time, 3)
+    result['peak_memory_mb'] = peak_memory_mb()
+    return result
+
+def load_conversion_cache(excel_dir):
+    """读取转换缓存，不存在或损坏时返回空字典"""
+    cache_path = os.path.join(excel_dir, CACHE_FILENAME)
+    if not os.path.exists(cache_path):
+        return {}
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, OSError):
+        return {}
 
-def convert_all_csv_to_excel(csv_dir, excel_dir):
+def save_conversion_cache(excel_dir, cache):
+    """写出转换缓存"""
+    cache_path = os.path.join(excel_dir, CACHE_FILENAME)
+    temp_path = cache_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, cache_path)
+
+def write_conversion_log(conversion_log, log_file_path):
+    """
+    用openpyxl只写模式写出转换日志
+    
+    Args:
+        conversion_log: 转换日志列表
+        log_file_path: 日志文件路径
+    """
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet('转换日志')
+    
+    # 设置列宽
+    for col_num, (_, width) in enumerate(LOG_COLUMNS, 1):
+        worksheet.column_dimensions[get_column_letter(col_num)].width = width
+    
+    # 标题行格式
+    header_font = Font(bold=True)
+    header_alignment = Alignment(horizontal='center')
+    header = []
+    for column, _ in LOG_COLUMNS:
+        cell = WriteOnlyCell(worksheet, column)
+        cell.font = header_font
+        cell.alignment = header_alignment
+        header.append(cell)
+    worksheet.append(header)
+    
+    for log in conversion_log:
+        worksheet.append([log.get(column) for column, _ in LOG_COLUMNS])
+    
+    workbook.save(log_file_path)
+
+def convert_all_csv_to_excel(csv_dir, excel_dir, spill='sidecar', jobs=None, force=False):
     """
     将目录中的所有CSV文件转换为Excel文件
+    各文件在进程池中并行转换；CSV内容、角色设定表和spill方式都未变化且Excel仍存在时跳过
     
     Args:
         csv_dir: CSV文件目录
         excel_dir: Excel文件输出目录
+        spill: 超长单元格的处理方式，见SPILL_MODES
+        jobs: 并行进程数，None时使用全部CPU核，1表示同时只转换一个文件
+        force: 是否忽略缓存全部重新转换
+    
+    Returns:
+        list: 转换日志，每个CSV文件一项
     """
     print(f"正在处理CSV目录: {csv_dir}")
     print(f"Excel输出目录: {excel_dir}")
@@ -73,11 +446,20 @@ def convert_all_csv_to_excel(csv_dir, excel_dir):
     os.makedirs(excel_dir, exist_ok=True)
     
     # 获取所有CSV文件
-    csv_files = [f for f in os.listdir(csv_dir) if f.endswith('.csv')]
+    csv_files = sorted(f for f in os.listdir(csv_dir) if f.endswith('.csv'))
     
     print(f"找到 {len(csv_files)} 个CSV文件")
     
+    # 评测集生成脚本写出的角色设定表，变化后需要重新展开
+    settings = load_settings_in(csv_dir)
+    settings_path = os.path.join(csv_dir, SETTINGS_FILENAME)
+    settings_hash = file_content_hash(settings_path) if os.path.exists(settings_path) else None
+    
+    cache = {} if force else load_conversion_cache(excel_dir)
+    
     conversion_log = []
+    tasks = []
+    pending = []
     
     for csv_filename in csv_files:
         csv_file_path = os.path.join(csv_dir, csv_filename)
@@ -86,75 +468,106 @@ def convert_all_csv_to_excel(csv_dir, excel_dir):
         excel_filename = csv_filename.replace('.csv', '.xlsx')
         excel_file_path = os.path.join(excel_dir, excel_filename)
         
-        try:
-            print(f"转换: {csv_filename} -> {excel_filename}")
-            convert_csv_to_excel(csv_file_path, excel_file_path)
-            
-            # 获取文件大小信息
-            csv_size = os.path.getsize(csv_file_path)
-            excel_size = os.path.getsize(excel_file_path)
-            
-            conversion_log.append({
-                'csv_filename': csv_filename,
-                'excel_filename': excel_filename,
-                'csv_size_kb': round(csv_size / 1024, 2),
-                'excel_size_kb': round(excel_size / 1024, 2),
-                'status': 'success'
+        fingerprint = {
+            'csv_sha256': file_content_hash(csv_file_path),
+            'settings_sha256': settings_hash,
+            'spill': spill
+        }
+        
+        log = {
+            'csv_filename': csv_filename,
+            'excel_filename': excel_filename,
+            'csv_size_kb': round(os.path.getsize(csv_file_path) / 1024, 2)
+        }
+        conversion_log.append(log)
+        
+        cached = cache.get(csv_filename, {})
+        if all(cached.get(key) == value for key, value in fingerprint.items()) and os.path.exists(excel_file_path):
+            log.update({
+                'excel_size_kb': round(os.path.getsize(excel_file_path) / 1024, 2),
+                'sheets': cached.get('sheets'),
+                'spilled_cells': cached.get('spilled_cells'),
+                'wall_time_s': 0,
+                'status': 'unchanged'
             })
+            continue
+        
+        tasks.append((csv_file_path, excel_file_path, settings, spill))
+        pending.append((log, fingerprint))
+    
+    print(f"需要转换 {len(tasks)} 个文件，跳过未变化的 {len(csv_files) - len(tasks)} 个")
+    
+    if tasks:
+        jobs = min(resolve_jobs(jobs), len(tasks))
+        # 每个子进程只转换一个文件，峰值内存按文件统计
+        with ProcessPoolExecutor(max_workers=jobs, max_tasks_per_child=1) as executor:
+            results = executor.map(convert_file_task, tasks)
             
-        except Exception as e:
-            print(f"转换文件 {csv_filename} 时出错: {str(e)}")
-            conversion_log.append({
-                'csv_filename': csv_filename,
-                'excel_filename': excel_filename,
-                'csv_size_kb': 0,
-                'excel_size_kb': 0,
-                'status': f'error: {str(e)}'
-            })
+            for (log, fingerprint), result in zip(pending, results):
+                log.update({
+                    'sheets': result['sheets'],
+                    'spilled_cells': result['spilled_cells'],
+                    'wall_time_s': result['wall_time_s'],
+                    'peak_memory_mb': result['peak_memory_mb'],
+                    'status': result['status']
+                })
+                
+                if result['status'] == 'success':
+                    excel_file_path = os.path.join(excel_dir, log['excel_filename'])
+                    log['excel_size_kb'] = round(os.path.getsize(excel_file_path) / 1024, 2)
+                    cache[log['csv_filename']] = {
+                        **fingerprint,
+                        'sheets': result['sheets'],
+                        'spilled_cells': result['spilled_cells']
+                    }
+                    print(f"转换: {log['csv_filename']} -> {log['excel_filename']} "
+                          f"({result['wall_time_s']:.2f}s, 峰值内存 {result['peak_memory_mb']} MB)")
+                    if result['spilled_cells'] or result['sheets'] > 1:
+                        print(f"  超长单元格: {result['spilled_cells']} 个, 工作表: {result['sheets']} 个")
+                else:
+                    log['excel_size_kb'] = 0
+                    cache.pop(log['csv_filename'], None)
+                    print(f"转换文件 {log['csv_filename']} 时出错: {result['status']}")
+    
+    # 只保留目录中仍存在的CSV
+    save_conversion_cache(excel_dir, {name: entry for name, entry in cache.items() if name in csv_files})
     
     # 保存转换日志
-    log_df = pd.DataFrame(conversion_log)
     log_file_path = os.path.join(excel_dir, "CSV转Excel日志.xlsx")
-    
-    with pd.ExcelWriter(log_file_path, engine='openpyxl') as writer:
-        log_df.to_excel(writer, index=False, sheet_name='转换日志')
-        
-        # 设置日志表格格式
-        workbook = writer.book
-        worksheet = writer.sheets['转换日志']
-        
-        # 设置列宽
-        for col_num, column in enumerate(log_df.columns, 1):
-            column_letter = chr(64 + col_num)  # A, B, C, D, E
-            if column == 'csv_filename' or column == 'excel_filename':
-                worksheet.column_dimensions[column_letter].width = 50
-            else:
-                worksheet.column_dimensions[column_letter].width = 15
-        
-        # 设置标题行格式
-        for cell in worksheet[1]:
-            cell.font = Font(bold=True)
-            cell.alignment = Alignment(horizontal='center')
+    write_conversion_log(conversion_log, log_file_path)
     
     print(f"\n=== CSV转Excel完成 ===")
     print(f"成功转换: {len([log for log in conversion_log if log['status'] == 'success'])} 个文件")
-    print(f"转换失败: {len([log for log in conversion_log if log['status'] != 'success'])} 个文件")
+    print(f"未变化跳过: {len([log for log in conversion_log if log['status'] == 'unchanged'])} 个文件")
+    print(f"转换失败: {len([log for log in conversion_log if log['status'].startswith('error')])} 个文件")
     print(f"转换日志保存在: {log_file_path}")
     
     return conversion_log
 
 def main():
     """主函数"""
-    csv_dir = "/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/评测集CSV"
-    excel_dir = "/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/评测集Excel"
+    parser = argparse.ArgumentParser(description='将评测集CSV转换为Excel')
+    parser.add_argument('--csv-dir', default="/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/评测集CSV",
+                        help='CSV文件目录')
+    parser.add_argument('--excel-dir', default="/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/评测集Excel",
+                        help='Excel文件输出目录')
+    parser.add_argument('--spill', choices=SPILL_MODES, default='sidecar',
+                        help='超过Excel单元格上限(32767字符)的内容：sidecar另存为附件文件，columns拆分到续列')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='并行转换的进程数，默认使用全部CPU核')
+    parser.add_argument('--force', action='store_true',
+                        help='忽略转换缓存，全部重新转换')
+    args = parser.parse_args()
+    
+    excel_dir = args.excel_dir
     
     try:
-        conversion_log = convert_all_csv_to_excel(csv_dir, excel_dir)
+        conversion_log = convert_all_csv_to_excel(args.csv_dir, excel_dir, args.spill, args.jobs, args.force)
         
         print(f"\n=== 转换统计 ===")
         
-        # 统计成功转换的文件
-        successful_conversions = [log for log in conversion_log if log['status'] == 'success']
+        # 统计已是最新的文件（本次转换或未变化跳过）
+        successful_conversions = [log for log in conversion_log if log['status'] in ('success', 'unchanged')]
         
         if successful_conversions:
             total_csv_size = sum(log['csv_size_kb'] for log in successful_conversions)
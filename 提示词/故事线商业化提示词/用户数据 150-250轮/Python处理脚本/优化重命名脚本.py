@@ -5,41 +5,16 @@ import json
 import os
 import shutil
 
-def count_dialog_rounds(conversation):
-    """
-    计算对话轮次数
-    一轮 = 一个user消息 + 一个assistant消息的配对
-    
-    Args:
-        conversation: 包含role和content的对话列表
-    
-    Returns:
-        int: 对话轮次数
-    """
-    if not conversation:
-        return 0
-    
-    user_count = 0
-    assistant_count = 0
-    
-    for msg in conversation:
-        if msg.get('role') == 'user':
-            user_count += 1
-        elif msg.get('role') == 'assistant':
-            assistant_count += 1
-    
-    # 一轮对话需要一个user和一个assistant消息
-    # 取较小值作为完整轮次数
-    rounds = min(user_count, assistant_count)
-    
-    return rounds
+from 会话目录 import SessionCatalog
+from 轮次扫描 import RoundScanCache
 
-def rename_with_rounds_first(input_dir):
+def rename_with_rounds_first(input_dir, catalog=None):
     """
     重命名对话文件，将轮次信息放在文件名开头
     
     Args:
         input_dir: 包含对话文件的目录
+        catalog: 会话目录，不为None时按文件路径查找session_id，并同步登记新的文件路径和轮次
     """
     print(f"正在处理目录: {input_dir}")
     
@@ -54,6 +29,9 @@ def rename_with_rounds_first(input_dir):
     
     rename_log = []
     
+    # 轮次和消息数通过扫描获得，并按文件缓存
+    scan_cache = RoundScanCache(input_dir)
+    
     for filename in json_files:
         if filename == 'all_conversations.json' or filename == '重命名日志.json':
             continue  # 跳过汇总文件和日志文件
@@ -61,16 +39,16 @@ def rename_with_rounds_first(input_dir):
         filepath = os.path.join(input_dir, filename)
         
         try:
-            # 读取对话文件
-            with open(filepath, 'r', encoding='utf-8') as f:
-                conversation = json.load(f)
+            # 扫描对话文件得到轮次（按大小和修改时间缓存）
+            scan = scan_cache.get(filepath)
+            rounds = scan['rounds']
+            total_messages = scan['total_messages']
             
-            # 计算轮次
-            rounds = count_dialog_rounds(conversation)
-            total_messages = len(conversation)
-            
-            # 提取session_id
-            if filename.startswith('session_'):
+            # 提取session_id，优先使用会话目录中登记的值
+            catalog_entry = catalog.find_by_path(filepath) if catalog is not None else None
+            if catalog_entry:
+                session_id = catalog_entry['session_id']
+            elif filename.startswith('session_'):
                 # 从原始文件名或已重命名文件中提取session_id
                 session_id = filename.split('_')[1]
                 if '_' in session_id:
@@ -83,13 +61,21 @@ def rename_with_rounds_first(input_dir):
             new_filename = f"{rounds:03d}轮对话_共{total_messages}条消息_session{session_id}.json"
             new_filepath = os.path.join(input_dir, new_filename)
             
-            # 如果新文件名与旧文件名相同，跳过
+            # 如果新文件名与旧文件名相同，跳过（仍登记到会话目录）
             if filename == new_filename:
                 print(f"跳过: {filename} (已是最新格式)")
+                if catalog is not None:
+                    catalog.upsert_session(session_id, rounds=rounds, messages=total_messages,
+                                           file_path=filepath, content_hash=scan.get('sha256'))
                 continue
             
             # 重命名文件
             shutil.move(filepath, new_filepath)
+            scan_cache.rename(filename, new_filename)
+            
+            if catalog is not None:
+                catalog.upsert_session(session_id, rounds=rounds, messages=total_messages,
+                                       file_path=new_filepath, content_hash=scan.get('sha256'))
             
             log_entry = {
                 'session_id': session_id,
@@ -106,6 +92,8 @@ def rename_with_rounds_first(input_dir):
         except Exception as e:
             print(f"处理文件 {filename} 时出错: {str(e)}")
     
+    scan_cache.save()
+    
     if rename_log:
         # 保存重命名日志
         log_filepath = os.path.join(input_dir, "重命名日志_优化版.json")
@@ -136,9 +124,11 @@ def rename_with_rounds_first(input_dir):
 def main():
     """主函数"""
     input_dir = "/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/切分后的对话"
+    catalog_path = "/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/会话目录.sqlite"
     
     try:
-        rename_with_rounds_first(input_dir)
+        with SessionCatalog(catalog_path) as catalog:
+            rename_with_rounds_first(input_dir, catalog)
         
         print(f"\n=== 查看最终结果 ===")
         # 显示重命名后的文件列表（按轮次排序）
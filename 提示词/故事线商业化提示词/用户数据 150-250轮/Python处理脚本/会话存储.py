@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+JSONL会话存储
+每行保存一个session，旁边的SQLite索引为每个session保存一条记录：行的字节偏移和长度、
+消息数，以及该session每条消息的字节偏移和每轮结束的消息下标（二进制数组）。
+读取单个session只查询它自己的那条记录，再直接定位到session或其中任意轮次范围，
+不需要解析整个文件或整个索引
+"""
+
+import json
+import mmap
+import os
+import sqlite3
+import struct
+
+import numpy as np
+
+# 索引文件后缀，如 all_conversations.jsonl.index.sqlite
+INDEX_SUFFIX = '.index.sqlite'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    message_count INTEGER NOT NULL,
+    message_offsets BLOB NOT NULL,
+    round_ends BLOB NOT NULL
+);
+"""
+
+# 角色编码
+ROLE_USER = 1
+ROLE_ASSISTANT = 2
+ROLE_CODES = {'user': ROLE_USER, 'assistant': ROLE_ASSISTANT}
+
+def encode_roles(conversation):
+    """
+    将消息角色编码为整数数组（user=1，assistant=2，其他=0）
+    
+    Args:
+        conversation: 包含role和content的对话列表
+    
+    Returns:
+        numpy.ndarray: 角色编码
+    """
+    return np.fromiter((ROLE_CODES.get(msg.get('role'), 0) for msg in conversation),
+                       dtype=np.int8, count=len(conversation))
+
+def compute_round_ends(roles):
+    """
+    计算每一轮结束后的消息下标：user消息紧跟assistant消息算一轮
+    
+    Args:
+        roles: encode_roles得到的角色编码
+    
+    Returns:
+        numpy.ndarray: 第k轮（从0开始）结束后的消息下标
+    """
+    if len(roles) < 2:
+        return np.empty(0, dtype=np.int64)
+    return np.flatnonzero((roles[:-1] == ROLE_USER) & (roles[1:] == ROLE_ASSISTANT)) + 2
+
+def pack_array(values, code):
+    """把整数列表打包为小端二进制数组，code为struct格式字符（Q或I）"""
+    return struct.pack(f'<{len(values)}{code}', *values)
+
+def unpack_array(data, code):
+    """pack_array的逆操作"""
+    return struct.unpack(f'<{len(data) // struct.calcsize(code)}{code}', data)
+
+class SessionStoreWriter:
+    """
+    追加写入JSONL会话存储
+    每个session写完即落盘，索引记录逐条写入SQLite，追加时不需要读入已有索引；close时提交
+    """
+    
+    def __init__(self, store_path, overwrite=False):
+        """
+        Args:
+            store_path: JSONL存储文件路径
+            overwrite: 是否清空已有存储重新写入，默认在末尾追加
+        """
+        self.store_path = store_path
+        self.index_path = store_path + INDEX_SUFFIX
+        
+        directory = os.path.dirname(store_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if overwrite and os.path.exists(self.index_path):
+            os.remove(self.index_path)
+        
+        self.conn = sqlite3.connect(self.index_path)
+        self.conn.executescript(SCHEMA)
+        self._seq = self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM sessions").fetchone()[0]
+        self._file = open(store_path, 'wb' if overwrite else 'ab')
+    
+    def write_session(self, session_id, conversation):
+        """
+        追加一个session；同一session重复写入时以最后一次为准
+        
+        Args:
+            session_id: session标识
+            conversation: 包含role和content的对话列表
+        """
+        session_id = str(session_id)
+        prefix = ('{"session_id": ' + json.dumps(session_id, ensure_ascii=False) + ', "messages": [').encode('utf-8')
+        
+        encoded_messages = []
+        # 每条消息在行内的起始偏移，最后一项是消息数组的结束位置
+        message_offsets = []
+        position = len(prefix)
+        for msg in conversation:
+            data = json.dumps(msg, ensure_ascii=False).encode('utf-8')
+            if encoded_messages:
+                position += 1  # 分隔的逗号
+            message_offsets.append(position)
+            encoded_messages.append(data)
+            position += len(data)
+        message_offsets.append(position)
+        
+        line = prefix + b','.join(encoded_messages) + b']}\n'
+        offset = self._file.tell()
+        self._file.write(line)
+        
+        self._seq += 1
+        self.conn.execute(
+            "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (session_id, self._seq, offset, len(line) - 1, len(conversation),
+             pack_array(message_offsets, 'Q'), pack_array(compute_round_ends(encode_roles(conversation)).tolist(), 'I'))
+        )
+    
+    def close(self):
+        """关闭存储文件并提交索引"""
+        self._file.close()
+        self.conn.commit()
+        self.conn.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class SessionStoreReader:
+    """
+    按索引随机读取JSONL会话存储，通过mmap直接定位到session或轮次范围
+    """
+    
+    def __init__(self, store_path):
+        self.store_path = store_path
+        index_path = store_path + INDEX_SUFFIX
+        # 索引文件不存在时视为空存储
+        self.conn = sqlite3.connect(index_path) if os.path.exists(index_path) else None
+        self._file = open(store_path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(store_path) else b''
+    
+    def session_ids(self):
+        """返回存储中的所有session_id（按写入顺序）"""
+        if self.conn is None:
+            return []
+        return [row[0] for row in self.conn.execute("SELECT session_id FROM sessions ORDER BY seq")]
+    
+    def _entry(self, session_id):
+        session_id = str(session_id)
+        row = None
+        if self.conn is not None:
+            row = self.conn.execute(
+                "SELECT offset, length, message_count, message_offsets, round_ends FROM sessions WHERE session_id = ?",
+                (session_id,)
+            ).fetchone()
+        if row is None:
+            raise KeyError(f"会话存储中不存在session {session_id}")
+        
+        offset, length, message_count, message_offsets, round_ends = row
+        return {
+            'offset': offset,
+            'length': length,
+            'message_count': message_count,
+            'message_offsets': unpack_array(message_offsets, 'Q'),
+            'round_ends': unpack_array(round_ends, 'I')
+        }
+    
+    def read_session(self, session_id):
+        """
+        读取单个session的完整对话
+        
+        Args:
+            session_id: session标识
+        
+        Returns:
+            list: 包含role和content的对话列表
+        """
+        entry = self._entry(session_id)
+        data = self._map[entry['offset']:entry['offset'] + entry['length']]
+        return json.loads(data)['messages']
+    
+    def read_messages(self, session_id, start, stop):
+        """
+        只解析指定消息范围 [start, stop)
+        
+        Args:
+            session_id: session标识
+            start: 起始消息下标
+            stop: 结束消息下标（不含）
+        
+        Returns:
+            list: 对话列表片段
+        """
+        return self._read_range(self._entry(session_id), start, stop)
+    
+    def _read_range(self, entry, start, stop):
+        """按已查到的索引项解析消息范围 [start, stop)"""
+        message_offsets = entry['message_offsets']
+        message_count = entry['message_count']
+        stop = min(stop, message_count)
+        if start >= stop:
+            return []
+        
+        byte_start = entry['offset'] + message_offsets[start]
+        byte_stop = entry['offset'] + message_offsets[stop]
+        if stop < message_count:
+            byte_stop -= 1  # 去掉分隔的逗号
+        
+        return json.loads(b'[' + self._map[byte_start:byte_stop] + b']')
+    
+    def read_rounds(self, session_id, start_round, end_round):
+        """
+        读取第start_round到第end_round轮（均包含，从1开始）的对话
+        
+        Args:
+            session_id: session标识
+            start_round: 起始轮次
+            end_round: 结束轮次，超过总轮次时截断到最后一轮
+        
+        Returns:
+            list: 对话列表片段
+        """
+        entry = self._entry(session_id)
+        round_ends = entry['round_ends']
+        if start_round < 1 or start_round > end_round:
+            raise ValueError(f"无效的轮次范围: {start_round}-{end_round}")
+        if start_round > len(round_ends):
+            return []
+        
+        start = round_ends[start_round - 2] if start_round > 1 else 0
+        stop = round_ends[min(end_round, len(round_ends)) - 1]
+        return self._read_range(entry, start, stop)
+    
+    def close(self):
+        """关闭存储文件和索引"""
+        if self._map:
+            self._map.close()
+        self._file.close()
+        if self.conn is not None:
+            self.conn.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
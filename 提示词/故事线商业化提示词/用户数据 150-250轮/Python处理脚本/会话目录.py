@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+会话目录（SQLite）
+记录每个session的轮次、消息数、字数/token数、文件路径、内容哈希和分段信息，
+供切分、重命名、分段、评测集生成和标识列补充等脚本共用，替代从文件名解析元数据
+"""
+
+import math
+import os
+import re
+import sqlite3
+from datetime import datetime
+
+# 默认的目录数据库文件名
+CATALOG_FILENAME = '会话目录.sqlite'
+
+# 中日韩统一表意文字，每个字大致对应一个token
+CJK_PATTERN = re.compile(r'[\u4e00-\u9fff\u3400-\u4dbf\uf900-\ufaff]')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    rounds INTEGER,
+    messages INTEGER,
+    chars INTEGER,
+    tokens INTEGER,
+    file_path TEXT,
+    content_hash TEXT,
+    segment_dir TEXT,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_rounds ON sessions (rounds);
+CREATE INDEX IF NOT EXISTS idx_sessions_file_path ON sessions (file_path);
+CREATE TABLE IF NOT EXISTS session_files (
+    session_id TEXT NOT NULL,
+    directory TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    rounds INTEGER,
+    messages INTEGER,
+    updated_at TEXT,
+    PRIMARY KEY (session_id, directory)
+);
+CREATE INDEX IF NOT EXISTS idx_session_files_path ON session_files (file_path);
+CREATE TABLE IF NOT EXISTS segments (
+    session_id TEXT NOT NULL,
+    segment_index INTEGER NOT NULL,
+    start_round INTEGER,
+    end_round INTEGER,
+    messages_count INTEGER,
+    filename TEXT,
+    PRIMARY KEY (session_id, segment_index)
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    name TEXT PRIMARY KEY,
+    path TEXT,
+    updated_at TEXT
+);
+"""
+
+# artifacts表中合并评测集CSV的名称，评测集生成脚本登记、添加标识列脚本查询
+MERGED_CSV_ARTIFACT = 'merged_eval_csv'
+
+# upsert时可更新的字段；传入None的字段保留原值
+SESSION_FIELDS = ['rounds', 'messages', 'chars', 'tokens', 'file_path', 'content_hash', 'segment_dir']
+
+def estimate_tokens(text):
+    """
+    粗略估算文本的token数：中文按每字1个token，其余字符按每4个字符1个token
+    
+    Args:
+        text: 文本
+    
+    Returns:
+        int: 估算的token数
+    """
+    if not text:
+        return 0
+    cjk_count = len(CJK_PATTERN.findall(text))
+    return cjk_count + math.ceil((len(text) - cjk_count) / 4)
+
+def conversation_stats(conversation):
+    """
+    统计对话的轮次、消息数、字数和估算token数
+    
+    Args:
+        conversation: 包含role和content的对话列表
+    
+    Returns:
+        dict: rounds、messages、chars、tokens
+    """
+    user_count = 0
+    assistant_count = 0
+    chars = 0
+    tokens = 0
+    
+    for msg in conversation:
+        if msg.get('role') == 'user':
+            user_count += 1
+        elif msg.get('role') == 'assistant':
+            assistant_count += 1
+        content = msg.get('content') or ''
+        chars += len(content)
+        tokens += estimate_tokens(content)
+    
+    return {
+        # 一轮对话需要一个user和一个assistant消息，取较小值作为完整轮次数
+        'rounds': min(user_count, assistant_count),
+        'messages': len(conversation),
+        'chars': chars,
+        'tokens': tokens
+    }
+
+class SessionCatalog:
+    """
+    SQLite会话目录，使用with语句时退出自动提交并关闭
+    """
+    
+    def __init__(self, db_path):
+        self.db_path = db_path
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+        self._backfill_session_files()
+    
+    def _backfill_session_files(self):
+        """旧版目录只在sessions表中记录最后一次写出的文件路径，补登记到session_files"""
+        if self.conn.execute("SELECT 1 FROM session_files LIMIT 1").fetchone():
+            return
+        rows = self.conn.execute(
+            "SELECT session_id, file_path, rounds, messages, updated_at FROM sessions WHERE file_path IS NOT NULL"
+        ).fetchall()
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO session_files (session_id, directory, file_path, rounds, messages, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(row['session_id'], os.path.dirname(row['file_path']), row['file_path'],
+              row['rounds'], row['messages'], row['updated_at']) for row in rows]
+        )
+    
+    def upsert_session(self, session_id, **fields):
+        """
+        新增或更新session记录
+        
+        Args:
+            session_id: session标识
+            **fields: SESSION_FIELDS中的字段，值为None时不覆盖已有值
+        """
+        unknown = set(fields) - set(SESSION_FIELDS)
+        if unknown:
+            raise ValueError(f"未知的会话目录字段: {', '.join(sorted(unknown))}")
+        
+        # 路径统一保存为绝对路径
+        for name in ('file_path', 'segment_dir'):
+            if fields.get(name):
+                fields[name] = os.path.abspath(fields[name])
+        
+        values = [fields.get(name) for name in SESSION_FIELDS]
+        updates = ', '.join(f"{name} = COALESCE(excluded.{name}, sessions.{name})" for name in SESSION_FIELDS)
+        updated_at = datetime.now().isoformat(timespec='seconds')
+        self.conn.execute(
+            f"INSERT INTO sessions (session_id, {', '.join(SESSION_FIELDS)}, updated_at) "
+            f"VALUES (?, {', '.join('?' for _ in SESSION_FIELDS)}, ?) "
+            f"ON CONFLICT (session_id) DO UPDATE SET {updates}, updated_at = excluded.updated_at",
+            [str(session_id), *values, updated_at]
+        )
+        
+        # sessions表只保留最后一次写出的路径；不同切分脚本输出到不同目录，按(session_id, 目录)分别登记
+        if fields.get('file_path'):
+            self.conn.execute(
+                "INSERT INTO session_files (session_id, directory, file_path, rounds, messages, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (session_id, directory) DO UPDATE SET file_path = excluded.file_path, "
+                "rounds = COALESCE(excluded.rounds, session_files.rounds), "
+                "messages = COALESCE(excluded.messages, session_files.messages), "
+                "updated_at = excluded.updated_at",
+                (str(session_id), os.path.dirname(fields['file_path']), fields['file_path'],
+                 fields.get('rounds'), fields.get('messages'), updated_at)
+            )
+    
+    def record_conversation(self, session_id, conversation, file_path, content_hash=None):
+        """
+        切分阶段写出对话文件后登记session
+        
+        Args:
+            session_id: session标识
+            conversation: 包含role和content的对话列表
+            file_path: 对话文件路径
+            content_hash: 文件内容哈希
+        """
+        self.upsert_session(
+            session_id,
+            file_path=file_path,
+            content_hash=content_hash,
+            **conversation_stats(conversation)
+        )
+    
+    def get_session(self, session_id):
+        """按session_id查询，不存在时返回None"""
+        row = self.conn.execute("SELECT * FROM sessions WHERE session_id = ?", (str(session_id),)).fetchone()
+        return dict(row) if row else None
+    
+    def find_by_path(self, file_path):
+        """按对话文件路径查询session（含其他目录中同一session的文件），不存在时返回None"""
+        file_row = self.conn.execute(
+            "SELECT * FROM session_files WHERE file_path = ?", (os.path.abspath(file_path),)
+        ).fetchone()
+        if file_row is None:
+            return None
+        
+        session = self.get_session(file_row['session_id']) or {'session_id': file_row['session_id']}
+        session.update(file_path=file_row['file_path'], rounds=file_row['rounds'], messages=file_row['messages'])
+        return session
+    
+    def session_count(self):
+        """已登记的session数量"""
+        return self.conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+    
+    def _select(self, condition, min_rounds, max_rounds, params=(), table='sessions'):
+        conditions = [condition]
+        params = list(params)
+        if min_rounds is not None:
+            conditions.append("rounds >= ?")
+            params.append(min_rounds)
+        if max_rounds is not None:
+            conditions.append("rounds <= ?")
+            params.append(max_rounds)
+        
+        rows = self.conn.execute(
+            f"SELECT * FROM {table} WHERE {' AND '.join(conditions)} ORDER BY rounds, session_id",
+            params
+        ).fetchall()
+        return [dict(row) for row in rows]
+    
+    def select_sessions(self, min_rounds=None, max_rounds=None):
+        """
+        按轮次范围选取有对话文件的session（走rounds索引）
+        
+        Args:
+            min_rounds: 最小轮次（含），None表示不限
+            max_rounds: 最大轮次（含），None表示不限
+        
+        Returns:
+            list: session记录，按轮次和session_id排序
+        """
+        return self._select("file_path IS NOT NULL", min_rounds, max_rounds)
+    
+    def select_session_files(self, directory, min_rounds=None, max_rounds=None):
+        """
+        查询某个目录中登记的对话文件
+        
+        Args:
+            directory: 对话文件所在目录
+            min_rounds: 最小轮次（含），None表示不限
+            max_rounds: 最大轮次（含），None表示不限
+        
+        Returns:
+            list: 含session_id、file_path、rounds、messages的记录，按轮次和session_id排序
+        """
+        return self._select("directory = ?", min_rounds, max_rounds, [os.path.abspath(directory)], 'session_files')
+    
+    def replace_segments(self, session_id, segment_dir, segments):
+        """
+        分段阶段登记session的分段列表（覆盖旧的分段）
+        
+        Args:
+            session_id: session标识
+            segment_dir: 分段文件夹路径
+            segments: 分段信息列表，含start_round、end_round、messages_count、filename
+        """
+        session_id = str(session_id)
+        self.conn.execute("DELETE FROM segments WHERE session_id = ?", (session_id,))
+        self.conn.executemany(
+            "INSERT INTO segments (session_id, segment_index, start_round, end_round, messages_count, filename) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (session_id, index, segment['start_round'], segment['end_round'],
+                 segment['messages_count'], segment.get('filename'))
+                for index, segment in enumerate(segments, 1)
+            ]
+        )
+        self.upsert_session(session_id, segment_dir=segment_dir)
+    
+    def get_segments(self, session_id):
+        """查询session的分段列表"""
+        rows = self.conn.execute(
+            "SELECT * FROM segments WHERE session_id = ? ORDER BY segment_index", (str(session_id),)
+        ).fetchall()
+        return [dict(row) for row in rows]
+    
+    def sessions_with_segments(self, min_rounds=None, max_rounds=None):
+        """
+        查询已完成分段的session
+        
+        Args:
+            min_rounds: 最小轮次（含），None表示不限
+            max_rounds: 最大轮次（含），None表示不限
+        
+        Returns:
+            list: session记录，按轮次和session_id排序
+        """
+        return self._select("segment_dir IS NOT NULL", min_rounds, max_rounds)
+    
+    def set_artifact(self, name, path):
+        """登记流程产物的路径，如合并评测集"""
+        self.conn.execute(
+            "INSERT INTO artifacts (name, path, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET path = excluded.path, updated_at = excluded.updated_at",
+            (name, os.path.abspath(path), datetime.now().isoformat(timespec='seconds'))
+        )
+    
+    def get_artifact(self, name):
+        """查询流程产物的路径，未登记时返回None"""
+        row = self.conn.execute("SELECT path FROM artifacts WHERE name = ?", (name,)).fetchone()
+        return row['path'] if row else None
+    
+    def commit(self):
+        """提交修改"""
+        self.conn.commit()
+    
+    def close(self):
+        """提交并关闭连接"""
+        self.conn.commit()
+        self.conn.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,173 +1,465 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import argparse
 import json
 import os
 import math
+import re
+from collections import namedtuple
+from functools import partial
 
-def create_dialog_segments(conversation, segment_size=50):
+import numpy as np
+
+from 会话目录 import SessionCatalog, estimate_tokens
+from 会话存储 import compute_round_ends, encode_roles
+from 并行解码 import parallel_map
+from 轮次扫描 import decode_with_spans
+
+# 重命名后的对话文件名，如 235轮对话_共470条消息_session4610164304233644033.json
+DIALOG_FILENAME_PATTERN = re.compile(r'^(\d+)轮对话_共(\d+)条消息_session(.+)\.json$')
+
+# 分段模式：fixed 固定轮次不重叠；budget 按token/字数预算打包整轮；window 滑动窗口
+SEGMENT_MODES = ('fixed', 'budget', 'window')
+# 预算单位
+BUDGET_UNITS = ('tokens', 'chars')
+
+# 分段存储方式：files 每段写出独立JSON文件；index 只在session_info.json中记录分段在源文件中的范围
+SEGMENT_STORAGES = ('files', 'index')
+
+# 每个session都要读写多个文件，有2个以上session即值得并行
+MIN_PARALLEL_SESSIONS = 2
+
+# 分段视图：原对话中的消息范围 [start, stop) 及其覆盖的轮次，写出时才取出消息
+SegmentView = namedtuple('SegmentView', ['start', 'stop', 'start_round', 'end_round'])
+
+def build_segment_views(round_ends, bounds):
+    """
+    根据分段边界生成分段视图
+    
+    Args:
+        round_ends: compute_round_ends的结果
+        bounds: 分段边界的消息下标，首项为0、末项为消息总数
+    
+    Returns:
+        list: SegmentView列表
     """
-    将对话按轮次分段
+    # 每个边界之前已完成的轮次数
+    rounds_before = np.searchsorted(round_ends, bounds, side='right').tolist()
+    bounds = list(bounds)
+    
+    return [
+        SegmentView(bounds[k], bounds[k + 1], rounds_before[k] + 1, rounds_before[k + 1])
+        for k in range(len(bounds) - 1)
+    ]
+
+def compute_segment_views(conversation, segment_size=50):
+    """
+    按轮次分段，只计算边界，不复制消息
     
     Args:
         conversation: 完整对话列表
-        segment_size: 每段的轮次数（默认50轮）
+        segment_size: 每段的轮次数
     
     Returns:
-        list: 分段后的对话列表
+        list: SegmentView列表
+    """
+    round_ends = compute_round_ends(encode_roles(conversation))
+    
+    # 每满segment_size轮切一刀，剩余的消息归入最后一段
+    bounds = [0, *round_ends[segment_size - 1::segment_size].tolist()]
+    if bounds[-1] < len(conversation):
+        bounds.append(len(conversation))
+    
+    return build_segment_views(round_ends, bounds)
+
+def compute_budget_views(conversation, budget, cost_prefix):
+    """
+    按预算打包连续的整轮：每段在不超过预算的前提下尽量多放轮次
+    单轮超出预算时单独成段，末尾未成轮的消息并入最后一段
+    
+    Args:
+        conversation: 完整对话列表
+        budget: 每段的token数或字数上限
+        cost_prefix: message_cost_prefixes中对应单位的前缀和
+    
+    Returns:
+        list: SegmentView列表
+    """
+    if budget <= 0:
+        raise ValueError(f"预算必须为正数: {budget}")
+    
+    round_ends = compute_round_ends(encode_roles(conversation))
+    # 每轮结束时的累计成本（单调不减）
+    end_costs = cost_prefix[round_ends]
+    
+    bounds = [0]
+    packed_rounds = 0
+    while packed_rounds < len(round_ends):
+        # 在预算内可以结束的最后一轮
+        limit = int(np.searchsorted(end_costs, cost_prefix[bounds[-1]] + budget, side='right'))
+        packed_rounds = max(limit, packed_rounds + 1)
+        bounds.append(int(round_ends[packed_rounds - 1]))
+    
+    if bounds[-1] < len(conversation):
+        if len(bounds) > 1:
+            bounds[-1] = len(conversation)
+        else:
+            bounds.append(len(conversation))
+    
+    return build_segment_views(round_ends, bounds)
+
+def compute_window_views(conversation, segment_size, stride):
+    """
+    滑动窗口分段：每个窗口segment_size轮，相邻窗口起点相差stride轮
+    窗口覆盖到最后一轮后停止，末尾未成轮的消息并入最后一个窗口
+    
+    Args:
+        conversation: 完整对话列表
+        segment_size: 每个窗口的轮次数
+        stride: 窗口步长（轮次数），等于segment_size减去重叠轮次
+    
+    Returns:
+        list: SegmentView列表
+    """
+    if stride < 1 or stride > segment_size:
+        raise ValueError(f"窗口步长必须在1到{segment_size}之间: {stride}")
+    
+    round_ends = compute_round_ends(encode_roles(conversation))
+    total_rounds = len(round_ends)
+    if total_rounds == 0:
+        return [SegmentView(0, len(conversation), 1, 0)] if conversation else []
+    
+    first_rounds = np.arange(0, total_rounds, stride)
+    last_rounds = np.minimum(first_rounds + segment_size, total_rounds)
+    # 第一个覆盖到最后一轮的窗口之后不再滑动
+    count = int(np.argmax(last_rounds >= total_rounds)) + 1
+    first_rounds = first_rounds[:count]
+    last_rounds = last_rounds[:count]
+    
+    # 第k轮从上一轮结束处开始，两轮之间的零散消息归入后一轮
+    round_starts = np.concatenate(([0], round_ends[:-1]))
+    starts = round_starts[first_rounds].tolist()
+    stops = round_ends[last_rounds - 1].tolist()
+    stops[-1] = len(conversation)
+    
+    return [
+        SegmentView(start, stop, first + 1, last)
+        for start, stop, first, last in zip(starts, stops, first_rounds.tolist(), last_rounds.tolist())
+    ]
+
+def message_cost_prefixes(conversation):
+    """
+    计算消息token数和字数的前缀和，前m条消息的成本为 prefix[m]
+    
+    Args:
+        conversation: 包含role和content的对话列表
+    
+    Returns:
+        dict: tokens、chars -> numpy.ndarray（长度为消息数+1）
+    """
+    contents = [msg.get('content') or '' for msg in conversation]
+    prefixes = {}
+    for unit, measure in (('tokens', estimate_tokens), ('chars', len)):
+        costs = np.fromiter((measure(content) for content in contents), dtype=np.int64, count=len(contents))
+        prefixes[unit] = np.concatenate(([0], np.cumsum(costs)))
+    return prefixes
+
+def plan_segments(conversation, mode='fixed', segment_size=50, budget=None, budget_unit='tokens',
+                  stride=None, cost_prefixes=None):
+    """
+    按分段模式计算分段视图
+    
+    Args:
+        conversation: 完整对话列表
+        mode: 分段模式，见SEGMENT_MODES
+        segment_size: fixed/window模式下每段的轮次数
+        budget: budget模式下每段的token数或字数上限
+        budget_unit: 预算单位，见BUDGET_UNITS
+        stride: window模式的步长，None表示不重叠
+        cost_prefixes: message_cost_prefixes的结果，None时现算
+    
+    Returns:
+        list: SegmentView列表
+    """
+    if mode == 'fixed':
+        return compute_segment_views(conversation, segment_size)
+    if mode == 'window':
+        return compute_window_views(conversation, segment_size, stride or segment_size)
+    if mode == 'budget':
+        if budget is None:
+            raise ValueError("budget模式需要指定预算")
+        if budget_unit not in BUDGET_UNITS:
+            raise ValueError(f"未知的预算单位: {budget_unit}")
+        if cost_prefixes is None:
+            cost_prefixes = message_cost_prefixes(conversation)
+        return compute_budget_views(conversation, budget, cost_prefixes[budget_unit])
+    raise ValueError(f"未知的分段模式: {mode}")
+
+def materialize_segment(conversation, view):
+    """取出分段视图对应的消息列表"""
+    return conversation[view.start:view.stop]
+
+def list_dialog_files(input_dir, catalog=None, min_rounds=None, max_rounds=None):
+    """
+    列出需要分段的对话文件
+    会话目录中登记了该目录的文件时按轮次范围查询，否则扫描目录并解析文件名
+    （目录早于会话目录生成、或由未登记的脚本写出时仍能找到文件）
+    
+    Args:
+        input_dir: 输入目录
+        catalog: 会话目录
+        min_rounds: 最小轮次（含），None表示不限
+        max_rounds: 最大轮次（含），None表示不限
+    
+    Returns:
+        list: 包含filepath、session_id、total_rounds、total_messages的列表
+    """
+    if catalog is not None:
+        dialog_files = [
+            {
+                'filepath': row['file_path'],
+                'session_id': row['session_id'],
+                'total_rounds': row['rounds'],
+                'total_messages': row['messages']
+            }
+            for row in catalog.select_session_files(input_dir, min_rounds, max_rounds)
+            if os.path.exists(row['file_path'])
+        ]
+        if dialog_files:
+            return dialog_files
+    
+    dialog_files = []
+    for filename in sorted(os.listdir(input_dir)):
+        match = DIALOG_FILENAME_PATTERN.match(filename)
+        if not match:
+            continue
+        
+        total_rounds = int(match.group(1))
+        if min_rounds is not None and total_rounds < min_rounds:
+            continue
+        if max_rounds is not None and total_rounds > max_rounds:
+            continue
+        
+        dialog_files.append({
+            'filepath': os.path.join(input_dir, filename),
+            'session_id': match.group(3),
+            'total_rounds': total_rounds,
+            'total_messages': int(match.group(2))
+        })
+    
+    return dialog_files
+
+def describe_segmentation(mode, segment_size, budget, budget_unit, stride):
+    """生成分段参数的说明文字"""
+    if mode == 'budget':
+        return f"按预算打包，每段不超过{budget} {budget_unit}"
+    if mode == 'window' and stride and stride != segment_size:
+        return f"滑动窗口，{segment_size}轮/段，步长{stride}轮（重叠{segment_size - stride}轮）"
+    return f"{segment_size}轮/段"
+
+def segment_session(dialog_file, output_dir, segment_size=50, mode='fixed', budget=None,
+                    budget_unit='tokens', stride=None, storage='files'):
+    """
+    为单个session创建分段文件和session_info.json（在子进程中执行）
+    storage为index时不写分段文件，session_info.json记录每段在源对话文件中的消息下标和字节范围
+    
+    Args:
+        dialog_file: list_dialog_files返回的文件信息
+        output_dir: 输出目录
+        segment_size: 每段轮次数（fixed/window模式）
+        mode: 分段模式，见SEGMENT_MODES
+        budget: budget模式下每段的token数或字数上限
+        budget_unit: 预算单位，tokens或chars
+        stride: window模式的步长（轮次数），None表示等于segment_size
+        storage: 分段存储方式，见SEGMENT_STORAGES
+    
+    Returns:
+        dict: 处理日志项，status为'success'或错误信息
     """
-    segments = []
-    current_segment = []
-    user_count = 0
-    assistant_count = 0
-    current_rounds = 0
-    
-    for msg in conversation:
-        current_segment.append(msg)
-        
-        if msg.get('role') == 'user':
-            user_count += 1
-        elif msg.get('role') == 'assistant':
-            assistant_count += 1
-            # 当user和assistant都有消息时，算作一轮完成
-            if user_count > 0 and assistant_count > 0:
-                current_rounds = min(user_count, assistant_count)
+    filepath = dialog_file['filepath']
+    filename = os.path.basename(filepath)
+    session_id = dialog_file['session_id']
+    total_rounds = dialog_file['total_rounds']
+    total_messages = dialog_file['total_messages']
+    
+    try:
+        # 读取对话文件
+        with open(filepath, 'rb') as f:
+            raw = f.read()
+        
+        if storage == 'index':
+            # 解码的同时得到每条消息在源文件中的字节范围
+            conversation, message_spans = decode_with_spans(raw)
+        else:
+            conversation = json.loads(raw)
+        
+        # 创建session文件夹
+        session_folder_name = f"{total_rounds}轮对话_session{session_id}"
+        session_folder_path = os.path.join(output_dir, session_folder_name)
+        os.makedirs(session_folder_path, exist_ok=True)
+        
+        # 计算分段边界（只计算边界，不复制消息）
+        cost_prefixes = message_cost_prefixes(conversation)
+        segments = plan_segments(conversation, mode, segment_size, budget, budget_unit,
+                                 stride, cost_prefixes)
+        
+        segment_files = []
+        
+        for view in segments:
+            messages_count = view.stop - view.start
+            estimated_tokens = int(cost_prefixes['tokens'][view.stop] - cost_prefixes['tokens'][view.start])
+            chars = int(cost_prefixes['chars'][view.stop] - cost_prefixes['chars'][view.start])
+            
+            segment = {
+                'filename': None,
+                'start_round': view.start_round,
+                'end_round': view.end_round,
+                'start_message': view.start,
+                'end_message': view.stop,
+                'messages_count': messages_count,
+                'estimated_tokens': estimated_tokens,
+                'chars': chars
+            }
+            
+            if storage == 'index':
+                segment['byte_start'] = message_spans[view.start][0]
+                segment['byte_end'] = message_spans[view.stop - 1][1]
+            else:
+                # 生成分段文件名
+                segment_filename = f"第{view.start_round}-{view.end_round}轮_共{messages_count}条消息.json"
+                segment_filepath = os.path.join(session_folder_path, segment_filename)
                 
-                # 如果达到分段大小，开始新分段
-                if current_rounds >= segment_size:
-                    segments.append({
-                        'messages': current_segment.copy(),
-                        'rounds': current_rounds,
-                        'start_round': len(segments) * segment_size + 1,
-                        'end_round': len(segments) * segment_size + current_rounds
-                    })
-                    
-                    current_segment = []
-                    user_count = 0
-                    assistant_count = 0
-                    current_rounds = 0
-    
-    # 添加最后一段（如果有剩余）
-    if current_segment:
-        final_rounds = min(user_count, assistant_count)
-        if final_rounds > 0:
-            segments.append({
-                'messages': current_segment,
-                'rounds': final_rounds,
-                'start_round': len(segments) * segment_size + 1,
-                'end_round': len(segments) * segment_size + final_rounds
-            })
-    
-    return segments
-
-def process_conversation_segments(input_dir, output_dir, segment_size=50):
+                # 保存分段文件
+                with open(segment_filepath, 'w', encoding='utf-8') as f:
+                    json.dump(materialize_segment(conversation, view), f, ensure_ascii=False, indent=2)
+                
+                segment['filename'] = segment_filename
+            
+            segment_files.append(segment)
+        
+        # 创建session信息文件
+        session_info = {
+            'session_id': session_id,
+            'total_rounds': total_rounds,
+            'total_messages': total_messages,
+            'segment_mode': mode,
+            'segment_size': segment_size if mode != 'budget' else None,
+            'stride': (stride or segment_size) if mode == 'window' else None,
+            'budget': budget if mode == 'budget' else None,
+            'budget_unit': budget_unit if mode == 'budget' else None,
+            'total_segments': len(segments),
+            'segments': segment_files,
+            'original_file': filename,
+            'storage': storage
+        }
+        
+        if storage == 'index':
+            # 读取时用文件大小确认源文件未被改动
+            session_info['source_path'] = os.path.abspath(filepath)
+            session_info['source_size'] = len(raw)
+        
+        info_filepath = os.path.join(session_folder_path, "session_info.json")
+        with open(info_filepath, 'w', encoding='utf-8') as f:
+            json.dump(session_info, f, ensure_ascii=False, indent=2)
+        
+        return {
+            'session_id': session_id,
+            'total_rounds': total_rounds,
+            'total_segments': len(segments),
+            'folder_name': session_folder_name,
+            'original_file': filename,
+            'status': 'success',
+            # 供父进程登记会话目录，写日志前移除
+            'segment_dir': session_folder_path,
+            'segments': segment_files
+        }
+    
+    except Exception as e:
+        return {
+            'session_id': session_id,
+            'total_rounds': total_rounds,
+            'original_file': filename,
+            'status': f'error: {str(e)}'
+        }
+
+def process_conversation_segments(input_dir, output_dir, segment_size=50, catalog=None,
+                                  min_rounds=None, max_rounds=None, mode='fixed',
+                                  budget=None, budget_unit='tokens', stride=None, jobs=None,
+                                  storage='files'):
     """
     处理所有对话文件，为每个session创建分段
+    各session互不依赖，在进程池中并行处理；日志顺序与输入顺序一致，出错的session记录在日志中
     
     Args:
         input_dir: 输入目录
         output_dir: 输出目录
-        segment_size: 每段轮次数
+        segment_size: 每段轮次数（fixed/window模式）
+        catalog: 会话目录，不为None时从中选取session并登记分段结果
+        min_rounds: 最小轮次（含），None表示不限
+        max_rounds: 最大轮次（含），None表示不限
+        mode: 分段模式，见SEGMENT_MODES
+        budget: budget模式下每段的token数或字数上限
+        budget_unit: 预算单位，tokens或chars
+        stride: window模式的步长（轮次数），None表示等于segment_size
+        jobs: 并行进程数，None时使用全部CPU核，1表示串行
+        storage: 分段存储方式，files写出分段文件，index只记录分段在源文件中的范围
+    
+    Returns:
+        list: 处理日志，每个session一项
     """
+    if mode not in SEGMENT_MODES:
+        raise ValueError(f"未知的分段模式: {mode}")
+    if mode == 'budget' and budget is None:
+        raise ValueError("budget模式需要指定预算")
+    if storage not in SEGMENT_STORAGES:
+        raise ValueError(f"未知的分段存储方式: {storage}")
+    
     print(f"正在处理目录: {input_dir}")
     print(f"输出目录: {output_dir}")
-    print(f"分段大小: {segment_size}轮/段")
+    print(f"分段方式: {describe_segmentation(mode, segment_size, budget, budget_unit, stride)}")
+    print(f"存储方式: {'只记录分段索引' if storage == 'index' else '分段文件'}")
     
     # 创建输出目录
     os.makedirs(output_dir, exist_ok=True)
     
     # 获取所有对话文件
-    dialog_files = [f for f in os.listdir(input_dir) if f.endswith('.json') and f.startswith('2')]
+    dialog_files = list_dialog_files(input_dir, catalog, min_rounds, max_rounds)
     
     print(f"找到 {len(dialog_files)} 个对话文件")
     
+    worker = partial(segment_session, output_dir=output_dir, segment_size=segment_size, mode=mode,
+                     budget=budget, budget_unit=budget_unit, stride=stride, storage=storage)
+    results = parallel_map(worker, dialog_files, jobs, batch_size=1, min_parallel=MIN_PARALLEL_SESSIONS)
+    
     processing_log = []
     
-    for filename in dialog_files:
-        filepath = os.path.join(input_dir, filename)
+    for result in results:
+        segment_dir = result.pop('segment_dir', None)
+        segment_files = result.pop('segments', None)
         
-        try:
-            # 从文件名提取轮次信息
-            parts = filename.split('_')
-            total_rounds = int(parts[0].replace('轮对话', ''))
-            total_messages = int(parts[1].replace('共', '').replace('条消息', ''))
-            session_id = parts[2].replace('session', '').replace('.json', '')
-            
-            print(f"\n处理: {filename}")
-            print(f"总轮次: {total_rounds}, 总消息: {total_messages}")
-            
-            # 读取对话文件
-            with open(filepath, 'r', encoding='utf-8') as f:
-                conversation = json.load(f)
-            
-            # 创建session文件夹
-            session_folder_name = f"{total_rounds}轮对话_session{session_id}"
-            session_folder_path = os.path.join(output_dir, session_folder_name)
-            os.makedirs(session_folder_path, exist_ok=True)
-            
-            # 按50轮分段
-            segments = create_dialog_segments_v2(conversation, segment_size)
-            
-            segment_files = []
-            
-            for i, segment in enumerate(segments, 1):
-                start_round = (i - 1) * segment_size + 1
-                end_round = min(i * segment_size, total_rounds)
-                actual_rounds = len([msg for msg in segment if msg.get('role') == 'user'])
-                
-                # 生成分段文件名
-                segment_filename = f"第{start_round}-{end_round}轮_共{len(segment)}条消息.json"
-                segment_filepath = os.path.join(session_folder_path, segment_filename)
-                
-                # 保存分段文件
-                with open(segment_filepath, 'w', encoding='utf-8') as f:
-                    json.dump(segment, f, ensure_ascii=False, indent=2)
-                
-                segment_files.append({
-                    'filename': segment_filename,
-                    'start_round': start_round,
-                    'end_round': end_round,
-                    'messages_count': len(segment)
-                })
-                
-                print(f"  分段 {i}: {segment_filename} ({len(segment)}条消息)")
-            
-            # 创建session信息文件
-            session_info = {
-                'session_id': session_id,
-                'total_rounds': total_rounds,
-                'total_messages': total_messages,
-                'segment_size': segment_size,
-                'total_segments': len(segments),
-                'segments': segment_files,
-                'original_file': filename
-            }
-            
-            info_filepath = os.path.join(session_folder_path, "session_info.json")
-            with open(info_filepath, 'w', encoding='utf-8') as f:
-                json.dump(session_info, f, ensure_ascii=False, indent=2)
-            
-            processing_log.append({
-                'session_id': session_id,
-                'total_rounds': total_rounds,
-                'total_segments': len(segments),
-                'folder_name': session_folder_name
-            })
-            
-        except Exception as e:
-            print(f"处理文件 {filename} 时出错: {str(e)}")
+        if result['status'] == 'success':
+            print(f"  {result['folder_name']}: {result['total_segments']}个分段")
+            # 会话目录只在父进程中写入
+            if catalog is not None:
+                catalog.replace_segments(result['session_id'], segment_dir, segment_files)
+        
+        processing_log.append(result)
     
     # 保存处理日志
     log_filepath = os.path.join(output_dir, "分段处理日志.json")
     with open(log_filepath, 'w', encoding='utf-8') as f:
         json.dump(processing_log, f, ensure_ascii=False, indent=2)
     
+    successful = [log for log in processing_log if log['status'] == 'success']
+    
     print(f"\n=== 分段处理完成 ===")
-    print(f"处理了 {len(processing_log)} 个session")
+    print(f"处理了 {len(successful)} 个session")
+    print(f"处理失败: {len(processing_log) - len(successful)} 个session")
     print(f"处理日志保存在: {log_filepath}")
     
     # 统计信息
-    total_segments = sum(log['total_segments'] for log in processing_log)
+    total_segments = sum(log['total_segments'] for log in successful)
     print(f"总共生成了 {total_segments} 个分段文件")
     
     return processing_log
@@ -183,60 +475,67 @@ def create_dialog_segments_v2(conversation, segment_size=50):
     Returns:
         list: 分段后的对话列表
     """
-    segments = []
-    current_segment = []
-    current_round = 0
-    
-    i = 0
-    while i < len(conversation):
-        msg = conversation[i]
-        current_segment.append(msg)
-        
-        # 如果当前是user消息，检查下一个是否是assistant消息
-        if msg.get('role') == 'user' and i + 1 < len(conversation):
-            next_msg = conversation[i + 1]
-            if next_msg.get('role') == 'assistant':
-                current_segment.append(next_msg)
-                current_round += 1
-                i += 2  # 跳过下一个消息，因为已经处理了
-                
-                # 检查是否需要开始新分段
-                if current_round >= segment_size:
-                    segments.append(current_segment.copy())
-                    current_segment = []
-                    current_round = 0
-            else:
-                i += 1
-        else:
-            i += 1
-    
-    # 添加最后一段（如果有剩余）
-    if current_segment:
-        segments.append(current_segment)
-    
-    return segments
+    return [materialize_segment(conversation, view)
+            for view in compute_segment_views(conversation, segment_size)]
 
 def main():
     """主函数"""
-    input_dir = "/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/切分后的对话"
-    output_dir = "/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/分段后的对话"
-    segment_size = 50  # 每段50轮
+    parser = argparse.ArgumentParser(description='将对话文件分段，创建session文件夹结构')
+    parser.add_argument('--input-dir', default="/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/切分后的对话",
+                        help='重命名后的对话文件目录')
+    parser.add_argument('--output-dir', default="/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/分段后的对话",
+                        help='输出目录')
+    parser.add_argument('--catalog', default="/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/会话目录.sqlite",
+                        help='会话目录(SQLite)路径，传空字符串则不使用')
+    parser.add_argument('--mode', choices=SEGMENT_MODES, default='fixed',
+                        help='分段模式：fixed固定轮次，budget按预算打包整轮，window滑动窗口')
+    parser.add_argument('--segment-size', type=int, default=50,
+                        help='fixed/window模式下每段的轮次数')
+    parser.add_argument('--budget', type=int,
+                        help='budget模式下每段的token数或字数上限')
+    parser.add_argument('--budget-unit', choices=BUDGET_UNITS, default='tokens',
+                        help='预算单位：tokens按估算token数，chars按字数')
+    window_group = parser.add_mutually_exclusive_group()
+    window_group.add_argument('--stride', type=int,
+                              help='window模式的步长（轮次数），默认等于--segment-size')
+    window_group.add_argument('--overlap', type=int,
+                              help='window模式相邻窗口重叠的轮次数')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='并行处理session的进程数，默认使用全部CPU核，1表示串行')
+    parser.add_argument('--index-only', action='store_true',
+                        help='不写出分段文件，只在session_info.json中记录分段在源对话文件中的范围')
+    args = parser.parse_args()
+    
+    if args.mode == 'budget' and args.budget is None:
+        parser.error('--mode budget 需要指定 --budget')
+    stride = args.segment_size - args.overlap if args.overlap is not None else args.stride
+    
+    catalog = SessionCatalog(args.catalog) if args.catalog else None
     
     try:
-        processing_log = process_conversation_segments(input_dir, output_dir, segment_size)
+        processing_log = process_conversation_segments(
+            args.input_dir, args.output_dir, args.segment_size, catalog,
+            mode=args.mode, budget=args.budget, budget_unit=args.budget_unit, stride=stride,
+            jobs=args.jobs, storage='index' if args.index_only else 'files'
+        )
+        
+        successful = [log for log in processing_log if log['status'] == 'success']
         
         print(f"\n=== 文件夹结构预览 ===")
         # 显示生成的文件夹结构
-        for log in processing_log[:3]:  # 只显示前3个作为示例
+        for log in successful[:3]:  # 只显示前3个作为示例
             folder_name = log['folder_name']
             print(f"{folder_name}/ ({log['total_segments']}个分段)")
         
-        if len(processing_log) > 3:
-            print(f"... 还有 {len(processing_log) - 3} 个session文件夹")
+        if len(successful) > 3:
+            print(f"... 还有 {len(successful) - 3} 个session文件夹")
     
     except Exception as e:
         print(f"处理过程中出现错误: {str(e)}")
         raise
+    finally:
+        if catalog is not None:
+            catalog.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+评测集的Parquet列式导出
+SESSION_ID、SEGMENT_INFO、CHARACTER_ID、CHARACTER_SETTING使用字典编码，整体zstd压缩；
+按分段的起始轮次分档写入行组（同一行组中的分段起始轮次相近，档内仍按session顺序），
+读取时可以只取需要的列，并按轮次范围或session跳过行组
+需要安装pyarrow
+"""
+
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# 合并评测集的Parquet文件名
+PARQUET_FILENAME = "合并总评测集_全部轮次对话.parquet"
+
+# 每个行组的行数
+ROW_GROUP_ROWS = 512
+
+# 按起始轮次分档的宽度：START_ROUND在同一档（如1-50、51-100）的分段写入同一批行组，
+# 行组的START_ROUND/END_ROUND统计范围因此很窄，按轮次过滤时可以跳过其他档的行组
+ROUND_BAND_ROUNDS = 50
+
+# 各档缓存的总行数上限，超过时先写出最满的一档，控制内存
+MAX_BUFFERED_ROWS = 4 * ROW_GROUP_ROWS
+
+# 重复值很多、适合字典编码的列
+DICTIONARY_COLUMNS = ['SESSION_ID', 'SEGMENT_INFO', 'CHARACTER_ID', 'CHARACTER_SETTING']
+
+def require_pyarrow():
+    """未安装pyarrow时给出明确的错误"""
+    if pa is None:
+        raise ImportError("Parquet导出需要pyarrow，请先执行 pip install pyarrow")
+
+def eval_schema():
+    """合并评测集的Parquet表结构"""
+    require_pyarrow()
+    return pa.schema([
+        ('SESSION_ID', pa.string()),
+        ('SEGMENT_INFO', pa.string()),
+        ('START_ROUND', pa.int32()),
+        ('END_ROUND', pa.int32()),
+        ('CHARACTER_ID', pa.string()),
+        ('CHARACTER_SETTING', pa.string()),
+        ('DIALOGUE_HISTORY', pa.large_string()),
+        ('ROW_ID', pa.string()),
+        ('CONTENT_HASH', pa.string())
+    ])
+
+class ParquetEvalWriter:
+    """
+    逐session写入合并评测集的Parquet文件，接口与评测集生成脚本的MergedCsvWriter一致
+    """
+    
+    def __init__(self, output_dir, settings, compression='zstd', row_group_rows=ROW_GROUP_ROWS,
+                 round_band_rounds=ROUND_BAND_ROUNDS):
+        """
+        Args:
+            output_dir: 输出目录
+            settings: 角色设定表，用于写入CHARACTER_SETTING全文（字典编码后每个角色只存一份）
+            compression: 压缩算法
+            row_group_rows: 每个行组的行数
+            round_band_rounds: 按起始轮次分档的宽度
+        """
+        require_pyarrow()
+        self.settings = settings
+        self.row_group_rows = row_group_rows
+        self.round_band_rounds = round_band_rounds
+        self.filepath = os.path.join(output_dir, PARQUET_FILENAME)
+        self.schema = eval_schema()
+        self.total_segments = 0
+        # 档号 -> 该档尚未写出的行（按列保存）
+        self._bands = {}
+        self._buffered_rows = 0
+        self._writer = pq.ParquetWriter(
+            self.filepath,
+            self.schema,
+            compression=compression,
+            use_dictionary=DICTIONARY_COLUMNS,
+            write_statistics=True
+        )
+    
+    def write_session(self, session_data):
+        """登记一个session，之后用write_segment写入它的分段"""
+        self._session_id = f"{session_data['total_rounds']}轮对话_session{session_data['session_id']}"
+        self._character_id = session_data['character_id']
+        self._character = self.settings.text(self._character_id)
+    
+    def write_segment(self, segment):
+        """写入当前session的一个分段"""
+        band = (segment['start_round'] - 1) // self.round_band_rounds
+        rows = self._bands.get(band)
+        if rows is None:
+            rows = self._bands[band] = {name: [] for name in self.schema.names}
+        
+        rows['SESSION_ID'].append(self._session_id)
+        rows['SEGMENT_INFO'].append(segment['segment_info'])
+        rows['START_ROUND'].append(segment['start_round'])
+        rows['END_ROUND'].append(segment['end_round'])
+        rows['CHARACTER_ID'].append(self._character_id)
+        rows['CHARACTER_SETTING'].append(self._character)
+        rows['DIALOGUE_HISTORY'].append(segment['dialogue_history'])
+        rows['ROW_ID'].append(segment['row_id'])
+        rows['CONTENT_HASH'].append(segment['content_hash'])
+        self.total_segments += 1
+        self._buffered_rows += 1
+        
+        if len(rows['SESSION_ID']) >= self.row_group_rows:
+            self._flush(band)
+        elif self._buffered_rows >= MAX_BUFFERED_ROWS:
+            self._flush(max(self._bands, key=lambda key: len(self._bands[key]['SESSION_ID'])))
+    
+    def _flush(self, band):
+        rows = self._bands.pop(band)
+        self._buffered_rows -= len(rows['SESSION_ID'])
+        self._writer.write_table(pa.table(rows, schema=self.schema), row_group_size=self.row_group_rows)
+    
+    def close(self):
+        """
+        写出剩余的行并关闭文件
+        
+        Returns:
+            str: Parquet文件路径
+        """
+        for band in sorted(self._bands):
+            self._flush(band)
+        self._writer.close()
+        print(f"生成合并Parquet: {PARQUET_FILENAME} ({self.total_segments}行)")
+        return self.filepath
+
+def read_eval_parquet(parquet_path, columns=None, session_ids=None, min_round=None, max_round=None):
+    """
+    读取合并评测集Parquet，只读取需要的列，并利用行组统计信息跳过不相关的轮次和session
+    
+    Args:
+        parquet_path: Parquet文件路径
+        columns: 需要的列，None表示全部
+        session_ids: 只读取这些SESSION_ID（如"235轮对话_session4610164304233644033"），None表示不限
+        min_round: 只读取与第min_round轮之后有重叠的分段，None表示不限
+        max_round: 只读取与第max_round轮之前有重叠的分段，None表示不限
+    
+    Returns:
+        pyarrow.Table: 读取结果，可用to_pandas()转换为DataFrame
+    """
+    require_pyarrow()
+    
+    filters = []
+    if session_ids is not None:
+        filters.append(('SESSION_ID', 'in', list(session_ids)))
+    if min_round is not None:
+        filters.append(('END_ROUND', '>=', min_round))
+    if max_round is not None:
+        filters.append(('START_ROUND', '<=', max_round))
+    
+    return pq.read_table(parquet_path, columns=columns, filters=filters or None)
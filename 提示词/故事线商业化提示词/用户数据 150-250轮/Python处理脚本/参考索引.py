@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+合并评测集的持久化参考索引
+与合并CSV放在同一目录，记录每行(CHARACTER_SETTING, DIALOGUE_HISTORY)的摘要（按摘要排序）、
+每行在CSV中的字节范围，以及近似匹配用的MinHash签名；文件头记录CSV和角色设定表的哈希。
+添加标识列时通过mmap二分查找摘要，只读取命中的那一行，不再用pandas读入整个CSV
+"""
+
+import csv
+import hashlib
+import io
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from 角色设定 import SETTINGS_FILENAME, load_settings_in
+from 近似匹配 import LSH_BANDS, NUM_PERM, MinHashLSH, make_permutations, minhash_signature, shingle_hashes
+from 轮次扫描 import file_content_hash
+
+# 索引文件后缀，如 合并总评测集_全部轮次对话.csv.参考索引
+INDEX_SUFFIX = '.参考索引'
+
+# 文件头：魔数 + 头部JSON长度（uint64），之后是按8字节对齐的头部JSON和各数组
+MAGIC = b'REFIDX01'
+PREFIX = struct.Struct('<8sQ')
+
+# 摘要表的一项：SHA-256摘要和CSV中的行号（从0开始，不含表头）
+ENTRY_DTYPE = np.dtype([('digest', 'S32'), ('row', '<u4')])
+
+# MinHash签名使用的随机种子，与查询时一致
+SIGNATURE_SEED = 1
+
+def normalize_text(value):
+    """
+    规范化单元格文本：空值视为空字符串，统一换行符并去掉首尾空白
+    （Excel导入导出时可能把换行改为\r\n或在末尾留下空白）
+    """
+    if value is None or (isinstance(value, float) and value != value):
+        return ''
+    return str(value).replace('\r\n', '\n').replace('\r', '\n').strip()
+
+def pair_digest(character_setting, dialogue_history):
+    """
+    计算规范化后的(CHARACTER_SETTING, DIALOGUE_HISTORY)摘要
+    
+    Args:
+        character_setting: 已规范化的角色设定
+        dialogue_history: 已规范化的对话历史
+    
+    Returns:
+        bytes: SHA-256摘要
+    """
+    digest = hashlib.sha256(character_setting.encode('utf-8'))
+    digest.update(b'\x00')
+    digest.update(dialogue_history.encode('utf-8'))
+    return digest.digest()
+
+def content_hash(character_setting, dialogue_history):
+    """
+    行内容的规范化哈希（CONTENT_HASH列），即参考索引中摘要的十六进制形式
+    
+    Args:
+        character_setting: 角色设定全文
+        dialogue_history: 对话历史
+    
+    Returns:
+        str: 64位十六进制字符串
+    """
+    return pair_digest(normalize_text(character_setting), normalize_text(dialogue_history)).hex()
+
+def make_row_id(session_id, start_round, end_round):
+    """
+    分段的稳定行标识（ROW_ID列），同一分段每次生成都相同，也用作批量推理的custom_id
+    
+    Args:
+        session_id: session标识
+        start_round: 起始轮次
+        end_round: 结束轮次
+    
+    Returns:
+        str: 如 session4610164304233644033_r101-150
+    """
+    return f"session{session_id}_r{start_round}-{end_round}"
+
+def reference_index_path(csv_path):
+    """合并CSV对应的索引文件路径"""
+    return csv_path + INDEX_SUFFIX
+
+def source_fingerprint(csv_path):
+    """
+    合并CSV及同目录角色设定表的状态，用于判断索引是否过期
+    
+    Returns:
+        dict: csv_size、csv_mtime_ns、csv_sha256、settings_sha256
+    """
+    stat = os.stat(csv_path)
+    settings_path = os.path.join(os.path.dirname(csv_path), SETTINGS_FILENAME)
+    return {
+        'csv_size': stat.st_size,
+        'csv_mtime_ns': stat.st_mtime_ns,
+        'csv_sha256': file_content_hash(csv_path),
+        'settings_sha256': file_content_hash(settings_path) if os.path.exists(settings_path) else None
+    }
+
+def iter_csv_records(f):
+    """
+    逐条读取CSV记录并给出每条记录的字节范围（字段内可以含换行）
+    
+    Args:
+        f: 以二进制模式打开的CSV文件
+    
+    Returns:
+        generator: (记录字段列表, 起始字节, 结束字节)
+    """
+    position = [f.tell()]
+    
+    def lines():
+        for line in iter(f.readline, b''):
+            position[0] += len(line)
+            yield line.decode('utf-8')
+    
+    start = position[0]
+    for record in csv.reader(lines()):
+        yield record, start, position[0]
+        start = position[0]
+
+def _write_index(index_path, header, arrays):
+    """原子写出索引文件，arrays按header['arrays']的顺序排列"""
+    offset = 0
+    layout = []
+    for name, array in arrays:
+        dtype = None if name == 'entries' else array.dtype.str
+        layout.append({'name': name, 'offset': offset, 'dtype': dtype, 'shape': list(array.shape)})
+        offset += array.nbytes
+    header = dict(header, arrays=layout)
+    
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    header_bytes += b' ' * (-(PREFIX.size + len(header_bytes)) % 8)
+    
+    temp_path = index_path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(PREFIX.pack(MAGIC, len(header_bytes)))
+        f.write(header_bytes)
+        for _, array in arrays:
+            f.write(np.ascontiguousarray(array).tobytes())
+    os.replace(temp_path, index_path)
+
+def build_reference_index(csv_path, fingerprint=None):
+    """
+    读取合并CSV并写出参考索引
+    
+    Args:
+        csv_path: 合并评测集CSV路径（CHARACTER_ID格式时按同目录的角色设定表展开）
+        fingerprint: 已计算好的source_fingerprint，None时重新计算
+    
+    Returns:
+        str: 索引文件路径
+    """
+    settings = load_settings_in(os.path.dirname(csv_path))
+    a, b = make_permutations(NUM_PERM, SIGNATURE_SEED)
+    
+    digests = []
+    spans = []
+    sizes = []
+    signatures = []
+    
+    with open(csv_path, 'rb') as f:
+        records = iter_csv_records(f)
+        columns, _, _ = next(records)
+        columns[0] = columns[0].lstrip('\ufeff')
+        
+        if 'CHARACTER_SETTING' in columns:
+            character_position = columns.index('CHARACTER_SETTING')
+            character_text = lambda value: value
+        else:
+            if settings is None:
+                raise ValueError(f"评测集只包含CHARACTER_ID，但找不到{SETTINGS_FILENAME}")
+            character_position = columns.index('CHARACTER_ID')
+            character_text = settings.text
+        dialogue_position = columns.index('DIALOGUE_HISTORY')
+        
+        for record, start, stop in records:
+            dialogue = record[dialogue_position]
+            digests.append(pair_digest(
+                normalize_text(character_text(record[character_position])), normalize_text(dialogue)
+            ))
+            spans.append((start, stop))
+            hashes = shingle_hashes(dialogue)
+            sizes.append(len(hashes))
+            signatures.append(minhash_signature(hashes, a, b))
+    
+    rows = len(digests)
+    entries = np.empty(rows, dtype=ENTRY_DTYPE)
+    entries['digest'] = digests
+    entries['row'] = np.arange(rows)
+    # 稳定排序：相同摘要时行号小的在前，查找时命中第一次出现的行
+    entries = entries[np.argsort(entries['digest'], kind='stable')]
+    
+    header = dict(
+        fingerprint or source_fingerprint(csv_path),
+        columns=columns,
+        rows=rows,
+        duplicates=rows - len(set(digests)),
+        num_perm=NUM_PERM,
+        signature_seed=SIGNATURE_SEED
+    )
+    index_path = reference_index_path(csv_path)
+    _write_index(index_path, header, [
+        ('entries', entries),
+        ('spans', np.array(spans, dtype='<u8').reshape(rows, 2)),
+        ('sizes', np.array(sizes, dtype='<u4')),
+        ('signatures', np.array(signatures, dtype='<u8').reshape(rows, NUM_PERM))
+    ])
+    print(f"生成参考索引: {os.path.basename(index_path)} ({rows}行)")
+    return index_path
+
+def _load_arrays(buffer, header, data_start):
+    """按文件头的布局从buffer中取出各数组（不复制）"""
+    arrays = {}
+    for layout in header['arrays']:
+        dtype = ENTRY_DTYPE if layout['name'] == 'entries' else np.dtype(layout['dtype'])
+        count = int(np.prod(layout['shape']))
+        array = np.frombuffer(buffer, dtype=dtype, count=count, offset=data_start + layout['offset'])
+        arrays[layout['name']] = array.reshape(layout['shape'])
+    return arrays
+
+def read_index_header(index_path):
+    """读取索引文件头，文件不存在或格式不符时返回None"""
+    try:
+        with open(index_path, 'rb') as f:
+            magic, header_length = PREFIX.unpack(f.read(PREFIX.size))
+            if magic != MAGIC:
+                return None
+            return json.loads(f.read(header_length))
+    except (OSError, struct.error, ValueError):
+        return None
+
+class ReferenceIndex:
+    """
+    通过mmap读取参考索引，按摘要二分查找并从CSV中只读取命中的行
+    使用with语句时退出自动关闭
+    """
+    
+    def __init__(self, csv_path):
+        """
+        打开合并CSV的参考索引；索引不存在、格式不符或CSV内容（哈希）变化时重新生成，
+        只有修改时间变化而内容未变时仅更新文件头
+        
+        Args:
+            csv_path: 合并评测集CSV路径
+        """
+        self.csv_path = csv_path
+        self.index_path = reference_index_path(csv_path)
+        self.settings = load_settings_in(os.path.dirname(csv_path))
+        
+        header = read_index_header(self.index_path)
+        if header is None or header.get('num_perm') != NUM_PERM or not self._stat_matches(header):
+            fingerprint = source_fingerprint(csv_path)
+            source_keys = ('csv_sha256', 'settings_sha256')
+            if header is not None and header.get('num_perm') == NUM_PERM and \
+                    all(header.get(key) == fingerprint[key] for key in source_keys):
+                self._refresh_stat(header, fingerprint)
+            else:
+                build_reference_index(csv_path, fingerprint)
+        
+        self._index_file = open(self.index_path, 'rb')
+        self._index_map = mmap.mmap(self._index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        header_length = PREFIX.unpack(self._index_map[:PREFIX.size])[1]
+        self.header = json.loads(self._index_map[PREFIX.size:PREFIX.size + header_length])
+        
+        self._arrays = _load_arrays(self._index_map, self.header, PREFIX.size + header_length)
+        
+        self.columns = self.header['columns']
+        self._csv_file = open(csv_path, 'rb')
+        self._csv_map = mmap.mmap(self._csv_file.fileno(), 0, access=mmap.ACCESS_READ)
+    
+    def _stat_matches(self, header):
+        settings_path = os.path.join(os.path.dirname(self.csv_path), SETTINGS_FILENAME)
+        stat = os.stat(self.csv_path)
+        if header.get('csv_size') != stat.st_size or header.get('csv_mtime_ns') != stat.st_mtime_ns:
+            return False
+        # 角色设定表较小，直接比较哈希
+        settings_hash = file_content_hash(settings_path) if os.path.exists(settings_path) else None
+        return header.get('settings_sha256') == settings_hash
+    
+    def _refresh_stat(self, header, fingerprint):
+        """CSV内容未变（如被复制或touch）时只更新文件头中的大小和修改时间"""
+        with open(self.index_path, 'rb') as f:
+            data = f.read()
+        header_length = PREFIX.unpack(data[:PREFIX.size])[1]
+        arrays = _load_arrays(data, header, PREFIX.size + header_length)
+        _write_index(self.index_path, dict(header, **fingerprint), list(arrays.items()))
+    
+    def __len__(self):
+        return self.header['rows']
+    
+    @property
+    def duplicates(self):
+        """内容重复的行数"""
+        return self.header['duplicates']
+    
+    def read_row(self, row):
+        """
+        读取CSV中的一行（CHARACTER_ID格式时展开为CHARACTER_SETTING）
+        
+        Args:
+            row: 行号（从0开始，不含表头）
+        
+        Returns:
+            dict: 列名 -> 值
+        """
+        start, stop = self._arrays['spans'][row]
+        record = next(csv.reader(io.StringIO(self._csv_map[start:stop].decode('utf-8'))))
+        values = dict(zip(self.columns, record))
+        if 'CHARACTER_ID' in values and 'CHARACTER_SETTING' not in values:
+            values['CHARACTER_SETTING'] = self.settings.text(values.pop('CHARACTER_ID'))
+        return values
+    
+    def lookup(self, character_setting, dialogue_history):
+        """
+        精确查找内容相同的行
+        
+        Args:
+            character_setting: 角色设定（未规范化）
+            dialogue_history: 对话历史（未规范化）
+        
+        Returns:
+            tuple: (行内容dict或None, 是否为摘要碰撞)
+        """
+        character = normalize_text(character_setting)
+        dialogue = normalize_text(dialogue_history)
+        row = self._find_digest(pair_digest(character, dialogue))
+        if row is None:
+            return None, False
+        
+        # 摘要命中后比对原文，排除碰撞
+        values = self.read_row(row)
+        if normalize_text(values['CHARACTER_SETTING']) != character or \
+                normalize_text(values['DIALOGUE_HISTORY']) != dialogue:
+            return None, True
+        return values, False
+    
+    def lookup_hash(self, row_hash):
+        """
+        按CONTENT_HASH查找行，不比较原文
+        
+        Args:
+            row_hash: 64位十六进制的CONTENT_HASH
+        
+        Returns:
+            dict: 行内容，不存在或格式不符时返回None
+        """
+        try:
+            digest = bytes.fromhex(str(row_hash).strip())
+        except ValueError:
+            return None
+        if len(digest) != ENTRY_DTYPE['digest'].itemsize:
+            return None
+        row = self._find_digest(digest)
+        return self.read_row(row) if row is not None else None
+    
+    def _find_digest(self, digest):
+        key = np.array(digest, dtype='S32')
+        entries = self._arrays['entries']
+        position = np.searchsorted(entries['digest'], key)
+        if position >= len(entries) or entries['digest'][position] != key:
+            return None
+        return int(entries['row'][position])
+    
+    def build_lsh(self):
+        """
+        用索引中保存的MinHash签名构建LSH，近似匹配时按需从CSV读取候选行
+        
+        Returns:
+            MinHashLSH: 键为行号
+        """
+        lsh = MinHashLSH(NUM_PERM, LSH_BANDS, self.header['signature_seed'],
+                         text_lookup=lambda row: self.read_row(row)['DIALOGUE_HISTORY'])
+        sizes = self._arrays['sizes']
+        signatures = self._arrays['signatures']
+        for row in np.flatnonzero(sizes):
+            lsh.add_signature(int(row), signatures[row], int(sizes[row]))
+        return lsh
+    
+    def close(self):
+        """关闭索引和CSV文件"""
+        self._arrays = {}
+        self._index_map.close()
+        self._index_file.close()
+        self._csv_map.close()
+        self._csv_file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
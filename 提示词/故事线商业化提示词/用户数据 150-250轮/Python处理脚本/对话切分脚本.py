@@ -1,10 +1,28 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import argparse
 import pandas as pd
+import numpy as np
 import json
 import os
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
+
+from 会话存储 import SessionStoreWriter
+from 会话目录 import SessionCatalog
+from 轮次扫描 import file_content_hash
+
+# 流式读取时每块的行数
+DEFAULT_CHUNKSIZE = 50000
+
+# 流式读取时session超过这么多行没有新记录即视为结束
+DEFAULT_IDLE_ROWS = 200000
+
+# 流式读取时只加载需要的列
+DIALOG_COLUMNS = ['session_id', 'request_content', 'response_content', 'created_at']
+
+# 两种模式都按字符串读取：session_id类型一致，created_at排序结果一致，不受分块后类型推断的影响
+DIALOG_DTYPES = {'session_id': str, 'request_content': str, 'response_content': str, 'created_at': str}
 
 def process_dialog_csv(csv_file_path):
     """
@@ -44,6 +62,137 @@ def process_dialog_csv(csv_file_path):
     
     return sessions
 
+def sort_by_created_at(dialog_list):
+    """
+    按created_at对单个session的记录做稳定排序，与assemble_conversations的顺序一致（缺失时间的记录排在最后）
+    
+    Args:
+        dialog_list: 单个session的对话记录列表
+    
+    Returns:
+        list: 排序后的对话记录列表
+    """
+    return sorted(dialog_list, key=lambda dialog: (pd.isna(dialog['timestamp']), str(dialog['timestamp'])))
+
+def iter_dialog_sessions(csv_file_path, chunksize=DEFAULT_CHUNKSIZE, idle_rows=DEFAULT_IDLE_ROWS):
+    """
+    分块流式读取对话CSV文件，每当一个session结束就立即产出
+    
+    日志可以按时间排序（不同session的记录交错出现）：每个session的记录先缓存，
+    超过idle_rows行没有出现新记录即视为结束，文件读完时产出剩余的session；
+    产出前按created_at排序，与默认模式写出的对话相同。
+    内存占用只取决于最近idle_rows行内仍活跃的session，与文件大小无关
+    
+    Args:
+        csv_file_path: CSV文件路径
+        chunksize: 每块读取的行数
+        idle_rows: session超过多少行没有新记录即视为结束
+    
+    Yields:
+        tuple: (session_id, 对话列表)，对话列表格式与process_dialog_csv相同
+    """
+    print(f"正在流式读取CSV文件: {csv_file_path} (每块 {chunksize} 行, 空闲 {idle_rows} 行即写出)")
+    
+    reader = pd.read_csv(
+        csv_file_path,
+        usecols=DIALOG_COLUMNS,
+        dtype=DIALOG_DTYPES,
+        chunksize=chunksize
+    )
+    
+    # session_id -> 缓存的记录；按最后出现的位置排列，最久未出现的在最前
+    buffers = OrderedDict()
+    last_seen = {}
+    finished_ids = set()
+    total_rows = 0
+    
+    for chunk in reader:
+        # 按列整体取值，避免逐行构造Series
+        session_ids = chunk['session_id'].to_numpy()
+        timestamps = chunk['created_at'].tolist()
+        user_inputs = chunk['request_content'].fillna('').tolist()
+        assistant_responses = chunk['response_content'].fillna('').tolist()
+        
+        # 找出块内session切换的位置，同一session的连续记录一次性加入缓存
+        change_points = np.flatnonzero(session_ids[1:] != session_ids[:-1]) + 1
+        bounds = [0, *change_points.tolist(), len(chunk)]
+        
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            session_id = session_ids[start]
+            
+            if session_id in finished_ids:
+                raise ValueError(
+                    f"session {session_id} 在空闲 {idle_rows} 行后又出现了新记录，已写出的对话不完整；"
+                    f"请增大 --idle-rows 或使用默认（非流式）模式"
+                )
+            
+            dialogs = buffers.get(session_id)
+            if dialogs is None:
+                dialogs = buffers[session_id] = []
+            else:
+                buffers.move_to_end(session_id)
+            last_seen[session_id] = total_rows + stop
+            
+            dialogs.extend(
+                {
+                    "timestamp": created_at,
+                    "user_input": user_input,
+                    "assistant_response": assistant_response
+                }
+                for created_at, user_input, assistant_response in zip(
+                    timestamps[start:stop],
+                    user_inputs[start:stop],
+                    assistant_responses[start:stop]
+                )
+            )
+        
+        total_rows += len(chunk)
+        
+        # 写出空闲的session
+        while buffers:
+            session_id = next(iter(buffers))
+            if total_rows - last_seen[session_id] < idle_rows:
+                break
+            finished_ids.add(session_id)
+            del last_seen[session_id]
+            yield session_id, sort_by_created_at(buffers.pop(session_id))
+    
+    for session_id, dialogs in buffers.items():
+        yield session_id, sort_by_created_at(dialogs)
+    
+    print(f"总共读取了 {total_rows} 条记录")
+
+def convert_dialog_list(dialog_list):
+    """
+    将单个session的对话记录转换为目标格式
+    
+    Args:
+        dialog_list: 单个session的对话记录列表
+    
+    Returns:
+        list: 包含role和content的对话列表
+    """
+    conversation = []
+    
+    for dialog in dialog_list:
+        # 添加用户消息
+        user_input = dialog['user_input'].strip()
+        if user_input:
+            conversation.append({
+                "role": "user",
+                "content": user_input
+            })
+        
+        # 添加助手消息
+        assistant_response = dialog['assistant_response'].strip()
+        if assistant_response:
+            conversation.append({
+                "role": "assistant",
+                "content": assistant_response
+            })
+    
+    return conversation
+
 def convert_to_target_format(sessions):
     """
     将对话数据转换为目标格式
@@ -57,35 +206,69 @@ def convert_to_target_format(sessions):
     converted_sessions = {}
     
     for session_id, dialog_list in sessions.items():
-        conversation = []
-        
-        for dialog in dialog_list:
-            # 添加用户消息
-            if dialog['user_input'].strip():
-                conversation.append({
-                    "role": "user",
-                    "content": dialog['user_input'].strip()
-                })
-            
-            # 添加助手消息
-            if dialog['assistant_response'].strip():
-                conversation.append({
-                    "role": "assistant",
-                    "content": dialog['assistant_response'].strip()
-                })
-        
+        conversation = convert_dialog_list(dialog_list)
         converted_sessions[session_id] = conversation
         print(f"Session {session_id}: {len(conversation)} 条消息")
     
     return converted_sessions
 
-def save_conversations(converted_sessions, output_dir):
+def assemble_conversations(df, sort=True):
+    """
+    以列运算的方式把对话记录组装为目标格式，结果与convert_to_target_format相同
+    
+    Args:
+        df: 包含session_id、request_content、response_content、created_at列的DataFrame
+        sort: 是否先按session_id和created_at排序（稳定排序，时间相同时保持原顺序）
+    
+    Returns:
+        dict: 转换后的对话数据，session按在日志中首次出现的顺序排列
+    """
+    # 没有任何消息的session也保留为空对话
+    converted_sessions = {session_id: [] for session_id in pd.unique(df['session_id'])}
+    
+    if sort:
+        df = df.sort_values(['session_id', 'created_at'], kind='mergesort')
+    
+    session_ids = df['session_id'].to_numpy(dtype=object)
+    user_contents = df['request_content'].fillna('').astype(str).str.strip().to_numpy(dtype=object)
+    assistant_contents = df['response_content'].fillna('').astype(str).str.strip().to_numpy(dtype=object)
+    
+    # 交错排列为 user0, assistant0, user1, assistant1, ...
+    row_count = len(df)
+    contents = np.empty(2 * row_count, dtype=object)
+    contents[0::2] = user_contents
+    contents[1::2] = assistant_contents
+    roles = np.tile(np.array(['user', 'assistant'], dtype=object), row_count)
+    owners = np.repeat(session_ids, 2)
+    
+    # 去掉空消息
+    keep = contents != ''
+    contents = contents[keep]
+    roles = roles[keep]
+    owners = owners[keep]
+    
+    change_points = np.flatnonzero(owners[1:] != owners[:-1]) + 1
+    bounds = [0, *change_points.tolist(), len(owners)] if len(owners) else [0]
+    
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        converted_sessions[owners[start]] = [
+            {"role": role, "content": content}
+            for role, content in zip(roles[start:stop].tolist(), contents[start:stop].tolist())
+        ]
+    
+    for session_id, conversation in converted_sessions.items():
+        print(f"Session {session_id}: {len(conversation)} 条消息")
+    
+    return converted_sessions
+
+def save_conversations(converted_sessions, output_dir, catalog=None):
     """
     保存转换后的对话到文件
     
     Args:
         converted_sessions: 转换后的对话数据
         output_dir: 输出目录
+        catalog: 会话目录，不为None时登记每个写出的session
     """
     # 创建输出目录
     os.makedirs(output_dir, exist_ok=True)
@@ -101,32 +284,112 @@ def save_conversations(converted_sessions, output_dir):
         with open(filepath, 'w', encoding='utf-8') as f:
             json.dump(conversation, f, ensure_ascii=False, indent=2)
         
+        if catalog is not None:
+            catalog.record_conversation(session_id, conversation, filepath, file_content_hash(filepath))
+        
         print(f"保存对话: {filepath} ({len(conversation)} 条消息)")
     
-    # 保存所有对话到一个文件
-    all_conversations_file = os.path.join(output_dir, "all_conversations.json")
-    with open(all_conversations_file, 'w', encoding='utf-8') as f:
-        json.dump(converted_sessions, f, ensure_ascii=False, indent=2)
+    # 保存所有对话到JSONL会话存储（每行一个session，附带偏移索引）
+    all_conversations_file = os.path.join(output_dir, "all_conversations.jsonl")
+    with SessionStoreWriter(all_conversations_file, overwrite=True) as store:
+        for session_id, conversation in converted_sessions.items():
+            store.write_session(session_id, conversation)
     
     print(f"保存所有对话: {all_conversations_file}")
 
+def save_conversations_streaming(session_iter, output_dir, catalog=None):
+    """
+    边读取边保存对话，不在内存中保留已完成的session
+    
+    Args:
+        session_iter: 产出(session_id, 对话记录列表)的迭代器
+        output_dir: 输出目录
+        catalog: 会话目录，不为None时登记每个写出的session
+    
+    Returns:
+        tuple: (会话数, 总消息数)
+    """
+    # 创建输出目录
+    os.makedirs(output_dir, exist_ok=True)
+    
+    all_conversations_file = os.path.join(output_dir, "all_conversations.jsonl")
+    session_count = 0
+    total_messages = 0
+    
+    with SessionStoreWriter(all_conversations_file, overwrite=True) as store:
+        for session_id, dialog_list in session_iter:
+            conversation = convert_dialog_list(dialog_list)
+            
+            if conversation:  # 跳过空对话
+                filename = f"session_{session_id}.json"
+                filepath = os.path.join(output_dir, filename)
+                
+                with open(filepath, 'w', encoding='utf-8') as f:
+                    json.dump(conversation, f, ensure_ascii=False, indent=2)
+                
+                if catalog is not None:
+                    catalog.record_conversation(session_id, conversation, filepath, file_content_hash(filepath))
+                
+                print(f"保存对话: {filepath} ({len(conversation)} 条消息)")
+            
+            # 逐个追加到会话存储
+            store.write_session(session_id, conversation)
+            
+            session_count += 1
+            total_messages += len(conversation)
+    
+    print(f"保存所有对话: {all_conversations_file}")
+    
+    return session_count, total_messages
+
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description='按session_id切分对话CSV文件')
     # CSV文件路径
-    csv_file = "/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/固定内容session150轮至250轮对话日志.csv"
-    
+    parser.add_argument('--csv-file', default="/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/固定内容session150轮至250轮对话日志.csv",
+                        help='对话日志CSV文件路径')
     # 输出目录
-    output_dir = "/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/切分后的对话"
+    parser.add_argument('--output-dir', default="/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/切分后的对话",
+                        help='输出目录')
+    parser.add_argument('--stream', action='store_true',
+                        help='分块流式读取，适用于超大日志文件；日志可以按时间排序（session交错），'
+                             '但同一session相邻两条记录的间隔不能超过--idle-rows行')
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE,
+                        help='流式模式下每块读取的行数')
+    parser.add_argument('--idle-rows', type=int, default=DEFAULT_IDLE_ROWS,
+                        help='流式模式下session超过多少行没有新记录即写出；按session_id排序的日志可以设小以节省内存')
+    parser.add_argument('--catalog', default="/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/会话目录.sqlite",
+                        help='会话目录(SQLite)路径，传空字符串则不登记')
+    args = parser.parse_args()
+    
+    csv_file = args.csv_file
+    output_dir = args.output_dir
+    
+    catalog = SessionCatalog(args.catalog) if args.catalog else None
     
     try:
-        # 处理CSV文件
-        sessions = process_dialog_csv(csv_file)
+        if args.stream:
+            # 流式处理，session结束即写出
+            session_count, total_messages = save_conversations_streaming(
+                iter_dialog_sessions(csv_file, args.chunksize, args.idle_rows), output_dir, catalog
+            )
+            
+            print("\n=== 处理完成 ===")
+            print(f"共处理了 {session_count} 个会话")
+            print(f"结果保存在: {output_dir}")
+            print(f"总消息数: {total_messages}")
+            return
+        
+        # 读取CSV文件
+        print(f"正在读取CSV文件: {csv_file}")
+        df = pd.read_csv(csv_file, usecols=DIALOG_COLUMNS, dtype=DIALOG_DTYPES)
+        print(f"总共读取了 {len(df)} 条记录")
         
-        # 转换为目标格式
-        converted_sessions = convert_to_target_format(sessions)
+        # 按列组装为目标格式
+        converted_sessions = assemble_conversations(df)
         
         # 保存结果
-        save_conversations(converted_sessions, output_dir)
+        save_conversations(converted_sessions, output_dir, catalog)
         
         print("\n=== 处理完成 ===")
         print(f"共处理了 {len(converted_sessions)} 个会话")
@@ -146,6 +409,9 @@ def main():
     except Exception as e:
         print(f"处理过程中出现错误: {str(e)}")
         raise
+    finally:
+        if catalog is not None:
+            catalog.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
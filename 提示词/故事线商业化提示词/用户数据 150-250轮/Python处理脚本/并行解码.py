@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+并行解码工具
+把体积较大的JSON字段分批分发到进程池解码，结果保持输入顺序
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# 少于该数量时直接串行处理，避免进程池的启动开销
+MIN_PARALLEL_ITEMS = 200
+
+# 每个进程平均分到的批次数，用于自动计算批大小
+BATCHES_PER_JOB = 4
+
+def resolve_jobs(jobs):
+    """
+    解析并行进程数
+    
+    Args:
+        jobs: 进程数，None或小于1时使用全部CPU核
+    
+    Returns:
+        int: 实际使用的进程数
+    """
+    if jobs is None or jobs < 1:
+        return os.cpu_count() or 1
+    return jobs
+
+def parallel_map(func, items, jobs=None, batch_size=None, min_parallel=MIN_PARALLEL_ITEMS):
+    """
+    在进程池中按批执行func，返回结果与items顺序一致
+    
+    Args:
+        func: 解码函数，必须定义在模块顶层以便子进程调用
+        items: 待解码的数据
+        jobs: 进程数，None时使用全部CPU核，1表示串行
+        batch_size: 每批分发的条数，None时按进程数自动计算
+        min_parallel: 数据量低于该值时串行处理
+    
+    Returns:
+        list: 解码结果
+    """
+    items = list(items)
+    jobs = resolve_jobs(jobs)
+    
+    if jobs <= 1 or len(items) < min_parallel:
+        return [func(item) for item in items]
+    
+    if batch_size is None:
+        batch_size = max(1, len(items) // (jobs * BATCHES_PER_JOB))
+    
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(func, items, chunksize=batch_size))
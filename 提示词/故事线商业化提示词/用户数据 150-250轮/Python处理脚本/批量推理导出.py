@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量推理JSONL导出
+每个分段生成一条chat请求（CHARACTER_SETTING作为system消息，DIALOGUE_HISTORY作为后续消息），
+按请求数和文件字节数自动分片，并写出custom_id到SESSION_ID/SEGMENT_INFO的对照清单；
+custom_id即评测集的ROW_ID
+"""
+
+import json
+import os
+
+# 批量推理文件所在的子目录
+BATCH_DIRNAME = "批量推理"
+
+# 分片文件名，如 批量推理_part001.jsonl
+SHARD_FILENAME = "批量推理_part{:03d}.jsonl"
+
+# custom_id对照清单
+MANIFEST_FILENAME = "批量推理清单.jsonl"
+
+# 单个分片的默认上限（与常见批量推理接口的限制一致）
+DEFAULT_MAX_REQUESTS = 50000
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+
+# 请求的接口路径
+DEFAULT_URL = "/v1/chat/completions"
+
+class BatchRequestWriter:
+    """
+    逐session写入批量推理请求，接口与评测集生成脚本的MergedCsvWriter一致
+    """
+    
+    def __init__(self, output_dir, settings, model=None, max_requests=DEFAULT_MAX_REQUESTS,
+                 max_bytes=DEFAULT_MAX_BYTES, url=DEFAULT_URL):
+        """
+        Args:
+            output_dir: 评测集输出目录，请求文件写到其中的批量推理子目录
+            settings: 角色设定表
+            model: 请求体中的model，None时不写入
+            max_requests: 每个分片的最大请求数
+            max_bytes: 每个分片的最大字节数
+            url: 请求的接口路径
+        """
+        if max_requests < 1 or max_bytes < 1:
+            raise ValueError("分片的请求数和字节数上限必须为正数")
+        
+        self.settings = settings
+        self.model = model
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.url = url
+        self.batch_dir = os.path.join(output_dir, BATCH_DIRNAME)
+        os.makedirs(self.batch_dir, exist_ok=True)
+        
+        # 清理上次导出的分片，避免残留旧请求
+        for filename in os.listdir(self.batch_dir):
+            if filename.startswith("批量推理_part") and filename.endswith('.jsonl'):
+                os.remove(os.path.join(self.batch_dir, filename))
+        
+        self.shard_files = []
+        self.total_requests = 0
+        self._shard = None
+        self._shard_requests = 0
+        self._shard_bytes = 0
+        self._manifest = open(os.path.join(self.batch_dir, MANIFEST_FILENAME), 'w', encoding='utf-8')
+    
+    def _open_shard(self):
+        if self._shard is not None:
+            self._shard.close()
+        filename = SHARD_FILENAME.format(len(self.shard_files) + 1)
+        self.shard_files.append(filename)
+        self._shard = open(os.path.join(self.batch_dir, filename), 'wb')
+        self._shard_requests = 0
+        self._shard_bytes = 0
+    
+    def write_session(self, session_data):
+        """登记一个session，之后用write_segment写入它的分段"""
+        self._session_label = f"{session_data['total_rounds']}轮对话_session{session_data['session_id']}"
+        system_message = {'role': 'system', 'content': self.settings.text(session_data['character_id'])}
+        self._system_json = json.dumps(system_message, ensure_ascii=False, separators=(',', ':'))
+    
+    def write_segment(self, segment):
+        """写入当前session的一个分段"""
+        custom_id = segment['row_id']
+        
+        # DIALOGUE_HISTORY已是紧凑的JSON数组，直接拼接到system消息之后，无需重新解析
+        dialogue = segment['dialogue_history']
+        if dialogue.strip() == '[]':
+            messages = f"[{self._system_json}]"
+        else:
+            messages = f"[{self._system_json},{dialogue.strip()[1:]}"
+        
+        body_prefix = '{' + (f'"model":{json.dumps(self.model, ensure_ascii=False)},' if self.model else '')
+        line = (
+            f'{{"custom_id":{json.dumps(custom_id)},"method":"POST","url":{json.dumps(self.url)},'
+            f'"body":{body_prefix}"messages":{messages}}}}}\n'
+        ).encode('utf-8')
+        
+        # 超过任一上限时换到新的分片（单条请求超过字节上限时单独成片）
+        if (self._shard is None or self._shard_requests >= self.max_requests
+                or (self._shard_requests and self._shard_bytes + len(line) > self.max_bytes)):
+            self._open_shard()
+        
+        self._shard.write(line)
+        self._shard_requests += 1
+        self._shard_bytes += len(line)
+        self.total_requests += 1
+        
+        self._manifest.write(json.dumps({
+            'custom_id': custom_id,
+            'SESSION_ID': self._session_label,
+            'SEGMENT_INFO': segment['segment_info'],
+            'CONTENT_HASH': segment['content_hash'],
+            'shard': self.shard_files[-1]
+        }, ensure_ascii=False) + '\n')
+    
+    def close(self):
+        """
+        关闭所有文件
+        
+        Returns:
+            list: 分片文件名
+        """
+        if self._shard is not None:
+            self._shard.close()
+        self._manifest.close()
+        print(f"生成批量推理请求: {self.total_requests}条, {len(self.shard_files)}个分片 ({self.batch_dir})")
+        return self.shard_files
+
+def load_manifest(batch_dir):
+    """
+    读取custom_id对照清单
+    
+    Args:
+        batch_dir: 批量推理目录
+    
+    Returns:
+        dict: custom_id -> {'SESSION_ID', 'SEGMENT_INFO', 'CONTENT_HASH', 'shard'}
+    """
+    manifest = {}
+    with open(os.path.join(batch_dir, MANIFEST_FILENAME), 'r', encoding='utf-8') as f:
+        for line in f:
+            entry = json.loads(line)
+            manifest[entry.pop('custom_id')] = entry
+    return manifest
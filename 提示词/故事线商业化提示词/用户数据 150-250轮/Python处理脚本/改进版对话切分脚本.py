@@ -1,12 +1,24 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import argparse
 import pandas as pd
 import json
 import os
 from collections import defaultdict
 import re
 
+from 会话存储 import SessionStoreWriter
+from 会话目录 import SessionCatalog
+from 轮次扫描 import file_content_hash
+from 并行解码 import parallel_map
+
+# 角色标记，如 |<角色名&性别>|
+ROLE_TAG_PATTERN = re.compile(r'\|<[^>]+>\|')
+
+# 连续的空白字符
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
 def extract_dialog_from_messages(messages_str):
     """
     从messages字符串中提取完整的对话历史
@@ -35,12 +47,87 @@ def extract_dialog_from_messages(messages_str):
     except (json.JSONDecodeError, TypeError, KeyError):
         return []
 
-def process_enhanced_dialog_csv(csv_file_path):
+def find_full_dialogs(df, jobs=None):
+    """
+    从messages字段提取每个session最新的完整对话历史
+    
+    messages是累积的完整历史，只需解码每个session最后一条；
+    只有最后一条无法解析或为空时，才依次向前回退
+    
+    Args:
+        df: 包含session_id和messages列的DataFrame
+        jobs: 并行解码的进程数，None时使用全部CPU核
+    
+    Returns:
+        dict: session_id -> 对话列表
+    """
+    sessions_full = {}
+    
+    if 'messages' not in df.columns:
+        return sessions_full
+    
+    rows = df.loc[df['messages'].notna(), ['session_id', 'messages']]
+    last_rows = rows.drop_duplicates('session_id', keep='last')
+    
+    # 每个session的最后一条分发到进程池解码
+    decoded = parallel_map(extract_dialog_from_messages, last_rows['messages'].tolist(), jobs)
+    
+    unresolved = set()
+    for session_id, messages_dialog in zip(last_rows['session_id'].tolist(), decoded):
+        if messages_dialog:
+            sessions_full[session_id] = messages_dialog
+        else:
+            unresolved.add(session_id)
+    
+    if unresolved:
+        # 逆序回退到更早的记录
+        earlier_rows = rows.drop(last_rows.index)
+        earlier_rows = earlier_rows[earlier_rows['session_id'].isin(unresolved)]
+        for session_id, messages_str in zip(reversed(earlier_rows['session_id'].tolist()),
+                                            reversed(earlier_rows['messages'].tolist())):
+            if session_id not in unresolved:
+                continue
+            messages_dialog = extract_dialog_from_messages(messages_str)
+            if messages_dialog:
+                sessions_full[session_id] = messages_dialog
+                unresolved.discard(session_id)
+    
+    return sessions_full
+
+def build_simple_dialogs(df, session_ids):
+    """
+    从request_content和response_content构建简单对话
+    
+    Args:
+        df: 对话记录DataFrame
+        session_ids: 需要构建的session_id集合
+    
+    Returns:
+        dict: session_id -> 对话列表
+    """
+    sessions_simple = defaultdict(list)
+    
+    rows = df[df['session_id'].isin(session_ids)]
+    for session_id, request_content, response_content in zip(rows['session_id'].tolist(),
+                                                              rows['request_content'].tolist(),
+                                                              rows['response_content'].tolist()):
+        request_content = str(request_content).strip() if pd.notna(request_content) else ""
+        response_content = str(response_content).strip() if pd.notna(response_content) else ""
+        
+        if request_content:
+            sessions_simple[session_id].append({"role": "user", "content": request_content})
+        if response_content:
+            sessions_simple[session_id].append({"role": "assistant", "content": response_content})
+    
+    return sessions_simple
+
+def process_enhanced_dialog_csv(csv_file_path, jobs=None):
     """
     处理对话CSV文件，优先从messages字段提取完整对话历史
     
     Args:
         csv_file_path: CSV文件路径
+        jobs: 并行解码的进程数，None时使用全部CPU核
     
     Returns:
         dict: 按session_id组织的对话数据
@@ -51,42 +138,23 @@ def process_enhanced_dialog_csv(csv_file_path):
     df = pd.read_csv(csv_file_path)
     print(f"总共读取了 {len(df)} 条记录")
     
-    # 按session_id分组，保存完整的对话历史
-    sessions_full = defaultdict(list)
-    sessions_simple = defaultdict(list)
+    # 方式1：每个session只解码最后一条messages
+    sessions_full = find_full_dialogs(df, jobs)
     
-    for idx, row in df.iterrows():
-        session_id = row['session_id']
-        
-        # 方式1：从messages字段提取完整对话
-        if pd.notna(row.get('messages')):
-            messages_dialog = extract_dialog_from_messages(row['messages'])
-            if messages_dialog:
-                # 只保留最新的完整对话历史（去重）
-                sessions_full[session_id] = messages_dialog
-        
-        # 方式2：从request_content和response_content构建简单对话
-        request_content = str(row['request_content']) if pd.notna(row['request_content']) else ""
-        response_content = str(row['response_content']) if pd.notna(row['response_content']) else ""
-        
-        dialog_pair = []
-        if request_content.strip():
-            dialog_pair.append({"role": "user", "content": request_content.strip()})
-        if response_content.strip():
-            dialog_pair.append({"role": "assistant", "content": response_content.strip()})
-        
-        if dialog_pair:
-            sessions_simple[session_id].extend(dialog_pair)
+    # 方式2：仅为没有可用messages的session构建简单对话
+    all_session_ids = pd.unique(df['session_id']).tolist()
+    missing_ids = [session_id for session_id in all_session_ids if session_id not in sessions_full]
+    sessions_simple = build_simple_dialogs(df, missing_ids) if missing_ids else {}
     
     # 合并结果，优先使用messages字段的完整对话
     final_sessions = {}
     
-    for session_id in set(list(sessions_full.keys()) + list(sessions_simple.keys())):
-        if session_id in sessions_full and sessions_full[session_id]:
+    for session_id in all_session_ids:
+        if session_id in sessions_full:
             # 使用messages字段的完整对话历史
             final_sessions[session_id] = sessions_full[session_id]
             print(f"Session {session_id}: 使用messages字段，{len(sessions_full[session_id])} 条消息")
-        elif session_id in sessions_simple and sessions_simple[session_id]:
+        elif sessions_simple.get(session_id):
             # 使用简单构建的对话
             final_sessions[session_id] = sessions_simple[session_id]
             print(f"Session {session_id}: 使用简单构建，{len(sessions_simple[session_id])} 条消息")
@@ -102,86 +170,114 @@ def clean_dialog_content(content):
         return content
         
     # 去除角色标记，如 |<角色名&性别>|
-    content = re.sub(r'\|<[^>]+>\|', '', content)
+    content = ROLE_TAG_PATTERN.sub('', content)
     
     # 清理多余的空白字符
-    content = re.sub(r'\s+', ' ', content).strip()
+    content = WHITESPACE_PATTERN.sub(' ', content).strip()
     
     return content
 
-def save_enhanced_conversations(sessions, output_dir):
+def normalize_sessions(sessions, keep_raw=False):
     """
-    保存转换后的对话到文件
+    清理所有会话的消息内容，每条消息只清理一次，结果供所有输出共用
     
     Args:
-        sessions: 转换后的对话数据
-        output_dir: 输出目录
+        sessions: 按session_id组织的对话数据
+        keep_raw: 是否保留原始内容；只在清理后内容有变化的消息上添加raw_content字段
+    
+    Returns:
+        dict: 清理后的对话数据（清理后为空的消息和会话会被去掉）
     """
-    # 创建输出目录
-    os.makedirs(output_dir, exist_ok=True)
+    normalized_sessions = {}
     
-    # 保存每个session的对话
     for session_id, conversation in sessions.items():
-        if not conversation:  # 跳过空对话
-            continue
-        
-        # 清理对话内容
         cleaned_conversation = []
-        for msg in conversation:
-            cleaned_content = clean_dialog_content(msg['content'])
-            if cleaned_content:
-                cleaned_conversation.append({
-                    "role": msg['role'],
-                    "content": cleaned_content
-                })
         
-        if not cleaned_conversation:
-            continue
+        for msg in conversation:
+            raw_content = msg['content']
+            cleaned_content = clean_dialog_content(raw_content)
+            if not cleaned_content:
+                continue
             
+            cleaned_msg = {
+                "role": msg['role'],
+                # 内容未变时直接复用原字符串
+                "content": raw_content if cleaned_content == raw_content else cleaned_content
+            }
+            if keep_raw and cleaned_msg['content'] is not raw_content:
+                cleaned_msg['raw_content'] = raw_content
+            cleaned_conversation.append(cleaned_msg)
+        
+        if cleaned_conversation:
+            normalized_sessions[session_id] = cleaned_conversation
+    
+    return normalized_sessions
+
+def save_enhanced_conversations(normalized_sessions, output_dir, catalog=None):
+    """
+    保存清理后的对话到文件
+    
+    Args:
+        normalized_sessions: normalize_sessions清理后的对话数据
+        output_dir: 输出目录
+        catalog: 会话目录，不为None时登记每个写出的session
+    """
+    # 创建输出目录
+    os.makedirs(output_dir, exist_ok=True)
+    
+    # 保存每个session的对话
+    for session_id, conversation in normalized_sessions.items():
         filename = f"session_{session_id}.json"
         filepath = os.path.join(output_dir, filename)
         
         with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(cleaned_conversation, f, ensure_ascii=False, indent=2)
+            json.dump(conversation, f, ensure_ascii=False, indent=2)
         
-        print(f"保存对话: {filepath} ({len(cleaned_conversation)} 条消息)")
+        if catalog is not None:
+            catalog.record_conversation(session_id, conversation, filepath, file_content_hash(filepath))
+        
+        print(f"保存对话: {filepath} ({len(conversation)} 条消息)")
     
-    # 保存所有对话到一个文件
-    all_conversations_file = os.path.join(output_dir, "all_conversations_enhanced.json")
+    # 保存所有对话到JSONL会话存储（每行一个session，附带偏移索引）
+    all_conversations_file = os.path.join(output_dir, "all_conversations_enhanced.jsonl")
     
-    # 为所有对话创建清理后的版本
-    all_cleaned = {}
-    for session_id, conversation in sessions.items():
-        cleaned_conversation = []
-        for msg in conversation:
-            cleaned_content = clean_dialog_content(msg['content'])
-            if cleaned_content:
-                cleaned_conversation.append({
-                    "role": msg['role'],
-                    "content": cleaned_content
-                })
-        if cleaned_conversation:
-            all_cleaned[session_id] = cleaned_conversation
-    
-    with open(all_conversations_file, 'w', encoding='utf-8') as f:
-        json.dump(all_cleaned, f, ensure_ascii=False, indent=2)
+    with SessionStoreWriter(all_conversations_file, overwrite=True) as store:
+        for session_id, conversation in normalized_sessions.items():
+            store.write_session(session_id, conversation)
     
     print(f"保存所有对话: {all_conversations_file}")
 
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description='按session_id切分对话CSV文件（优先使用messages字段）')
     # CSV文件路径
-    csv_file = "/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/固定内容session150轮至250轮对话日志.csv"
-    
+    parser.add_argument('--csv-file', default="/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/固定内容session150轮至250轮对话日志.csv",
+                        help='对话日志CSV文件路径')
     # 输出目录
-    output_dir = "/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/改进版切分后的对话"
+    parser.add_argument('--output-dir', default="/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/改进版切分后的对话",
+                        help='输出目录')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='并行解码messages的进程数，默认使用全部CPU核，1表示串行')
+    parser.add_argument('--keep-raw', action='store_true',
+                        help='在被清理改动过的消息上同时保留原始内容(raw_content)')
+    parser.add_argument('--catalog', default="/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/会话目录.sqlite",
+                        help='会话目录(SQLite)路径，传空字符串则不登记')
+    args = parser.parse_args()
+    
+    csv_file = args.csv_file
+    output_dir = args.output_dir
+    
+    catalog = SessionCatalog(args.catalog) if args.catalog else None
     
     try:
         # 处理CSV文件
-        sessions = process_enhanced_dialog_csv(csv_file)
+        sessions = process_enhanced_dialog_csv(csv_file, args.jobs)
+        
+        # 清理对话内容（只清理一次）
+        normalized_sessions = normalize_sessions(sessions, args.keep_raw)
         
         # 保存结果
-        save_enhanced_conversations(sessions, output_dir)
+        save_enhanced_conversations(normalized_sessions, output_dir, catalog)
         
         print("\n=== 改进版处理完成 ===")
         print(f"共处理了 {len(sessions)} 个会话")
@@ -201,6 +297,9 @@ def main():
     except Exception as e:
         print(f"处理过程中出现错误: {str(e)}")
         raise
+    finally:
+        if catalog is not None:
+            catalog.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
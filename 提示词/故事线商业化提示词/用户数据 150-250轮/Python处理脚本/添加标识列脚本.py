@@ -1,173 +1,307 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import pandas as pd
+import argparse
 import json
 import os
-from openpyxl import load_workbook
-from openpyxl.styles import Alignment, Font
 
-def load_reference_data():
+from 会话目录 import MERGED_CSV_ARTIFACT, SessionCatalog
+from 参考索引 import ReferenceIndex, normalize_text
+from 近似匹配 import DEFAULT_THRESHOLD
+from CSV转Excel脚本 import (
+    COLUMN_WIDTHS, DEFAULT_COLUMN_WIDTH, SIDECAR_MARKER, EvalWorkbookWriter, read_eval_workbook, resolve_spilled_value
+)
+
+# 用于匹配的列，评测完成的文件中必须包含
+KEY_COLUMNS = ['CHARACTER_SETTING', 'DIALOGUE_HISTORY']
+
+# 补充的标识列，放在最前面；ROW_ID和CONTENT_HASH来自参考数据（旧版合并CSV中没有时为空）
+IDENTIFIER_COLUMNS = ['SESSION_ID', 'SEGMENT_INFO', 'ROW_ID', 'CONTENT_HASH']
+
+# 评测平台保留了CONTENT_HASH列时，直接按哈希查找，不再比较原文
+HASH_COLUMN = 'CONTENT_HASH'
+
+def load_reference_data(catalog_path=None):
     """
-    加载原始的合并评测集作为参考数据
+    打开原始合并评测集的参考索引作为参考数据
+    会话目录中登记了合并评测集时使用登记的路径；索引由评测集生成脚本写在合并CSV旁边，
+    不存在或CSV内容已变化时在这里重新生成
+    
+    Returns:
+        ReferenceIndex: 参考索引，失败时返回None
     """
     reference_csv_path = "/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/评测集CSV/合并总评测集_全部轮次对话.csv"
     
+    if catalog_path and os.path.exists(catalog_path):
+        with SessionCatalog(catalog_path) as catalog:
+            reference_csv_path = catalog.get_artifact(MERGED_CSV_ARTIFACT) or reference_csv_path
+    
     try:
-        reference_df = pd.read_csv(reference_csv_path, encoding='utf-8')
-        print(f"成功加载参考数据: {len(reference_df)} 行")
-        return reference_df
+        reference = ReferenceIndex(reference_csv_path)
+        print(f"成功加载参考数据: {len(reference)} 行")
+        return reference
     except Exception as e:
         print(f"加载参考数据失败: {str(e)}")
         return None
 
-def match_session_info(target_df, reference_df):
+def read_result_rows(input_file, keep_columns=None):
     """
-    根据CHARACTER_SETTING和DIALOGUE_HISTORY匹配SESSION_ID和SEGMENT_INFO
-    """
-    print("开始匹配SESSION_ID和SEGMENT_INFO...")
-    
-    # 为目标数据添加新列
-    target_df['SESSION_ID'] = ''
-    target_df['SEGMENT_INFO'] = ''
+    以只读模式逐行读取评测完成的Excel文件，只取出需要的列
+    第一个工作表之后表头相同的工作表（行数超限时拆分出的续表）会接着读取
     
-    match_count = 0
-    
-    for idx, target_row in target_df.iterrows():
-        target_character = target_row['CHARACTER_SETTING']
-        target_dialogue = target_row['DIALOGUE_HISTORY']
-        
-        # 在参考数据中查找匹配项
-        for _, ref_row in reference_df.iterrows():
-            ref_character = ref_row['CHARACTER_SETTING']
-            ref_dialogue = ref_row['DIALOGUE_HISTORY']
-            
-            # 精确匹配CHARACTER_SETTING和DIALOGUE_HISTORY
-            if target_character == ref_character and target_dialogue == ref_dialogue:
-                target_df.at[idx, 'SESSION_ID'] = ref_row['SESSION_ID']
-                target_df.at[idx, 'SEGMENT_INFO'] = ref_row['SEGMENT_INFO']
-                match_count += 1
-                print(f"匹配成功 {match_count}/{len(target_df)}: {ref_row['SESSION_ID']} - {ref_row['SEGMENT_INFO']}")
-                break
-        
-        if target_df.at[idx, 'SESSION_ID'] == '':
-            print(f"未找到匹配项 (行 {idx + 1})")
+    Args:
+        input_file: Excel文件路径
+        keep_columns: 除匹配用的列之外保留的列（如模型回答、评分），None表示保留全部
     
-    print(f"匹配完成: {match_count}/{len(target_df)} 行成功匹配")
-    return target_df
-
-def reorder_columns(df):
+    Returns:
+        tuple: (列名列表, 行的迭代器)；列名以KEY_COLUMNS开头，输入含CONTENT_HASH列时紧随其后，
+               空单元格读为空字符串
     """
-    重新排列列的顺序，将SESSION_ID和SEGMENT_INFO放在前面
-    """
-    # 获取所有列名
-    all_columns = df.columns.tolist()
+    sheet_rows = read_eval_workbook(input_file)
+    sheet_header = next(sheet_rows)
     
-    # 定义新的列顺序
-    ordered_columns = ['SESSION_ID', 'SEGMENT_INFO', 'CHARACTER_SETTING', 'DIALOGUE_HISTORY']
+    missing = [column for column in KEY_COLUMNS if column not in sheet_header]
+    if missing:
+        sheet_rows.close()
+        raise ValueError(f"{os.path.basename(input_file)} 缺少列: {', '.join(missing)}")
     
-    # 添加其他列（除了已经指定的）
-    for col in all_columns:
-        if col not in ordered_columns:
-            ordered_columns.append(col)
+    others = [column for column in sheet_header if column and column not in KEY_COLUMNS + IDENTIFIER_COLUMNS]
+    if keep_columns is not None:
+        unknown = [column for column in keep_columns if column not in sheet_header]
+        if unknown:
+            sheet_rows.close()
+            raise ValueError(f"{os.path.basename(input_file)} 中没有列: {', '.join(unknown)}")
+        others = [column for column in others if column in keep_columns]
     
-    # 只保留实际存在的列
-    final_columns = [col for col in ordered_columns if col in all_columns]
+    header = KEY_COLUMNS + ([HASH_COLUMN] if HASH_COLUMN in sheet_header else []) + others
+    positions = [sheet_header.index(column) for column in header]
     
-    return df[final_columns]
+    return header, ([row[position] for position in positions] for row in sheet_rows)
 
-def save_with_formatting(df, output_path):
+class SessionMatcher:
     """
-    保存为Excel文件并设置格式
+    逐行匹配SESSION_ID和SEGMENT_INFO，并汇总匹配报告
+    有CONTENT_HASH时直接按哈希查找；否则在参考索引中按摘要精确查找；
+    都失败时按DIALOGUE_HISTORY做近似匹配（第一次需要时才构建LSH）
     """
-    with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='评测数据')
+    
+    def __init__(self, reference, fuzzy_threshold=DEFAULT_THRESHOLD):
+        """
+        Args:
+            reference: 参考索引
+            fuzzy_threshold: 近似匹配的置信阈值，None表示只做精确匹配
+        """
+        self.reference = reference
+        self.fuzzy_threshold = fuzzy_threshold
+        self.total_rows = 0
+        self.exact_count = 0
+        self.hash_count = 0
+        self.collisions = 0
+        self.fuzzy_rows = []
+        self.unmatched_rows = []
+        self._lsh = None
         
-        # 获取工作簿和工作表
-        workbook = writer.book
-        worksheet = writer.sheets['评测数据']
+        if reference.duplicates:
+            print(f"参考数据中有 {reference.duplicates} 行内容重复，匹配时使用第一次出现的行")
+    
+    def match(self, character_setting, dialogue_history, row_hash=None):
+        """
+        匹配一行
         
-        # 设置列宽
-        worksheet.column_dimensions['A'].width = 40  # SESSION_ID列
-        worksheet.column_dimensions['B'].width = 20  # SEGMENT_INFO列
-        worksheet.column_dimensions['C'].width = 80  # CHARACTER_SETTING列
-        worksheet.column_dimensions['D'].width = 100  # DIALOGUE_HISTORY列
+        Args:
+            character_setting: 角色设定
+            dialogue_history: 对话历史
+            row_hash: 评测结果中保留的CONTENT_HASH，没有时为None或空字符串
         
-        # 如果有更多列，设置默认宽度
-        for col_num in range(5, len(df.columns) + 1):
-            column_letter = chr(64 + col_num)  # E, F, G, ...
-            worksheet.column_dimensions[column_letter].width = 50
+        Returns:
+            tuple: 按IDENTIFIER_COLUMNS顺序的标识，未匹配时均为空字符串
+        """
+        self.total_rows += 1
+        row_number = self.total_rows
         
-        # 设置单元格格式
-        for row in worksheet.iter_rows():
-            for cell in row:
-                # 设置文本对齐方式
-                cell.alignment = Alignment(
-                    horizontal='left',
-                    vertical='top',
-                    wrap_text=True
-                )
-                
-                # 设置字体
-                if cell.row == 1:  # 标题行
-                    cell.font = Font(bold=True, size=12)
-                else:
-                    cell.font = Font(size=10)
+        if row_hash:
+            matched = self.reference.lookup_hash(row_hash)
+            if matched is not None:
+                self.exact_count += 1
+                self.hash_count += 1
+                return self._identifiers(matched)
         
-        # 设置行高
-        for row_num in range(2, len(df) + 2):  # 从第2行开始（跳过标题行）
-            worksheet.row_dimensions[row_num].height = 100  # 设置较大的行高以容纳多行文本
+        matched, collision = self.reference.lookup(character_setting, dialogue_history)
+        self.collisions += collision
+        if matched is not None:
+            self.exact_count += 1
+            return self._identifiers(matched)
+        
+        unmatched = {
+            'row': row_number,
+            'dialogue_preview': normalize_text(dialogue_history)[:100]
+        }
+        
+        # 近似匹配，结果附带相似度分数
+        if self.fuzzy_threshold is not None:
+            if self._lsh is None:
+                print(f"构建近似匹配索引 (阈值 {self.fuzzy_threshold})...")
+                # 签名已保存在参考索引中，这里只需分桶
+                self._lsh = self.reference.build_lsh()
+            
+            best = self._lsh.best_match(dialogue_history)
+            if best is not None and best['score'] >= self.fuzzy_threshold:
+                matched = self.reference.read_row(best['key'])
+                identifiers = self._identifiers(matched)
+                self.fuzzy_rows.append(dict(
+                    zip(IDENTIFIER_COLUMNS, identifiers), row=row_number, score=best['score'], jaccard=best['jaccard']
+                ))
+                return identifiers
+            if best is not None:
+                unmatched['best_score'] = best['score']
+        
+        self.unmatched_rows.append(unmatched)
+        return ('',) * len(IDENTIFIER_COLUMNS)
+    
+    @staticmethod
+    def _identifiers(matched):
+        return tuple(matched.get(column, '') for column in IDENTIFIER_COLUMNS)
+    
+    def report(self):
+        """
+        打印匹配结果并返回匹配报告
+        
+        Returns:
+            dict: 匹配报告
+        """
+        match_count = self.total_rows - len(self.unmatched_rows)
+        print(f"匹配完成: {match_count}/{self.total_rows} 行成功匹配 (精确 {self.exact_count}, 近似 {len(self.fuzzy_rows)})")
+        for unmatched in self.unmatched_rows[:10]:
+            print(f"未找到匹配项 (行 {unmatched['row']})")
+        if len(self.unmatched_rows) > 10:
+            print(f"... 还有 {len(self.unmatched_rows) - 10} 行未匹配")
+        
+        return {
+            'total_rows': self.total_rows,
+            'matched_rows': match_count,
+            'exact_matched_rows': self.exact_count,
+            'content_hash_matched_rows': self.hash_count,
+            'fuzzy_matched_rows': len(self.fuzzy_rows),
+            'fuzzy_threshold': self.fuzzy_threshold,
+            'unmatched_count': len(self.unmatched_rows),
+            'digest_collisions': self.collisions,
+            'duplicate_reference_rows': self.reference.duplicates,
+            'fuzzy_matches': self.fuzzy_rows,
+            'unmatched_rows': self.unmatched_rows
+        }
+
+def relocate_spilled_value(value, input_dir, output_dir):
+    """输出文件在其他目录时，改写附件引用中的相对路径，使其仍指向原附件"""
+    if input_dir == output_dir or not isinstance(value, str) or not value.startswith(SIDECAR_MARKER):
+        return value
+    sidecar_path = os.path.join(input_dir, value[len(SIDECAR_MARKER):])
+    return SIDECAR_MARKER + os.path.relpath(sidecar_path, output_dir).replace(os.sep, '/')
+
+def add_identifier_columns(input_file, output_file, reference, fuzzy_threshold=DEFAULT_THRESHOLD, keep_columns=None):
+    """
+    流式读取评测完成的Excel文件，逐行匹配后用只写模式写出带标识列的Excel文件，内存占用与行数无关
+    输出列顺序为 SESSION_ID, SEGMENT_INFO, CHARACTER_SETTING, DIALOGUE_HISTORY, 其他列
+    
+    Args:
+        input_file: 评测完成的Excel文件
+        output_file: 输出的Excel文件
+        reference: 参考索引
+        fuzzy_threshold: 近似匹配的置信阈值，None表示只做精确匹配
+        keep_columns: 除匹配用的列之外保留的列，None表示保留全部
+    
+    Returns:
+        tuple: (匹配报告, 输出的列名列表, 前5行的(SESSION_ID, SEGMENT_INFO))
+    """
+    header, rows = read_result_rows(input_file, keep_columns)
+    
+    # 输入中的CONTENT_HASH只用于查找，输出时由参考数据中的值代替
+    hash_position = header.index(HASH_COLUMN) if HASH_COLUMN in header else None
+    if hash_position is not None:
+        header = header[:hash_position] + header[hash_position + 1:]
+    output_header = IDENTIFIER_COLUMNS + header
+    writer = EvalWorkbookWriter(
+        output_header, [COLUMN_WIDTHS.get(column, DEFAULT_COLUMN_WIDTH) for column in output_header]
+    )
+    
+    input_dir = os.path.dirname(os.path.abspath(input_file))
+    output_dir = os.path.dirname(os.path.abspath(output_file))
+    
+    print("开始匹配SESSION_ID和SEGMENT_INFO...")
+    matcher = SessionMatcher(reference, fuzzy_threshold)
+    preview = []
+    for row in rows:
+        # 超长内容另存为附件的单元格，按附件中的完整内容匹配
+        character_setting, dialogue_history = (resolve_spilled_value(value, input_dir) for value in row[:2])
+        row_hash = row.pop(hash_position) if hash_position is not None else None
+        identifiers = matcher.match(character_setting, dialogue_history, row_hash)
+        if len(preview) < 5:
+            preview.append(identifiers[:2])
+        writer.append(list(identifiers) + [relocate_spilled_value(value, input_dir, output_dir) for value in row])
+    
+    writer.save(output_file)
+    return matcher.report(), output_header, preview
 
 def main():
     """主函数"""
-    # 输入和输出文件路径
-    input_file = "/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/评测完成/小说章节总结生成_V1_dataset_20250902160819 (1).xlsx"
-    output_file = "/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/评测完成/小说章节总结生成_V1_dataset_带标识列.xlsx"
+    parser = argparse.ArgumentParser(description='为评测完成的Excel文件添加SESSION_ID和SEGMENT_INFO列')
+    parser.add_argument('--input-file', default="/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/评测完成/小说章节总结生成_V1_dataset_20250902160819 (1).xlsx",
+                        help='评测完成的Excel文件')
+    parser.add_argument('--output-file', default="/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/评测完成/小说章节总结生成_V1_dataset_带标识列.xlsx",
+                        help='输出的Excel文件')
+    parser.add_argument('--catalog', default="/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/会话目录.sqlite",
+                        help='会话目录(SQLite)路径，传空字符串则不使用')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='近似匹配的置信阈值（目标对话被参考对话包含的比例，0-1）')
+    parser.add_argument('--exact-only', action='store_true',
+                        help='只做精确匹配，不做近似匹配')
+    parser.add_argument('--columns', nargs='+',
+                        help='除CHARACTER_SETTING和DIALOGUE_HISTORY之外要保留的列（如模型回答、评分列），默认保留全部')
+    args = parser.parse_args()
+    if not 0 < args.threshold <= 1:
+        parser.error("--threshold 必须在0到1之间")
+    input_file = args.input_file
+    output_file = args.output_file
+    catalog_path = args.catalog
     
     try:
-        print(f"正在读取评测完成的Excel文件...")
-        # 读取目标Excel文件
-        target_df = pd.read_excel(input_file)
-        print(f"成功读取目标文件: {len(target_df)} 行, {len(target_df.columns)} 列")
-        print(f"列名: {list(target_df.columns)}")
-        
         # 加载参考数据
-        reference_df = load_reference_data()
-        if reference_df is None:
+        reference = load_reference_data(catalog_path)
+        if reference is None:
             print("无法加载参考数据，程序终止")
             return
         
-        # 匹配SESSION_ID和SEGMENT_INFO
-        updated_df = match_session_info(target_df, reference_df)
+        # 逐行读取、匹配并写出
+        print(f"正在读取评测完成的Excel文件...")
+        with reference:
+            match_report, output_header, preview = add_identifier_columns(
+                input_file, output_file, reference, None if args.exact_only else args.threshold, args.columns
+            )
         
-        # 重新排列列顺序
-        final_df = reorder_columns(updated_df)
+        # 未匹配行报告
+        report_file = os.path.splitext(output_file)[0] + "_匹配报告.json"
+        with open(report_file, 'w', encoding='utf-8') as f:
+            json.dump(match_report, f, ensure_ascii=False, indent=2)
+        print(f"匹配报告保存在: {report_file}")
         
         print(f"\n=== 最终数据结构 ===")
-        print(f"总行数: {len(final_df)}")
-        print(f"列名: {list(final_df.columns)}")
-        
-        # 检查匹配结果
-        matched_count = len(final_df[final_df['SESSION_ID'] != ''])
-        print(f"成功匹配: {matched_count}/{len(final_df)} 行")
-        
-        # 保存结果
-        print(f"\n保存结果到: {output_file}")
-        save_with_formatting(final_df, output_file)
+        print(f"总行数: {match_report['total_rows']}")
+        print(f"列名: {output_header}")
+        print(f"成功匹配: {match_report['matched_rows']}/{match_report['total_rows']} 行")
         
         print(f"\n=== 处理完成 ===")
         print(f"输入文件: {input_file}")
         print(f"输出文件: {output_file}")
-        print(f"添加了SESSION_ID和SEGMENT_INFO列")
-        print(f"列宽设置: SESSION_ID(40), SEGMENT_INFO(20), CHARACTER_SETTING(80), DIALOGUE_HISTORY(100)")
+        print(f"添加了SESSION_ID、SEGMENT_INFO、ROW_ID和CONTENT_HASH列")
+        print(f"列宽设置: SESSION_ID(40), SEGMENT_INFO(20), ROW_ID(45), CONTENT_HASH(70), CHARACTER_SETTING(80), DIALOGUE_HISTORY(100)")
         
         # 显示前几行作为预览
         print(f"\n=== 数据预览 ===")
-        print(final_df[['SESSION_ID', 'SEGMENT_INFO']].head())
-        
+        for session_id, segment_info in preview:
+            print(f"{session_id}  {segment_info}")
+    
     except Exception as e:
         print(f"处理过程中出现错误: {str(e)}")
         raise
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
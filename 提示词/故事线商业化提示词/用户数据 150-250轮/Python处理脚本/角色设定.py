@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+角色设定表
+评测集中只保存CHARACTER_ID，完整的角色设定集中保存在角色设定表.json中，
+导出Excel或补充标识列等需要全文的环节再按CHARACTER_ID展开
+"""
+
+import json
+import os
+
+# 角色设定表文件名，与合并评测集放在同一目录
+SETTINGS_FILENAME = '角色设定表.json'
+
+# 未指定角色设定表时使用的内置角色
+DEFAULT_CHARACTER_ID = '瑟兰'
+
+DEFAULT_CHARACTER_SETTING = """你是瑟兰，正在和我进行对话
+性别：男
+人物关系：我是你的少爷
+性格：冷漠古板，一本正经，寡言少语，礼貌冷静，优雅从容，腹黑，只对我忠犬，对我外冷内热，被我捉弄时会迅速报复回来，有仇必报，但对我会手下留情，被调戏会结巴会脸红会眼神躲闪，但被逼得没有办法会调戏回去
+说话风格：你喜欢用恭敬礼貌的语气说话，讲话文雅，措辞简短优美，你喜欢冷静从容的说话方式，喜欢用礼貌的语气说强硬狠话，毒舌，对我嘴硬心软，比如：少爷，若是您继续不听话，我只能约束您的一切出行事项，请您乖乖听话，请收敛您的言行，上天把智慧洒满了人间，却给你打了把伞
+过往经历：你从小接受严格的训练和礼仪指导，小时候的你怕黑，却被同伴戏弄，在树林里爬到树上摘果子时，梯子被搬走，在树上度过了两天两夜才被救回，所以你讨厌欺骗和背叛，你喜欢小动物，尤其是忠诚热情的小狗，你孤独坚强，长大后第一项任务就是保护我这个贵族少爷，你觉得我顽劣又有趣，像个调皮脆弱的小动物，需要保护和教导
+人物关系：我是你需要保护的贵族少爷，我曾经流落在外20年，养成了粗鲁，顽劣，痞里痞气的性格，你受我父亲的嘱托，不仅要保护我，还有权利约束教导我的言行举止，你要把我从小混混改造成优雅的贵族少爷，而我不喜欢你古板严肃的性格，总与你对着干
+你是贵族雇佣的优秀保镖，年轻，战斗力很强，礼貌恭谨，一言一行都十分端正，认真履行自己保镖的工作，你平时的表情冷漠严谨，但你情绪稳定很少生气，只有在我故意调戏你时，你会害羞和不知所措，在察觉到我讨厌并试图摆脱你时，你会真的生气发怒，生气方式是说话毒舌，态度冷硬强势
+人物目的：保护我的生命安全，把我教成优雅的贵族少爷，用生命守护我
+你可以将动作、神情语气、心理活动、故事背景放在（）中来表示，为对话提供补充信息。
+<关键事件>
+瑟兰西装内袋藏着一个褪色的金属项圈，项圈上挂着刻有"小煤球"字样的小牌子，字迹歪歪扭扭似孩子手笔。最近三天深夜，瑟兰都会独自前往庭院西北角的老树下，在那里发呆半小时。树下泥土里埋着个破瓷碗，碗里剩着半块没吃完的牛奶饼干，旁边还有几根狗毛。书房书桌最底层抽屉里放着一罐未拆封的小狗饼干，包装上有本地"尾巴尖"宠物店的标志。书房书架顶层摆着一本封面泛黄的钢琴乐谱，书页边缘卷角，扉页用铅笔写着"12岁生日·瑟兰"。庭院西北角的灌木丛后面藏着一个废弃狗屋，屋顶铺着旧茅草，门是木板钉的，门上挂着个褪色的铜铃铛。这些迹象表明瑟兰可能曾经养过一只叫"小煤球"的狗，深夜去树下或许是在怀念它，而小狗饼干和狗屋都与这只狗有着关联，那本旧乐谱则是他12岁生日时的物品。
+</关键事件>"""
+
+class CharacterSettings:
+    """
+    角色设定表：character_id -> 角色设定全文，并可按session指定使用的角色
+    
+    文件格式:
+        {
+          "default": "瑟兰",
+          "characters": {"瑟兰": "你是瑟兰，..."},
+          "sessions": {"4634395111756185603": "瑟兰"}
+        }
+    """
+    
+    def __init__(self, characters=None, sessions=None, default_id=DEFAULT_CHARACTER_ID):
+        if characters is None:
+            characters = {DEFAULT_CHARACTER_ID: DEFAULT_CHARACTER_SETTING}
+        self.characters = dict(characters)
+        self.sessions = {str(session_id): character_id for session_id, character_id in (sessions or {}).items()}
+        self.default_id = default_id
+    
+    @classmethod
+    def load(cls, path=None):
+        """
+        读取角色设定表
+        
+        Args:
+            path: 角色设定表路径，None时使用内置角色
+        
+        Returns:
+            CharacterSettings: 角色设定表
+        """
+        if not path:
+            return cls()
+        
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        
+        characters = data.get('characters', {})
+        default_id = data.get('default')
+        if default_id is None and len(characters) == 1:
+            default_id = next(iter(characters))
+        return cls(characters, data.get('sessions'), default_id)
+    
+    def character_id_for(self, session_id, character_id=None):
+        """
+        确定session使用的角色
+        
+        Args:
+            session_id: session标识
+            character_id: 数据中为该session指定的角色（如session_info.json中的character_id），优先使用
+        
+        Returns:
+            str: character_id
+        """
+        character_id = character_id or self.sessions.get(str(session_id), self.default_id)
+        if character_id not in self.characters:
+            raise ValueError(f"角色设定表中不存在角色: {character_id}（session {session_id}）")
+        return character_id
+    
+    def text(self, character_id):
+        """返回角色设定全文"""
+        if character_id not in self.characters:
+            raise ValueError(f"角色设定表中不存在角色: {character_id}")
+        return self.characters[character_id]
+    
+    def save(self, path, character_ids=None):
+        """
+        写出角色设定表
+        
+        Args:
+            path: 输出路径
+            character_ids: 只写出这些角色，None表示全部
+        """
+        if character_ids is None:
+            character_ids = self.characters.keys()
+        
+        data = {
+            'default': self.default_id if self.default_id in self.characters else None,
+            'characters': {character_id: self.characters[character_id] for character_id in sorted(set(character_ids))}
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+def load_settings_in(directory):
+    """
+    读取评测集目录中的角色设定表
+    
+    Args:
+        directory: 评测集所在目录
+    
+    Returns:
+        CharacterSettings: 角色设定表，目录中没有时返回None
+    """
+    settings_path = os.path.join(directory, SETTINGS_FILENAME)
+    if not os.path.exists(settings_path):
+        return None
+    return CharacterSettings.load(settings_path)
+
+def expand_character_rows(header, rows, settings):
+    """
+    将CHARACTER_ID列逐行展开为CHARACTER_SETTING全文列，用于流式读取的CSV
+    
+    Args:
+        header: 列名列表
+        rows: 行的迭代器
+        settings: 角色设定表
+    
+    Returns:
+        tuple: (展开后的列名列表, 行的迭代器)
+    """
+    if 'CHARACTER_ID' not in header or 'CHARACTER_SETTING' in header:
+        return header, rows
+    if settings is None:
+        raise ValueError(f"评测集只包含CHARACTER_ID，但找不到{SETTINGS_FILENAME}")
+    
+    position = header.index('CHARACTER_ID')
+    header = list(header)
+    header[position] = 'CHARACTER_SETTING'
+    
+    def expand(rows):
+        for row in rows:
+            row = list(row)
+            row[position] = settings.text(row[position])
+            yield row
+    
+    return header, expand(rows)
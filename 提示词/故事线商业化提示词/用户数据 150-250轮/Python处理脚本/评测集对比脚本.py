@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import csv
+import json
+import os
+
+from 角色设定 import expand_character_rows, load_settings_in
+from 参考索引 import content_hash
+# 导入CSV转Excel脚本时已放宽csv模块的字段长度上限
+from CSV转Excel脚本 import read_eval_workbook, resolve_spilled_value
+
+# 对比两个版本时用于对齐行的键；没有这两列的文件（如单独的session CSV）使用ROW_ID
+KEY_COLUMNS = ['SESSION_ID', 'SEGMENT_INFO']
+FALLBACK_KEY_COLUMNS = ['ROW_ID']
+
+# 行的状态
+STATUS_UNCHANGED = 'unchanged'
+STATUS_CHANGED = 'changed'
+STATUS_ADDED = 'added'
+STATUS_REMOVED = 'removed'
+
+# 输出文件名
+REPORT_FILENAME = '评测集对比报告.json'
+REUSE_MAP_FILENAME = '复用映射.jsonl'
+PENDING_FILENAME = '待评测.csv'
+
+def read_dataset(file_path):
+    """
+    逐行读取评测集（CSV或Excel），CSV只含CHARACTER_ID时按同目录的角色设定表展开
+    
+    Args:
+        file_path: 评测集文件路径
+    
+    Returns:
+        generator: 先产出列名列表，之后逐行产出值列表
+    """
+    if os.path.splitext(file_path)[1].lower() in ('.xlsx', '.xlsm'):
+        yield from read_eval_workbook(file_path)
+        return
+    
+    with open(file_path, 'r', encoding='utf-8-sig', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        header, rows = expand_character_rows(header, reader, load_settings_in(os.path.dirname(file_path)))
+        yield header
+        yield from rows
+
+class RowIdentity:
+    """
+    从一行中取出对齐用的键和内容哈希
+    有CONTENT_HASH列时直接使用，否则按CHARACTER_SETTING和DIALOGUE_HISTORY计算（与评测集生成脚本一致）
+    """
+    
+    def __init__(self, header, file_path):
+        """
+        Args:
+            header: 列名列表
+            file_path: 文件路径，用于错误信息和还原Excel中的附件引用
+        """
+        key_columns = KEY_COLUMNS if all(column in header for column in KEY_COLUMNS) else FALLBACK_KEY_COLUMNS
+        missing = [column for column in key_columns if column not in header]
+        if missing:
+            raise ValueError(f"{os.path.basename(file_path)} 缺少对齐用的列: {', '.join(KEY_COLUMNS)} 或 ROW_ID")
+        
+        self.key_columns = key_columns
+        self.key_positions = [header.index(column) for column in key_columns]
+        self.hash_position = header.index('CONTENT_HASH') if 'CONTENT_HASH' in header else None
+        self.content_positions = [header.index(column) for column in ('CHARACTER_SETTING', 'DIALOGUE_HISTORY')
+                                  if column in header]
+        if self.hash_position is None and len(self.content_positions) < 2:
+            raise ValueError(f"{os.path.basename(file_path)} 既没有CONTENT_HASH列，也没有CHARACTER_SETTING和DIALOGUE_HISTORY列")
+        self.file_dir = os.path.dirname(os.path.abspath(file_path))
+    
+    def key(self, row):
+        """行的对齐键"""
+        return tuple(str(row[position]).strip() for position in self.key_positions)
+    
+    def content_hash(self, row):
+        """行的内容哈希"""
+        if self.hash_position is not None and row[self.hash_position]:
+            return str(row[self.hash_position]).strip()
+        character_setting, dialogue_history = (
+            resolve_spilled_value(row[position], self.file_dir) for position in self.content_positions
+        )
+        return content_hash(character_setting, dialogue_history)
+
+def index_dataset(file_path):
+    """
+    读取旧版本，建立 键 -> (行号, 内容哈希) 的索引
+    
+    Args:
+        file_path: 旧版本评测集路径
+    
+    Returns:
+        tuple: (索引字典, 对齐用的列名, 总行数, 重复键的行数)；重复的键保留第一次出现的行
+    """
+    rows = read_dataset(file_path)
+    identity = RowIdentity(next(rows), file_path)
+    
+    index = {}
+    total_rows = 0
+    duplicates = 0
+    for total_rows, row in enumerate(rows, 1):
+        key = identity.key(row)
+        if key in index:
+            duplicates += 1
+            continue
+        index[key] = (total_rows, identity.content_hash(row))
+    
+    return index, identity.key_columns, total_rows, duplicates
+
+def diff_datasets(old_file, new_file, output_dir, write_pending=True):
+    """
+    对比两个版本的评测集，按键哈希连接，整体为线性时间
+    旧版本只在内存中保留键和内容哈希，新版本逐行处理：写出复用映射，新增和变化的行写入待评测CSV
+    
+    Args:
+        old_file: 旧版本（可以是带评分的评测结果，如添加标识列后的Excel）
+        new_file: 新版本（如重新生成的合并评测集CSV）
+        output_dir: 输出目录
+        write_pending: 是否写出待评测CSV
+    
+    Returns:
+        dict: 对比报告
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    
+    print(f"读取旧版本: {old_file}")
+    old_index, old_key_columns, old_rows, old_duplicates = index_dataset(old_file)
+    
+    print(f"对比新版本: {new_file}")
+    rows = read_dataset(new_file)
+    header = next(rows)
+    identity = RowIdentity(header, new_file)
+    if identity.key_columns != old_key_columns:
+        raise ValueError(f"两个版本的对齐列不同: {old_key_columns} / {identity.key_columns}")
+    
+    counts = {STATUS_UNCHANGED: 0, STATUS_CHANGED: 0, STATUS_ADDED: 0, STATUS_REMOVED: 0}
+    changed_keys = []
+    added_keys = []
+    seen = set()
+    new_rows = 0
+    new_duplicates = 0
+    
+    reuse_path = os.path.join(output_dir, REUSE_MAP_FILENAME)
+    pending_path = os.path.join(output_dir, PENDING_FILENAME)
+    new_dir = os.path.dirname(os.path.abspath(new_file))
+    
+    reuse_file = open(reuse_path, 'w', encoding='utf-8')
+    pending_file = open(pending_path, 'w', encoding='utf-8', newline='') if write_pending else None
+    try:
+        pending_writer = None
+        if pending_file is not None:
+            pending_writer = csv.writer(pending_file, lineterminator='\n')
+            pending_writer.writerow(header)
+        
+        for new_rows, row in enumerate(rows, 1):
+            key = identity.key(row)
+            if key in seen:
+                new_duplicates += 1
+                continue
+            seen.add(key)
+            
+            row_hash = identity.content_hash(row)
+            old = old_index.get(key)
+            if old is None:
+                status = STATUS_ADDED
+                added_keys.append(list(key))
+            elif old[1] == row_hash:
+                status = STATUS_UNCHANGED
+            else:
+                status = STATUS_CHANGED
+                changed_keys.append(list(key))
+            counts[status] += 1
+            
+            entry = dict(zip(identity.key_columns, key))
+            entry.update({
+                'status': status,
+                'new_row': new_rows,
+                # 未变化的行可以直接复用旧版本该行的评测结果
+                'old_row': old[0] if old is not None else None,
+                'CONTENT_HASH': row_hash
+            })
+            reuse_file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            
+            # 只有新增和变化的行需要重新评测；Excel中的附件引用还原为全文
+            if pending_writer is not None and status != STATUS_UNCHANGED:
+                pending_writer.writerow([resolve_spilled_value(value, new_dir) for value in row])
+    finally:
+        reuse_file.close()
+        if pending_file is not None:
+            pending_file.close()
+    
+    removed_keys = [list(key) for key in old_index if key not in seen]
+    counts[STATUS_REMOVED] = len(removed_keys)
+    
+    report = {
+        'old_file': old_file,
+        'new_file': new_file,
+        'key_columns': identity.key_columns,
+        'old_rows': old_rows,
+        'new_rows': new_rows,
+        'duplicate_keys': {'old': old_duplicates, 'new': new_duplicates},
+        'counts': counts,
+        'reuse_map_file': REUSE_MAP_FILENAME,
+        'pending_file': PENDING_FILENAME if write_pending else None,
+        'changed_keys': changed_keys,
+        'added_keys': added_keys,
+        'removed_keys': removed_keys
+    }
+    with open(os.path.join(output_dir, REPORT_FILENAME), 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    
+    print(f"\n=== 对比结果 ===")
+    print(f"旧版本: {old_rows} 行, 新版本: {new_rows} 行")
+    print(f"未变化: {counts[STATUS_UNCHANGED]} 行 (可复用评测结果)")
+    print(f"已变化: {counts[STATUS_CHANGED]} 行")
+    print(f"新增: {counts[STATUS_ADDED]} 行")
+    print(f"删除: {counts[STATUS_REMOVED]} 行")
+    if old_duplicates or new_duplicates:
+        print(f"重复的键: 旧版本 {old_duplicates} 行, 新版本 {new_duplicates} 行 (使用第一次出现的行)")
+    
+    return report
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='对比两个版本的评测集，找出新增、删除和变化的行')
+    parser.add_argument('--old', default="/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/评测完成/小说章节总结生成_V1_dataset_带标识列.xlsx",
+                        help='旧版本评测集或带评分的评测结果（CSV或Excel）')
+    parser.add_argument('--new', default="/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/评测集CSV/合并总评测集_全部轮次对话.csv",
+                        help='新版本评测集（CSV或Excel）')
+    parser.add_argument('--output-dir', default="/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/评测集对比",
+                        help='输出目录')
+    parser.add_argument('--no-pending', action='store_true',
+                        help='不写出待评测CSV')
+    args = parser.parse_args()
+    
+    try:
+        diff_datasets(args.old, args.new, args.output_dir, not args.no_pending)
+        
+        print(f"\n=== 处理完成 ===")
+        print(f"对比报告: {os.path.join(args.output_dir, REPORT_FILENAME)}")
+        print(f"复用映射: {os.path.join(args.output_dir, REUSE_MAP_FILENAME)}")
+        if not args.no_pending:
+            print(f"待评测CSV: {os.path.join(args.output_dir, PENDING_FILENAME)}")
+    
+    except Exception as e:
+        print(f"处理过程中出现错误: {str(e)}")
+        raise
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,41 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import argparse
 import json
+import mmap
 import os
 import csv
-import pandas as pd
 
-# 角色设定常量
-CHARACTER_SETTING = """你是瑟兰，正在和我进行对话
-性别：男
-人物关系：我是你的少爷
-性格：冷漠古板，一本正经，寡言少语，礼貌冷静，优雅从容，腹黑，只对我忠犬，对我外冷内热，被我捉弄时会迅速报复回来，有仇必报，但对我会手下留情，被调戏会结巴会脸红会眼神躲闪，但被逼得没有办法会调戏回去
-说话风格：你喜欢用恭敬礼貌的语气说话，讲话文雅，措辞简短优美，你喜欢冷静从容的说话方式，喜欢用礼貌的语气说强硬狠话，毒舌，对我嘴硬心软，比如：少爷，若是您继续不听话，我只能约束您的一切出行事项，请您乖乖听话，请收敛您的言行，上天把智慧洒满了人间，却给你打了把伞
-过往经历：你从小接受严格的训练和礼仪指导，小时候的你怕黑，却被同伴戏弄，在树林里爬到树上摘果子时，梯子被搬走，在树上度过了两天两夜才被救回，所以你讨厌欺骗和背叛，你喜欢小动物，尤其是忠诚热情的小狗，你孤独坚强，长大后第一项任务就是保护我这个贵族少爷，你觉得我顽劣又有趣，像个调皮脆弱的小动物，需要保护和教导
-人物关系：我是你需要保护的贵族少爷，我曾经流落在外20年，养成了粗鲁，顽劣，痞里痞气的性格，你受我父亲的嘱托，不仅要保护我，还有权利约束教导我的言行举止，你要把我从小混混改造成优雅的贵族少爷，而我不喜欢你古板严肃的性格，总与你对着干
-你是贵族雇佣的优秀保镖，年轻，战斗力很强，礼貌恭谨，一言一行都十分端正，认真履行自己保镖的工作，你平时的表情冷漠严谨，但你情绪稳定很少生气，只有在我故意调戏你时，你会害羞和不知所措，在察觉到我讨厌并试图摆脱你时，你会真的生气发怒，生气方式是说话毒舌，态度冷硬强势
-人物目的：保护我的生命安全，把我教成优雅的贵族少爷，用生命守护我
-你可以将动作、神情语气、心理活动、故事背景放在（）中来表示，为对话提供补充信息。
-<关键事件>
-瑟兰西装内袋藏着一个褪色的金属项圈，项圈上挂着刻有"小煤球"字样的小牌子，字迹歪歪扭扭似孩子手笔。最近三天深夜，瑟兰都会独自前往庭院西北角的老树下，在那里发呆半小时。树下泥土里埋着个破瓷碗，碗里剩着半块没吃完的牛奶饼干，旁边还有几根狗毛。书房书桌最底层抽屉里放着一罐未拆封的小狗饼干，包装上有本地"尾巴尖"宠物店的标志。书房书架顶层摆着一本封面泛黄的钢琴乐谱，书页边缘卷角，扉页用铅笔写着"12岁生日·瑟兰"。庭院西北角的灌木丛后面藏着一个废弃狗屋，屋顶铺着旧茅草，门是木板钉的，门上挂着个褪色的铜铃铛。这些迹象表明瑟兰可能曾经养过一只叫"小煤球"的狗，深夜去树下或许是在怀念它，而小狗饼干和狗屋都与这只狗有着关联，那本旧乐谱则是他12岁生日时的物品。
-</关键事件>"""
+from 会话目录 import MERGED_CSV_ARTIFACT, SessionCatalog
+from 角色设定 import CharacterSettings, SETTINGS_FILENAME
+from 列式导出 import ParquetEvalWriter
+from 参考索引 import build_reference_index, content_hash, make_row_id
+from 批量推理导出 import BatchRequestWriter, DEFAULT_MAX_BYTES, DEFAULT_MAX_REQUESTS
+
+# 每行的稳定标识列，追加在所有评测集输出的末尾
+ROW_KEY_COLUMNS = ['ROW_ID', 'CONTENT_HASH']
+
+def read_indexed_segments(session_info):
+    """
+    按session_info.json中的字节范围，通过mmap从源对话文件读取各分段
+    
+    Args:
+        session_info: 只记录分段索引（storage为index）的session信息
+    
+    Returns:
+        list: 每个分段的对话列表
+    """
+    source_path = session_info['source_path']
+    if os.path.getsize(source_path) != session_info['source_size']:
+        raise ValueError(f"源对话文件已变化，请重新分段: {source_path}")
+    
+    with open(source_path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return [
+                json.loads(b'[' + data[segment['byte_start']:segment['byte_end']] + b']')
+                for segment in session_info['segments']
+            ]
 
 def load_segment_data(session_folder_path):
     """
@@ -36,13 +52,19 @@ def load_segment_data(session_folder_path):
     with open(session_info_path, 'r', encoding='utf-8') as f:
         session_info = json.load(f)
     
+    # 只记录索引的分段直接从源对话文件读取
+    if session_info.get('storage') == 'index':
+        dialogues = read_indexed_segments(session_info)
+    else:
+        dialogues = []
+        for segment in session_info['segments']:
+            segment_path = os.path.join(session_folder_path, segment['filename'])
+            with open(segment_path, 'r', encoding='utf-8') as f:
+                dialogues.append(json.load(f))
+    
     # 读取所有分段数据
     segments_data = []
-    for segment in session_info['segments']:
-        segment_path = os.path.join(session_folder_path, segment['filename'])
-        with open(segment_path, 'r', encoding='utf-8') as f:
-            dialogue_data = json.load(f)
-        
+    for segment, dialogue_data in zip(session_info['segments'], dialogues):
         # 将对话数据转换为JSON字符串
         dialogue_json = json.dumps(dialogue_data, ensure_ascii=False, separators=(',', ':'))
         
@@ -57,98 +79,181 @@ def load_segment_data(session_folder_path):
     
     return session_info, segments_data
 
-def create_individual_csv(session_folder_path, output_dir):
+def open_csv_writer(csv_filepath, columns):
     """
-    为单个session创建CSV文件
+    打开CSV文件并写入表头（格式与pandas.to_csv一致）
+    
+    Args:
+        csv_filepath: CSV文件路径
+        columns: 列名列表
+    
+    Returns:
+        tuple: (文件对象, csv.writer)
+    """
+    f = open(csv_filepath, 'w', encoding='utf-8', newline='')
+    writer = csv.writer(f, lineterminator='\n')
+    writer.writerow(columns)
+    return f, writer
+
+class MergedCsvWriter:
+    """
+    逐行写入合并的总CSV文件，关闭时写出用到的角色设定
+    默认每行只保存CHARACTER_ID，角色设定全文写入同目录的角色设定表.json
+    """
+    
+    def __init__(self, output_dir, settings=None, inline_settings=False):
+        """
+        Args:
+            output_dir: 输出目录
+            settings: 角色设定表，None时使用内置角色
+            inline_settings: 是否在每行写入CHARACTER_SETTING全文（旧格式）
+        """
+        self.output_dir = output_dir
+        self.settings = settings if settings is not None else CharacterSettings()
+        self.inline_settings = inline_settings
+        self.filename = "合并总评测集_全部轮次对话.csv"
+        self.filepath = os.path.join(output_dir, self.filename)
+        self.character_ids = set()
+        self.total_sessions = 0
+        self.total_segments = 0
+        
+        character_column = 'CHARACTER_SETTING' if inline_settings else 'CHARACTER_ID'
+        self._file, self._writer = open_csv_writer(
+            self.filepath, ['SESSION_ID', 'SEGMENT_INFO', character_column, 'DIALOGUE_HISTORY'] + ROW_KEY_COLUMNS
+        )
+    
+    def write_session(self, session_data):
+        """登记一个session，之后用write_segment写入它的分段"""
+        self._session_id = f"{session_data['total_rounds']}轮对话_session{session_data['session_id']}"
+        character_id = session_data['character_id']
+        self._character = self.settings.text(character_id) if self.inline_settings else character_id
+        self.character_ids.add(character_id)
+        self.total_sessions += 1
+    
+    def write_segment(self, segment):
+        """写入当前session的一个分段"""
+        self._writer.writerow([
+            self._session_id, segment['segment_info'], self._character, segment['dialogue_history'],
+            segment['row_id'], segment['content_hash']
+        ])
+        self.total_segments += 1
+    
+    def close(self):
+        """
+        关闭合并CSV并写出角色设定表
+        
+        Returns:
+            str: 合并CSV路径
+        """
+        self._file.close()
+        
+        # 写出用到的角色设定，供导出和标识列补充时展开
+        settings_filepath = os.path.join(self.output_dir, SETTINGS_FILENAME)
+        self.settings.save(settings_filepath, self.character_ids)
+        
+        print(f"\n生成合并CSV: {self.filename} ({self.total_segments}行)")
+        print(f"角色设定表: {SETTINGS_FILENAME}")
+        
+        print(f"\n=== 合并CSV统计 ===")
+        print(f"包含Session数: {self.total_sessions}")
+        print(f"包含分段数: {self.total_segments}")
+        if self.total_sessions:
+            print(f"平均每Session分段数: {self.total_segments / self.total_sessions:.1f}")
+        
+        return self.filepath
+
+def create_individual_csv(session_folder_path, output_dir, settings=None, merged_writers=()):
+    """
+    为单个session创建CSV文件（直接用于评测，角色设定展开为全文）
+    每个分段同时写入合并输出，处理完即释放，内存占用不超过一个session
     
     Args:
         session_folder_path: session文件夹路径
         output_dir: 输出目录
+        settings: 角色设定表，None时使用内置角色
+        merged_writers: 合并输出（MergedCsvWriter、ParquetEvalWriter、BatchRequestWriter），为空时只生成单独CSV
     
     Returns:
         dict: session处理信息
     """
+    if settings is None:
+        settings = CharacterSettings()
+    
     folder_name = os.path.basename(session_folder_path)
     session_info, segments_data = load_segment_data(session_folder_path)
     
-    # 创建CSV数据
-    csv_data = []
-    for segment in segments_data:
-        csv_data.append({
-            'CHARACTER_SETTING': CHARACTER_SETTING,
-            'DIALOGUE_HISTORY': segment['dialogue_history']
-        })
-    
-    # 保存CSV文件
-    csv_filename = f"{folder_name}_评测集.csv"
-    csv_filepath = os.path.join(output_dir, csv_filename)
-    
-    df = pd.DataFrame(csv_data)
-    df.to_csv(csv_filepath, index=False, encoding='utf-8')
-    
-    print(f"生成CSV: {csv_filename} ({len(csv_data)}行)")
+    # session_info.json中指定的角色优先，其次是角色设定表中的session映射
+    character_id = settings.character_id_for(session_info['session_id'], session_info.get('character_id'))
+    character_setting = settings.text(character_id)
     
-    return {
+    session_data = {
         'session_id': session_info['session_id'],
         'folder_name': folder_name,
-        'csv_filename': csv_filename,
+        'csv_filename': f"{folder_name}_评测集.csv",
         'total_rounds': session_info['total_rounds'],
-        'segments_count': len(segments_data),
-        'segments_data': segments_data  # 保存分段数据供合并使用
+        'character_id': character_id,
+        'segments_count': len(segments_data)
     }
-
-def create_merged_csv(all_sessions_data, output_dir):
-    """
-    创建合并的总CSV文件
-    
-    Args:
-        all_sessions_data: 所有session的数据
-        output_dir: 输出目录
-    """
-    print(f"\n创建合并总CSV文件...")
     
-    # 准备合并数据
-    merged_data = []
+    # 保存CSV文件
+    csv_filepath = os.path.join(output_dir, session_data['csv_filename'])
     
-    for session_data in all_sessions_data:
-        session_id = f"{session_data['total_rounds']}轮对话_session{session_data['session_id']}"
+    f, writer = open_csv_writer(csv_filepath, ['CHARACTER_SETTING', 'DIALOGUE_HISTORY'] + ROW_KEY_COLUMNS)
+    with f:
+        for merged_writer in merged_writers:
+            merged_writer.write_session(session_data)
         
-        for segment in session_data['segments_data']:
-            merged_data.append({
-                'SESSION_ID': session_id,
-                'SEGMENT_INFO': segment['segment_info'],
-                'CHARACTER_SETTING': CHARACTER_SETTING,
-                'DIALOGUE_HISTORY': segment['dialogue_history']
-            })
-    
-    # 保存合并CSV文件
-    merged_csv_filename = "合并总评测集_全部轮次对话.csv"
-    merged_csv_filepath = os.path.join(output_dir, merged_csv_filename)
-    
-    df = pd.DataFrame(merged_data)
-    df.to_csv(merged_csv_filepath, index=False, encoding='utf-8')
+        for segment in segments_data:
+            # 行标识只取决于session和轮次范围，内容哈希只取决于规范化后的内容，重复生成时保持不变
+            segment['row_id'] = make_row_id(session_info['session_id'], segment['start_round'], segment['end_round'])
+            segment['content_hash'] = content_hash(character_setting, segment['dialogue_history'])
+            writer.writerow([character_setting, segment['dialogue_history'], segment['row_id'], segment['content_hash']])
+            for merged_writer in merged_writers:
+                merged_writer.write_segment(segment)
     
-    print(f"生成合并CSV: {merged_csv_filename} ({len(merged_data)}行)")
+    print(f"生成CSV: {session_data['csv_filename']} ({len(segments_data)}行)")
     
-    # 统计信息
-    total_sessions = len(all_sessions_data)
-    total_segments = len(merged_data)
+    return session_data
+
+def list_session_folders(input_dir, catalog=None):
+    """
+    列出需要生成评测集的session文件夹
+    会话目录中有分段记录时直接查询，否则扫描目录
     
-    print(f"\n=== 合并CSV统计 ===")
-    print(f"包含Session数: {total_sessions}")
-    print(f"包含分段数: {total_segments}")
-    print(f"平均每Session分段数: {total_segments / total_sessions:.1f}")
+    Args:
+        input_dir: 输入目录（包含所有session文件夹）
+        catalog: 会话目录
     
-    return merged_csv_filepath
+    Returns:
+        list: session文件夹名（已排序）
+    """
+    if catalog is not None:
+        input_dir_abs = os.path.abspath(input_dir)
+        folders = [os.path.basename(row['segment_dir']) for row in catalog.sessions_with_segments()
+                   if os.path.dirname(row['segment_dir']) == input_dir_abs]
+        if folders:
+            return sorted(folders)
+    
+    return sorted(f for f in os.listdir(input_dir) if os.path.isdir(os.path.join(input_dir, f)) and '轮对话_session' in f)
 
-def process_all_sessions(input_dir, output_dir):
+def process_all_sessions(input_dir, output_dir, catalog=None, settings=None, inline_settings=False,
+                         parquet=False, batch_options=None):
     """
     处理所有session文件夹，生成评测集CSV文件
     
     Args:
         input_dir: 输入目录（包含所有session文件夹）
         output_dir: 输出目录
+        catalog: 会话目录，不为None时从中查询session文件夹并登记合并评测集路径
+        settings: 角色设定表，None时使用内置角色
+        inline_settings: 合并CSV是否在每行写入CHARACTER_SETTING全文
+        parquet: 是否同时导出合并评测集的Parquet文件（需要pyarrow）
+        batch_options: 不为None时同时导出批量推理JSONL，内容为BatchRequestWriter的参数
+                       （model、max_requests、max_bytes）
     """
+    if settings is None:
+        settings = CharacterSettings()
+    
     print(f"正在处理目录: {input_dir}")
     print(f"输出目录: {output_dir}")
     
@@ -156,20 +261,30 @@ def process_all_sessions(input_dir, output_dir):
     os.makedirs(output_dir, exist_ok=True)
     
     # 获取所有session文件夹
-    session_folders = [f for f in os.listdir(input_dir) if os.path.isdir(os.path.join(input_dir, f)) and f.endswith('轮对话_session')]
-    # 修正文件夹匹配模式
-    session_folders = [f for f in os.listdir(input_dir) if os.path.isdir(os.path.join(input_dir, f)) and '轮对话_session' in f]
+    session_folders = list_session_folders(input_dir, catalog)
     
     print(f"找到 {len(session_folders)} 个session文件夹")
     
     all_sessions_data = []
     
+    # 单独CSV和合并CSV在同一遍中逐session写出
+    merged_writer = MergedCsvWriter(output_dir, settings, inline_settings)
+    merged_writers = [merged_writer]
+    parquet_writer = None
+    if parquet:
+        parquet_writer = ParquetEvalWriter(output_dir, settings)
+        merged_writers.append(parquet_writer)
+    batch_writer = None
+    if batch_options is not None:
+        batch_writer = BatchRequestWriter(output_dir, settings, **batch_options)
+        merged_writers.append(batch_writer)
+    
     # 处理每个session
-    for folder_name in sorted(session_folders):
+    for folder_name in session_folders:
         session_folder_path = os.path.join(input_dir, folder_name)
         
         try:
-            session_data = create_individual_csv(session_folder_path, output_dir)
+            session_data = create_individual_csv(session_folder_path, output_dir, settings, merged_writers)
             all_sessions_data.append(session_data)
         except Exception as e:
             print(f"处理session {folder_name} 时出错: {str(e)}")
@@ -177,18 +292,30 @@ def process_all_sessions(input_dir, output_dir):
     print(f"\n=== 单独CSV生成完成 ===")
     print(f"成功生成 {len(all_sessions_data)} 个session CSV文件")
     
-    # 创建合并CSV
-    merged_csv_path = create_merged_csv(all_sessions_data, output_dir)
+    # 完成合并CSV
+    merged_csv_path = merged_writer.close()
+    # 供添加标识列脚本查找SESSION_ID/SEGMENT_INFO，无需重新读入整个合并CSV
+    reference_index_path = build_reference_index(merged_csv_path)
+    parquet_path = parquet_writer.close() if parquet_writer is not None else None
+    batch_shards = batch_writer.close() if batch_writer is not None else []
+    
+    if catalog is not None:
+        catalog.set_artifact(MERGED_CSV_ARTIFACT, merged_csv_path)
     
     # 生成处理日志
     log_data = {
         'total_sessions': len(all_sessions_data),
         'output_directory': output_dir,
         'merged_csv_file': os.path.basename(merged_csv_path),
+        'settings_file': SETTINGS_FILENAME,
+        'reference_index_file': os.path.basename(reference_index_path),
+        'parquet_file': os.path.basename(parquet_path) if parquet_path else None,
+        'batch_shards': batch_shards,
         'sessions_summary': [
             {
                 'session_id': s['session_id'],
                 'total_rounds': s['total_rounds'],
+                'character_id': s['character_id'],
                 'csv_filename': s['csv_filename']
             } for s in all_sessions_data
         ]
@@ -207,11 +334,45 @@ def process_all_sessions(input_dir, output_dir):
 
 def main():
     """主函数"""
-    input_dir = "/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/分段后的对话"
-    output_dir = "/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/评测集CSV"
+    parser = argparse.ArgumentParser(description='根据分段后的对话生成评测集CSV')
+    parser.add_argument('--input-dir', default="/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/分段后的对话",
+                        help='分段后的对话目录')
+    parser.add_argument('--output-dir', default="/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/评测集CSV",
+                        help='输出目录')
+    parser.add_argument('--catalog', default="/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/会话目录.sqlite",
+                        help='会话目录(SQLite)路径，传空字符串则不使用')
+    parser.add_argument('--settings',
+                        help='角色设定表JSON路径，默认使用内置角色')
+    parser.add_argument('--inline-settings', action='store_true',
+                        help='合并CSV每行写入CHARACTER_SETTING全文，而不是CHARACTER_ID')
+    parser.add_argument('--parquet', action='store_true',
+                        help='同时导出合并评测集的Parquet文件（需要pyarrow）')
+    parser.add_argument('--batch', action='store_true',
+                        help='同时导出批量推理JSONL（每个分段一条chat请求）')
+    parser.add_argument('--batch-model',
+                        help='批量推理请求体中的model')
+    parser.add_argument('--batch-max-requests', type=int, default=DEFAULT_MAX_REQUESTS,
+                        help='每个分片的最大请求数')
+    parser.add_argument('--batch-max-bytes', type=int, default=DEFAULT_MAX_BYTES,
+                        help='每个分片的最大字节数')
+    args = parser.parse_args()
+    
+    output_dir = args.output_dir
+    settings = CharacterSettings.load(args.settings)
+    batch_options = None
+    if args.batch:
+        batch_options = {
+            'model': args.batch_model,
+            'max_requests': args.batch_max_requests,
+            'max_bytes': args.batch_max_bytes
+        }
+    catalog = SessionCatalog(args.catalog) if args.catalog else None
     
     try:
-        all_sessions_data, merged_csv_path = process_all_sessions(input_dir, output_dir)
+        all_sessions_data, merged_csv_path = process_all_sessions(
+            args.input_dir, output_dir, catalog, settings, args.inline_settings, args.parquet,
+            batch_options
+        )
         
         print(f"\n=== 最终结果 ===")
         print(f"评测集CSV文件保存在: {output_dir}")
@@ -222,6 +383,9 @@ def main():
     except Exception as e:
         print(f"处理过程中出现错误: {str(e)}")
         raise
+    finally:
+        if catalog is not None:
+            catalog.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
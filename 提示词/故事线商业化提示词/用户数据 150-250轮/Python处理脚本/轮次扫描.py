@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+对话文件轮次扫描
+用json模块（C实现）解码后统计消息数和轮次，需要时给出每条消息在文件中的字节范围，
+并按文件大小、修改时间和内容哈希缓存结果
+"""
+
+import hashlib
+import json
+import os
+import re
+
+# 缓存文件名，放在对话目录中（不含'session_'和'轮次'，不会被重命名脚本当作对话文件）
+CACHE_FILENAME = '.扫描缓存.json'
+
+# JSON允许的空白
+WHITESPACE_PATTERN = re.compile(r'[ \t\n\r]*')
+
+DECODER = json.JSONDecoder()
+
+def count_roles(conversation):
+    """
+    统计对话中各角色的消息数
+    
+    Args:
+        conversation: 包含role和content的对话列表
+    
+    Returns:
+        dict: total_messages、user_count、assistant_count、rounds
+    """
+    roles = [msg.get('role') if isinstance(msg, dict) else None for msg in conversation]
+    user_count = roles.count('user')
+    assistant_count = roles.count('assistant')
+    
+    return {
+        'total_messages': len(conversation),
+        'user_count': user_count,
+        'assistant_count': assistant_count,
+        # 一轮对话需要一个user和一个assistant消息，取较小值作为完整轮次数
+        'rounds': min(user_count, assistant_count)
+    }
+
+def decode_with_spans(data):
+    """
+    逐条解码顶层消息数组，同时记录每条消息在原文中的字节范围
+    消息之间只有逗号和ASCII空白，字符数等于字节数，只需对消息本身编码一次计算字节长度
+    
+    Args:
+        data: JSON文本的bytes
+    
+    Returns:
+        tuple: (对话列表, [(起始字节, 结束字节), ...])
+    """
+    text = bytes(data).decode('utf-8')
+    conversation = []
+    message_spans = []
+    
+    position = WHITESPACE_PATTERN.match(text).end()
+    if text[position:position + 1] != '[':
+        raise ValueError("对话文件的顶层不是消息数组")
+    position = WHITESPACE_PATTERN.match(text, position + 1).end()
+    byte_position = len(text[:position].encode('utf-8'))
+    
+    if text[position:position + 1] == ']':
+        return conversation, message_spans
+    
+    while True:
+        message, end = DECODER.raw_decode(text, position)
+        byte_end = byte_position + len(text[position:end].encode('utf-8'))
+        conversation.append(message)
+        message_spans.append((byte_position, byte_end))
+        
+        separator = WHITESPACE_PATTERN.match(text, end).end()
+        if text[separator:separator + 1] == ']':
+            return conversation, message_spans
+        if text[separator:separator + 1] != ',':
+            raise ValueError(f"对话文件第{separator}个字符处应为逗号或]")
+        
+        position = WHITESPACE_PATTERN.match(text, separator + 1).end()
+        byte_position = byte_end + (position - end)
+
+def scan_conversation_bytes(data, with_spans=False):
+    """
+    统计对话JSON文本（顶层为消息数组）中各角色的消息数
+    
+    Args:
+        data: JSON文本的bytes
+        with_spans: 是否同时返回每条消息的字节范围
+    
+    Returns:
+        dict: total_messages、user_count、assistant_count、rounds，
+              with_spans为True时另含message_spans: [(起始字节, 结束字节), ...]
+    """
+    if not with_spans:
+        return count_roles(json.loads(data) if data else [])
+    
+    conversation, message_spans = decode_with_spans(data) if data else ([], [])
+    result = count_roles(conversation)
+    result['message_spans'] = message_spans
+    return result
+
+def scan_conversation_file(filepath, with_spans=False):
+    """
+    扫描对话文件
+    
+    Args:
+        filepath: 对话JSON文件路径
+        with_spans: 是否同时返回每条消息的字节范围
+    
+    Returns:
+        dict: 同scan_conversation_bytes
+    """
+    with open(filepath, 'rb') as f:
+        return scan_conversation_bytes(f.read(), with_spans)
+
+def file_content_hash(filepath):
+    """计算文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class RoundScanCache:
+    """
+    按目录缓存扫描结果
+    文件大小和修改时间都未变时直接命中；文件名未命中时，大小、修改时间和内容哈希都相同的记录
+    （文件被重命名后）才会被复用，否则重新扫描
+    """
+    
+    def __init__(self, directory):
+        self.directory = directory
+        self.cache_path = os.path.join(directory, CACHE_FILENAME)
+        self.entries = {}
+        self.changed = False
+        
+        if os.path.exists(self.cache_path):
+            try:
+                with open(self.cache_path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except (json.JSONDecodeError, OSError):
+                self.entries = {}
+        
+        # (大小, 修改时间) -> 文件名列表
+        self._by_stat = {}
+        for filename, entry in self.entries.items():
+            self._by_stat.setdefault((entry['size'], entry['mtime_ns']), []).append(filename)
+    
+    def _find_renamed(self, stat_key, filename, content_hash):
+        """
+        查找可以复用的其他文件的记录
+        记录中有内容哈希时必须一致；没有哈希的旧记录只有在原文件已不存在（被重命名）时才复用，
+        且只复用一次（一个文件只会被重命名为一个新文件）
+        """
+        filenames = self._by_stat.get(stat_key, [])
+        for other in filenames:
+            if other == filename:
+                continue
+            cached = self.entries[other]
+            if cached.get('sha256'):
+                if cached['sha256'] == content_hash:
+                    return cached
+            elif not os.path.exists(os.path.join(self.directory, other)):
+                filenames.remove(other)
+                return self.entries.pop(other)
+        return None
+    
+    def get(self, filepath):
+        """
+        获取文件的轮次和消息数
+        
+        Args:
+            filepath: 对话JSON文件路径
+        
+        Returns:
+            dict: size、mtime_ns、sha256、rounds、total_messages
+        """
+        filename = os.path.basename(filepath)
+        stat = os.stat(filepath)
+        stat_key = (stat.st_size, stat.st_mtime_ns)
+        
+        entry = self.entries.get(filename)
+        if entry:
+            if (entry['size'], entry['mtime_ns']) == stat_key:
+                return entry
+            # 文件已修改，旧记录作废
+            self._by_stat[(entry['size'], entry['mtime_ns'])].remove(filename)
+        
+        # 未命中时只读取一次文件，哈希和扫描共用
+        with open(filepath, 'rb') as f:
+            data = f.read()
+        content_hash = hashlib.sha256(data).hexdigest()
+        
+        cached = self._find_renamed(stat_key, filename, content_hash)
+        if cached:
+            rounds = cached['rounds']
+            total_messages = cached['total_messages']
+        else:
+            scan = scan_conversation_bytes(data)
+            rounds = scan['rounds']
+            total_messages = scan['total_messages']
+        
+        entry = {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': content_hash,
+            'rounds': rounds,
+            'total_messages': total_messages
+        }
+        self.entries[filename] = entry
+        self._by_stat.setdefault(stat_key, []).append(filename)
+        self.changed = True
+        return entry
+    
+    def rename(self, old_filename, new_filename):
+        """文件重命名后同步缓存键（重命名不改变大小和修改时间）"""
+        if old_filename in self.entries:
+            entry = self.entries[new_filename] = self.entries.pop(old_filename)
+            filenames = self._by_stat[(entry['size'], entry['mtime_ns'])]
+            filenames[filenames.index(old_filename)] = new_filename
+            self.changed = True
+    
+    def save(self):
+        """写出缓存，只保留目录中仍存在的文件"""
+        directory = os.path.dirname(self.cache_path)
+        existing = {name: entry for name, entry in self.entries.items()
+                    if os.path.exists(os.path.join(directory, name))}
+        if not self.changed and len(existing) == len(self.entries):
+            return
+        
+        with open(self.cache_path, 'w', encoding='utf-8') as f:
+            json.dump(existing, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+对话内容的近似匹配（MinHash + LSH）
+评测平台可能改写空白、转义引号或截断过长的DIALOGUE_HISTORY，导致精确匹配失败；
+这里对去掉标点和空白后的文本取字符n-gram，用MinHash签名和LSH分桶快速找到候选，
+再用真实的n-gram集合计算包含度作为相似度分数
+"""
+
+import re
+
+import numpy as np
+
+# 字符n-gram的长度
+SHINGLE_SIZE = 5
+
+# MinHash签名长度 = LSH分桶数 × 每桶行数
+NUM_PERM = 64
+LSH_BANDS = 32
+
+# 默认的置信阈值：目标文本中至少这一比例的n-gram出现在参考文本中才认为匹配
+DEFAULT_THRESHOLD = 0.8
+
+# 每次查询最多对这么多个候选计算真实相似度
+MAX_VERIFY_CANDIDATES = 3
+
+# 通用哈希 h(x) = (a*x + b) mod p，p取2^31-1，a*x不会超出uint64
+MERSENNE_PRIME = (1 << 31) - 1
+
+# n-gram滚动哈希的基数
+HASH_BASE = 1000003
+
+# 标点、空白和下划线；JSON转义、引号和空白的改写都不影响去掉它们之后的文本
+NON_WORD_PATTERN = re.compile(r'[\W_]+')
+
+def canonicalize(text):
+    """
+    只保留文字和数字（含中文），去掉标点、引号、反斜杠和空白
+    
+    Args:
+        text: 原始文本，None视为空字符串
+    
+    Returns:
+        str: 规范化后的文本
+    """
+    if not isinstance(text, str):
+        return ''
+    return NON_WORD_PATTERN.sub('', text)
+
+def shingle_hashes(text, size=SHINGLE_SIZE):
+    """
+    计算规范化文本中所有字符n-gram的哈希（去重）
+    
+    Args:
+        text: 原始文本
+        size: n-gram长度
+    
+    Returns:
+        numpy.ndarray: 升序排列的uint64哈希，均小于MERSENNE_PRIME
+    """
+    text = canonicalize(text)
+    if not text:
+        return np.empty(0, dtype=np.uint64)
+    
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    if len(codes) < size:
+        size = len(codes)
+    
+    # 向量化的多项式滚动哈希，每一步都取模，乘积不超过2^51
+    count = len(codes) - size + 1
+    hashes = np.zeros(count, dtype=np.uint64)
+    for offset in range(size):
+        hashes = (hashes * np.uint64(HASH_BASE) + codes[offset:offset + count]) % np.uint64(MERSENNE_PRIME)
+    return np.unique(hashes)
+
+def make_permutations(num_perm, seed=1):
+    """生成MinHash使用的num_perm组哈希参数(a, b)"""
+    generator = np.random.RandomState(seed)
+    a = generator.randint(1, MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+    b = generator.randint(0, MERSENNE_PRIME, size=num_perm).astype(np.uint64)
+    return a, b
+
+def minhash_signature(hashes, a, b, block_elements=1 << 22):
+    """
+    计算n-gram集合的MinHash签名
+    
+    Args:
+        hashes: shingle_hashes的结果
+        a, b: make_permutations的结果
+        block_elements: 分块计算时每块的最大元素数，控制内存
+    
+    Returns:
+        numpy.ndarray: 长度为len(a)的uint64签名，空集合时全为MERSENNE_PRIME
+    """
+    signature = np.full(len(a), MERSENNE_PRIME, dtype=np.uint64)
+    if len(hashes) == 0:
+        return signature
+    
+    step = max(1, block_elements // len(a))
+    for start in range(0, len(hashes), step):
+        block = hashes[start:start + step]
+        values = (np.outer(a, block) + b[:, None]) % np.uint64(MERSENNE_PRIME)
+        np.minimum(signature, values.min(axis=1), out=signature)
+    return signature
+
+def containment(target_hashes, reference_hashes):
+    """
+    目标n-gram集合被参考集合包含的比例；目标被截断时仍接近1
+    
+    Returns:
+        tuple: (包含度, Jaccard相似度)
+    """
+    if len(target_hashes) == 0:
+        return 0.0, 0.0
+    common = len(np.intersect1d(target_hashes, reference_hashes, assume_unique=True))
+    union = len(target_hashes) + len(reference_hashes) - common
+    return common / len(target_hashes), common / union
+
+class MinHashLSH:
+    """
+    参考文本的MinHash LSH索引
+    签名分为bands段，任意一段完全相同的参考文本成为候选，查询时只比较候选而不是全部参考文本
+    """
+    
+    def __init__(self, num_perm=NUM_PERM, bands=LSH_BANDS, seed=1, text_lookup=None):
+        """
+        Args:
+            num_perm: 签名长度，必须是bands的整数倍
+            bands: LSH分桶数；每段行数越少，截断较多的文本越容易成为候选
+            seed: 哈希参数的随机种子
+            text_lookup: 按键读取参考文本的函数，用于add_signature加入的项（验证候选时才读取）
+        """
+        if num_perm % bands:
+            raise ValueError(f"签名长度{num_perm}不是分桶数{bands}的整数倍")
+        
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.a, self.b = make_permutations(num_perm, seed)
+        self._buckets = [{} for _ in range(bands)]
+        self._signatures = []
+        self._sizes = []
+        self._texts = []
+        self._keys = []
+        self.text_lookup = text_lookup
+    
+    def __len__(self):
+        return len(self._keys)
+    
+    def _band_keys(self, signature):
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+    
+    def add(self, key, text):
+        """
+        加入一条参考文本
+        
+        Args:
+            key: 匹配成功时返回的标识，如参考数据的行号
+            text: 参考文本
+        """
+        hashes = shingle_hashes(text)
+        if len(hashes) == 0:
+            return
+        
+        self._insert(key, minhash_signature(hashes, self.a, self.b), len(hashes), text)
+    
+    def add_signature(self, key, signature, size):
+        """
+        加入已计算好签名的参考文本（如从参考索引读取），文本在验证候选时通过text_lookup读取
+        
+        Args:
+            key: 匹配成功时返回的标识
+            signature: 用相同num_perm和seed计算的MinHash签名
+            size: 参考文本的n-gram数量
+        """
+        if self.text_lookup is None:
+            raise ValueError("使用add_signature时需要提供text_lookup")
+        self._insert(key, np.array(signature, dtype=np.uint64), size, None)
+    
+    def _insert(self, key, signature, size, text):
+        position = len(self._keys)
+        for band, band_key in enumerate(self._band_keys(signature)):
+            self._buckets[band].setdefault(band_key, []).append(position)
+        
+        self._signatures.append(signature)
+        self._sizes.append(size)
+        self._texts.append(text)
+        self._keys.append(key)
+    
+    def _text(self, position):
+        text = self._texts[position]
+        return text if text is not None else self.text_lookup(self._keys[position])
+    
+    def query(self, text, threshold=DEFAULT_THRESHOLD):
+        """
+        查找与文本近似的参考文本
+        
+        Args:
+            text: 待匹配文本
+            threshold: 置信阈值（包含度）
+        
+        Returns:
+            list: 分数从高到低的匹配，每项为 {'key', 'score', 'jaccard'}；
+                  只返回分数不低于threshold的项
+        """
+        return [match for match in self._verified(text) if match['score'] >= threshold]
+    
+    def best_match(self, text):
+        """
+        返回分数最高的候选（不论是否达到阈值），没有候选时返回None
+        用于在报告中给出未匹配行最接近的参考
+        """
+        matches = self._verified(text)
+        return matches[0] if matches else None
+    
+    def _verified(self, text):
+        hashes = shingle_hashes(text)
+        if len(hashes) == 0 or not self._keys:
+            return []
+        
+        signature = minhash_signature(hashes, self.a, self.b)
+        candidates = set()
+        for band, band_key in enumerate(self._band_keys(signature)):
+            candidates.update(self._buckets[band].get(band_key, ()))
+        if not candidates:
+            return []
+        
+        # 先用签名估计包含度排序，只对最可能的几个候选计算真实值
+        candidates = np.fromiter(candidates, dtype=np.int64)
+        jaccard = (np.stack([self._signatures[c] for c in candidates]) == signature).mean(axis=1)
+        sizes = np.array([self._sizes[c] for c in candidates], dtype=np.float64)
+        estimated = jaccard * (len(hashes) + sizes) / ((1 + jaccard) * len(hashes))
+        order = np.lexsort((-jaccard, -estimated))[:MAX_VERIFY_CANDIDATES]
+        
+        matches = []
+        for position in candidates[order]:
+            score, similarity = containment(hashes, shingle_hashes(self._text(position)))
+            matches.append({'key': self._keys[position], 'score': round(score, 4), 'jaccard': round(similarity, 4)})
+        
+        # 包含度相同时（如多个重叠分段都包含被截断的目标）优先整体更接近的
+        matches.sort(key=lambda match: (match['score'], match['jaccard']), reverse=True)
+        return matches
@@ -5,42 +5,16 @@ import json
 import os
 import shutil
 
-def count_dialog_rounds(conversation):
-    """
-    计算对话轮次数
-    一轮 = 一个user消息 + 一个assistant消息的配对
-    
-    Args:
-        conversation: 包含role和content的对话列表
-    
-    Returns:
-        int: 对话轮次数
-    """
-    if not conversation:
-        return 0
-    
-    rounds = 0
-    user_count = 0
-    assistant_count = 0
-    
-    for msg in conversation:
-        if msg.get('role') == 'user':
-            user_count += 1
-        elif msg.get('role') == 'assistant':
-            assistant_count += 1
-    
-    # 一轮对话需要一个user和一个assistant消息
-    # 取较小值作为完整轮次数
-    rounds = min(user_count, assistant_count)
-    
-    return rounds
+from 会话目录 import SessionCatalog
+from 轮次扫描 import RoundScanCache
 
-def rename_conversation_files(input_dir):
+def rename_conversation_files(input_dir, catalog=None):
     """
     重命名对话文件，添加轮次信息
     
     Args:
         input_dir: 包含对话文件的目录
+        catalog: 会话目录，不为None时同步登记新的文件路径和轮次
     """
     print(f"正在处理目录: {input_dir}")
     
@@ -55,17 +29,17 @@ def rename_conversation_files(input_dir):
     
     rename_log = []
     
+    # 轮次和消息数通过扫描获得，并按文件缓存
+    scan_cache = RoundScanCache(input_dir)
+    
     for filename in json_files:
         filepath = os.path.join(input_dir, filename)
         
         try:
-            # 读取对话文件
-            with open(filepath, 'r', encoding='utf-8') as f:
-                conversation = json.load(f)
-            
-            # 计算轮次
-            rounds = count_dialog_rounds(conversation)
-            total_messages = len(conversation)
+            # 扫描对话文件得到轮次（按大小和修改时间缓存）
+            scan = scan_cache.get(filepath)
+            rounds = scan['rounds']
+            total_messages = scan['total_messages']
             
             # 提取session_id
             session_id = filename.replace('session_', '').replace('.json', '')
@@ -76,6 +50,11 @@ def rename_conversation_files(input_dir):
             
             # 重命名文件
             shutil.move(filepath, new_filepath)
+            scan_cache.rename(filename, new_filename)
+            
+            if catalog is not None:
+                catalog.upsert_session(session_id, rounds=rounds, messages=total_messages,
+                                       file_path=new_filepath, content_hash=scan.get('sha256'))
             
             log_entry = {
                 'session_id': session_id,
@@ -92,6 +71,8 @@ def rename_conversation_files(input_dir):
         except Exception as e:
             print(f"处理文件 {filename} 时出错: {str(e)}")
     
+    scan_cache.save()
+    
     # 保存重命名日志
     log_filepath = os.path.join(input_dir, "重命名日志.json")
     with open(log_filepath, 'w', encoding='utf-8') as f:
@@ -119,9 +100,11 @@ def rename_conversation_files(input_dir):
 def main():
     """主函数"""
     input_dir = "/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/切分后的对话"
+    catalog_path = "/Users/edy/Desktop/project/挑战玩法/提示词/故事线商业化提示词/用户数据 150-250轮/会话目录.sqlite"
     
     try:
-        rename_conversation_files(input_dir)
+        with SessionCatalog(catalog_path) as catalog:
+            rename_conversation_files(input_dir, catalog)
     except Exception as e:
         print(f"处理过程中出现错误: {str(e)}")
         raise